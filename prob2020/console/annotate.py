@@ -21,15 +21,18 @@ import numpy as np
 import pandas as pd
 import pysam
 import csv
+import shutil
 from multiprocessing import Pool
 import argparse
 import logging
 import copy
 import itertools as it
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)  # module logger
 
-def multiprocess_permutation(bed_dict, mut_df, opts, indel_df=None):
+def multiprocess_permutation(bed_dict, mut_df, opts, indel_df=None,
+                             gene_index=None):
     """Handles parallelization of permutations by splitting work
     by chromosome.
     """
@@ -39,6 +42,8 @@ def multiprocess_permutation(bed_dict, mut_df, opts, indel_df=None):
         num_processes = opts['processes']
     else:
         num_processes = 1
+    if gene_index is None:
+        mut_df, gene_index = utils.index_mutations_by_gene(mut_df)
     file_handle = open(opts['output'], 'w')
     mywriter = csv.writer(file_handle, delimiter='\t', lineterminator='\n')
     if opts['maf'] and opts['num_iterations']:
@@ -91,34 +96,40 @@ def multiprocess_permutation(bed_dict, mut_df, opts, indel_df=None):
                 fs_cts[0, ix] = 0 if mygene not in fs_cts_dict else fs_cts_dict[mygene]
                 inframe_cts[0, ix] = indel_cts_dict[mygene] - fs_cts[0, ix]
 
+    # simulated MAF lines are written out by each process and then
+    # concatenated, rather than being held in memory
+    sim_maf_flag = opts['maf'] and num_iterations
+
     # simulate snvs
-    obs_result = []
     for i in range(0, len(chroms), num_processes):
         if multiprocess_flag:
             pool = Pool(processes=num_processes)
             tmp_num_proc = len(chroms) - i if i + num_processes > len(chroms) else num_processes
-            info_repeat = ((bed_dict[chroms[tmp_ix]], mut_df, opts)
-                            for tmp_ix in range(i, i+tmp_num_proc))
-            process_results = pool.imap(singleprocess_permutation, info_repeat)
+            info_repeat = ((bed_dict[chroms[tmp_ix]],
+                            utils.select_gene_mutations(mut_df, bed_dict[chroms[tmp_ix]], gene_index),
+                            opts)
+                           for tmp_ix in range(i, i+tmp_num_proc))
+            if sim_maf_flag:
+                info_repeat = (info + ('{0}.{1}.tmp'.format(opts['output'], info[0][0].chrom),)
+                               for info in info_repeat)
+                process_results = pool.imap(singleprocess_maf_permutation, info_repeat)
+            else:
+                process_results = pool.imap(singleprocess_permutation, info_repeat)
             process_results.next = utils.keyboard_exit_wrapper(process_results.next)
             try:
                 # iterate through each chromosome result
                 for chrom_result in process_results:
+                    # copy over simulated MAF lines
+                    if sim_maf_flag:
+                        with open(chrom_result) as tmp_handle:
+                            shutil.copyfileobj(tmp_handle, file_handle)
+                        os.remove(chrom_result)
+                        continue
+
                     # add columns for indels
                     if opts['summary']:
-                        tmp_chrom_result = []
-                        for gname, grp in it.groupby(chrom_result, lambda x: x[0]):
-                            for l, row in enumerate(grp):
-                                gene_ix = name2ix[gname]
-                                fs_count = fs_cts[l, gene_ix]
-                                inframe_count = inframe_cts[l, gene_ix]
-                                missense_pos_ct = list(row.pop(-1).values())  # missense codon counts
-                                silent_pos_ct = [1 for l in range(row[4])]
-                                inactivating_ct = sum(row[5:9]) + fs_count
-                                tmp_count_list = missense_pos_ct + silent_pos_ct + [inactivating_ct, inframe_count]
-                                norm_ent = math.normalized_mutation_entropy(tmp_count_list)
-                                tmp_chrom_result.append(row+[fs_count, inframe_count, norm_ent])
-                        chrom_result = tmp_chrom_result
+                        chrom_result = _summary_rows(chrom_result, header, name2ix,
+                                                     fs_cts, inframe_cts)
 
                     # write output to file
                     mywriter.writerows(chrom_result)
@@ -131,44 +142,136 @@ def multiprocess_permutation(bed_dict, mut_df, opts, indel_df=None):
             pool.join()
         else:
             # perform simulation
-            info = (bed_dict[chroms[i]], mut_df, opts)
+            info = (bed_dict[chroms[i]],
+                    utils.select_gene_mutations(mut_df, bed_dict[chroms[i]], gene_index),
+                    opts)
+
+            # write MAF lines as they are simulated
+            if sim_maf_flag:
+                for maf_lines in _gene_results(*info):
+                    mywriter.writerows(maf_lines)
+                continue
+
             chrom_results = singleprocess_permutation(info)
 
             # add indel columns
             if opts['summary']:
-                tmp_chrom_result = []
-                for gname, grp in it.groupby(chrom_results, lambda x: x[0]):
-                    for l, row in enumerate(grp):
-                        gene_ix = name2ix[gname]
-                        fs_count = fs_cts[l, gene_ix]
-                        inframe_count = inframe_cts[l, gene_ix]
-                        missense_pos_ct = list(row.pop(-1).values())  # missense codon counts
-                        silent_pos_ct = [1 for l in range(row[4])]
-                        inactivating_ct = sum(row[5:9]) + fs_count
-                        tmp_count_list = missense_pos_ct + silent_pos_ct + [inactivating_ct, inframe_count]
-                        norm_ent = math.normalized_mutation_entropy(tmp_count_list)
-                        tmp_chrom_result.append(row+[fs_count, inframe_count, norm_ent])
-                chrom_results = tmp_chrom_result
+                chrom_results = _summary_rows(chrom_results, header, name2ix,
+                                              fs_cts, inframe_cts)
 
             # write to file
             mywriter.writerows(chrom_results)
     file_handle.close()
 
 
+def _summary_rows(chrom_result, header, name2ix, fs_cts, inframe_cts):
+    """Adds indel columns to the columnar summary of each gene and
+    converts them to rows for output.
+
+    Parameters
+    ----------
+    chrom_result : list
+        summary columns and missense position counts for each gene, as
+        returned by permutation.summary_permutation
+    header : list
+        output columns
+    name2ix : dict
+        maps gene names to columns of fs_cts and inframe_cts
+    fs_cts : np.array
+        frameshift counts for each permutation (rows) and gene (columns)
+    inframe_cts : np.array
+        inframe indel counts for each permutation (rows) and gene (columns)
+
+    Returns
+    -------
+    rows : list of lists
+        output rows
+    """
+    rows = []
+    for summary_info, missense_pos_ct in chrom_result:
+        num_rows = len(summary_info['ID'])
+        gene_ix = name2ix[summary_info['Gene'][0]]
+        fs_count = fs_cts[:num_rows, gene_ix]
+        inframe_count = inframe_cts[:num_rows, gene_ix]
+        summary_info['frameshift indel'] = fs_count
+        summary_info['inframe indel'] = inframe_count
+
+        # mutation counts are the missense codon counts, each silent
+        # mutation, all inactivating mutations and the inframe indels
+        pos_ct, offsets = missense_pos_ct
+        pos_row_ix = np.repeat(np.arange(num_rows), np.diff(offsets))
+        inactivating_ct = (summary_info['nonsense'] + summary_info['lost stop'] +
+                           summary_info['splice site'] + summary_info['lost start'] +
+                           fs_count)
+        summary_info['normalized mutation entropy'] = math.normalized_mutation_entropy_batch(
+            pos_ct, pos_row_ix, summary_info['silent snv'],
+            [inactivating_ct, inframe_count])
+
+        rows.extend(zip(*[summary_info[col].tolist() for col in header]))
+    return rows
+
+
+def _summary_info_columns(bed, summary_list, score_dir):
+    """Converts the output of cutils.calc_summary_info for the observed
+    mutations into the columnar format of permutation.summary_permutation.
+    """
+    summary_info = OrderedDict()
+    summary_info['Gene'] = np.array([bed.gene_name], dtype=object)
+    summary_info['ID'] = np.array(['NA'], dtype=object)
+    summary_info['gene length'] = np.array([bed.cds_len])
+    cols = pm.summary_count_cols + ['recurrent missense',
+                                    'normalized missense position entropy']
+    if score_dir:
+        cols += ['Total Missense MGAEntropy', 'Total Missense VEST Score']
+    for col, val in zip(cols, summary_list[:-1]):
+        summary_info[col] = np.array([val])
+
+    # missense codon counts
+    pos_ct = np.array(list(summary_list[-1].values()), dtype=int)
+    missense_pos_ct = (pos_ct, np.array([0, len(pos_ct)]))
+    return summary_info, missense_pos_ct
+
+
 @utils.log_error_decorator
 def singleprocess_permutation(info):
     bed_list, mut_df, opts = info
+    result = []
+    for gene_result in _gene_results(bed_list, mut_df, opts):
+        result += gene_result
+    return result
+
+
+@utils.log_error_decorator
+def singleprocess_maf_permutation(info):
+    """Writes the simulated MAF lines of a chromosome to a temporary file,
+    so that the lines are not all returned through the pool at once.
+    """
+    bed_list, mut_df, opts, tmp_path = info
+    with open(tmp_path, 'w') as handle:
+        mywriter = csv.writer(handle, delimiter='\t', lineterminator='\n')
+        for maf_lines in _gene_results(bed_list, mut_df, opts):
+            mywriter.writerows(maf_lines)
+    return tmp_path
+
+
+def _gene_results(bed_list, mut_df, opts):
+    """Generates the output lines for each gene on a chromosome.
+
+    Simulated MAF lines are generated in blocks of permutations, so a
+    single gene may produce several lists of lines.
+    """
     current_chrom = bed_list[0].chrom
     logger.info('Working on chromosome: {0} . . .'.format(current_chrom))
     num_iterations = opts['num_iterations']
     gene_fa = pysam.Fastafile(opts['input'])
     gs = GeneSequence(gene_fa, nuc_context=opts['context'])
+    mut_df, gene_index = utils.index_mutations_by_gene(mut_df)
 
     # go through each gene to perform simulation
-    result = []
     for bed in bed_list:
         # compute context counts and somatic bases for each context
-        gene_tuple = mc.compute_mutation_context(bed, gs, mut_df, opts)
+        gene_tuple = mc.compute_mutation_context(bed, gs, mut_df, opts,
+                                                 gene_index=gene_index)
         context_cts, context_to_mutations, mutations_df, gs, sc = gene_tuple
 
         if context_to_mutations:
@@ -185,7 +288,7 @@ def singleprocess_permutation(info):
                                                       opts['score_dir'],
                                                       min_frac=opts['fraction'],
                                                       min_recur=opts['recurrent'])
-                tmp_result = [[bed.gene_name, 'NA', bed.cds_len] + tmp_result]
+                tmp_result = [_summary_info_columns(bed, tmp_result, opts['score_dir'])]
             ## Just record protein changes in MAF
             elif opts['maf'] and not num_iterations:
                 # input code for just annotating genes mutations
@@ -200,27 +303,28 @@ def singleprocess_permutation(info):
             elif opts['maf']:
                 # if user specified MAF format then output all mutations in
                 # MAF format
-                tmp_result = pm.maf_permutation(context_cts,
-                                                context_to_mutations,
-                                                sc,
-                                                gs,
-                                                num_iterations)
+                for maf_lines in pm.maf_permutation_blocks(context_cts,
+                                                           context_to_mutations,
+                                                           sc,
+                                                           gs,
+                                                           num_iterations):
+                    yield maf_lines
+                continue
             else:
                 # Summarized results for feature for each simulation for each
                 # gene
-                tmp_result = pm.summary_permutation(context_cts,
-                                                    context_to_mutations,
-                                                    sc,  # sequence context obj
-                                                    gs,  # gene sequence obj
-                                                    opts['score_dir'],
-                                                    num_iterations,
-                                                    min_frac=opts['fraction'],
-                                                    min_recur=opts['recurrent'])
-            result += tmp_result
+                tmp_result = [pm.summary_permutation(context_cts,
+                                                     context_to_mutations,
+                                                     sc,  # sequence context obj
+                                                     gs,  # gene sequence obj
+                                                     opts['score_dir'],
+                                                     num_iterations,
+                                                     min_frac=opts['fraction'],
+                                                     min_recur=opts['recurrent'])]
+            yield tmp_result
 
     gene_fa.close()
     logger.info('Finished working on chromosome: {0}.'.format(current_chrom))
-    return result
 
 
 def parse_arguments():
@@ -388,12 +492,14 @@ def main(opts):
 
     # select valid single nucleotide variants only
     mut_df = utils._fix_mutation_df(mut_df, opts['unique'])
+    mut_df, gene_index = utils.index_mutations_by_gene(mut_df)
 
     # read in bed info
     bed_dict = utils.read_bed(opts['bed'], [])
 
     # perform permutation
-    multiprocess_permutation(bed_dict, mut_df, opts, indel_df)
+    multiprocess_permutation(bed_dict, mut_df, opts, indel_df,
+                             gene_index=gene_index)
 
     # save indels
     if opts['maf']:
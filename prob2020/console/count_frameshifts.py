@@ -18,20 +18,20 @@ def count_frameshifts(mut_df,
                       use_unmapped=False):
     fs_cts = {}  # frameshift count information for each gene
     fs_df = indel.keep_frameshifts(mut_df)
+    fs_df, gene_index = utils.index_mutations_by_gene(fs_df)
     fs_lens = indel.get_frameshift_lengths(num_bins)
 
     for bed in utils.bed_generator(bed_path):
-        gene_df = fs_df[fs_df['Gene']==bed.gene_name]
+        gene_df = utils.get_gene_mutations(fs_df, gene_index, bed.gene_name).copy()
 
         # find it frameshift actually is on gene annotation
-        fs_pos = []
-        for ix, row in gene_df.iterrows():
-            indel_pos = [row['Start_Position'], row['End_Position']]
-            coding_pos = bed.query_position(bed.strand, row['Chromosome'], indel_pos)
-            fs_pos.append(coding_pos)
+        pos_left = bed.query_positions(bed.strand, gene_df['Chromosome'].values,
+                                       gene_df['Start_Position'].values)
+        pos_right = bed.query_positions(bed.strand, gene_df['Chromosome'].values,
+                                        gene_df['End_Position'].values)
 
         # mark frameshifts that could not be mapped to reference tx
-        gene_df['unmapped'] = [(1 if x is None else 0) for x in fs_pos]
+        gene_df['unmapped'] = ((pos_left < 0) & (pos_right < 0)).astype(int)
         total_fs = len(gene_df)
         unmapped_fs = len(gene_df[gene_df['unmapped']==1])
 
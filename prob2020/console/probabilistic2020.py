@@ -10,6 +10,7 @@ sys.path.append(os.path.join(file_dir, '../../'))
 import prob2020
 import prob2020.python.utils as utils
 import prob2020.python.p_value as mypval
+import prob2020.python.journal as journal
 import prob2020.python.indel as indel
 import prob2020.console.randomization_test as rt
 
@@ -168,6 +169,42 @@ def parse_arguments():
         advance_parser.add_argument('-seed', '--seed',
                                     type=int, default=101,
                                     help=help_str)
+        help_str = ('Record the result of each finished gene in a journal (output '
+                    'file name with a ".journal" suffix), so that an interrupted '
+                    'run can be resumed with --resume. The journal is removed once '
+                    'the output is written.')
+        advance_parser.add_argument('--journal',
+                                    action='store_true',
+                                    default=False,
+                                    help=help_str)
+        help_str = ('Resume an interrupted run from the journal of finished genes '
+                    '(output file name with a ".journal" suffix). Options affecting '
+                    'the results must be the same as the interrupted run. Implies '
+                    '--journal.')
+        advance_parser.add_argument('--resume',
+                                    action='store_true',
+                                    default=False,
+                                    help=help_str)
+        help_str = ('Directory to cache the result of each gene. Genes with the same '
+                    'sequence, mutations and options as a previous run reuse the '
+                    'cached result. Requires a seed (Default: None).')
+        advance_parser.add_argument('--cache-dir',
+                                    type=str, default=None,
+                                    help=help_str)
+        help_str = ('Directory to store the simulated null distribution of each gene. '
+                    'Genes with the same sequence, number of mutations per context '
+                    'and somatic bases (e.g. in cohort subsets or reruns with '
+                    'different thresholds) reuse or extend the stored null '
+                    'distribution (Default: None).')
+        advance_parser.add_argument('--null-store',
+                                    type=str, default=None,
+                                    help=help_str)
+        help_str = ('Maximum size of the null distribution store in MB. The least '
+                    'recently used null distributions are removed once it is '
+                    'exceeded (Default: 1024).')
+        advance_parser.add_argument('--null-store-size',
+                                    type=float, default=1024,
+                                    help=help_str)
         help_str = 'Output text file of probabilistic 20/20 results'
         major_parser.add_argument('-o', '--output',
                                   type=str, required=True,
@@ -206,6 +243,10 @@ def main(opts,
     myoutput_path = opts['output']
     opts['output'] = ''
 
+    # keep the journal of finished genes next to the output
+    if myoutput_path and not opts.get('journal_file'):
+        opts['journal_file'] = myoutput_path + '.journal'
+
     # perform randomization-based test
     result_df = rt.main(opts, mutation_df)
 
@@ -248,8 +289,10 @@ def main(opts,
         del result_df['tmp entropy p-value']
 
     if myoutput_path:
-        # write output if specified
+        # write output if specified, the journal is no longer needed
+        # once the output is written
         result_df.to_csv(myoutput_path, sep='\t', index=False)
+        journal.remove_journal(journal.journal_path(opts))
 
     result_df = result_df.set_index('gene', drop=False)
 
@@ -14,6 +14,9 @@ import prob2020.python.mutation_context as mc
 import prob2020.python.count_frameshifts as cf
 import prob2020.python.process_result as pr
 import prob2020.python.p_value as mypval
+import prob2020.python.journal as journal
+import prob2020.python.result_cache as result_cache
+from prob2020.python.null_store import NullStore
 
 # external imports
 import argparse
@@ -29,18 +32,24 @@ logger = logging.getLogger(__name__)  # module logger
 @utils.log_error_decorator
 def singleprocess_permutation(info):
     # initialize input
-    bed_list, mut_df, opts, fs_cts_df, p_inactivating = info
-    current_chrom = bed_list[0].chrom
-    logger.info('Working on chromosome: {0} . . .'.format(current_chrom))
+    bed_list, mut_df, opts, fs_cts_df, p_inactivating, journal_handle = info
+    logger.info('Working on {0} genes ({1} . . .)'.format(len(bed_list),
+                                                      bed_list[0].gene_name))
     num_permutations = opts['num_iterations']
     gene_fa = pysam.Fastafile(opts['input'])
     gs = GeneSequence(gene_fa, nuc_context=opts['context'])
+    mut_df, gene_index = utils.index_mutations_by_gene(mut_df)
+    cache_dir = opts.get('cache_dir')
+    if opts.get('null_store'):
+        null_store = NullStore(opts['null_store'], opts.get('null_store_size'))
+    else:
+        null_store = None
 
     # iterate through each gene
     result = []
     for bed in bed_list:
         # prepare info for running permutation test
-        gene_mut = mut_df[mut_df['Gene']==bed.gene_name]
+        gene_mut = utils.get_gene_mutations(mut_df, gene_index, bed.gene_name)
         cols = ['Chromosome', 'Start_Position', 'Reference_Allele',
                 'Tumor_Allele', 'Variant_Classification',]
         # conditionally add protein_change column if exists
@@ -48,7 +57,6 @@ def singleprocess_permutation(info):
             cols += ['Protein_Change']
         mut_info = gene_mut[cols]
         gs.set_gene(bed)
-        sc = SequenceContext(gs, seed=opts['seed'])
 
         # count total mutations in gene
         total_mut = len(mut_info)
@@ -60,11 +68,24 @@ def singleprocess_permutation(info):
 
         # get coding positions, mutations unmapped to the reference tx will have
         # NA for a coding position
-        pos_list = []
-        for ix, row in mut_info.iterrows():
-            coding_pos = bed.query_position(bed.strand, row['Chromosome'], row['Start_Position'])
-            pos_list.append(coding_pos)
-        mut_info.loc[:, 'Coding Position'] = pos_list
+        coding_pos = bed.query_positions(bed.strand,
+                                         mut_info['Chromosome'].values,
+                                         mut_info['Start_Position'].values)
+        mut_info.loc[:, 'Coding Position'] = np.where(coding_pos >= 0, coding_pos, np.nan)
+
+        # reuse the result of a previous run with the same gene, mutations
+        # and options
+        if cache_dir:
+            cache_key = result_cache.gene_cache_key(gs, mut_info, opts)
+            cached_result = result_cache.load_result(cache_dir, cache_key)
+            if cached_result is not None:
+                result.append(cached_result)
+                if journal_handle is not None:
+                    journal.write_row(journal_handle, result[-1])
+                continue
+
+        # get sequence context
+        sc = SequenceContext(gs, seed=opts['seed'])
 
         # recover mutations that could not be mapped to the reference transcript
         # for a gene before being dropped (next step)
@@ -89,7 +110,8 @@ def singleprocess_permutation(info):
                                                       opts['stop_criteria'],
                                                       0,  # no recurrent mutation pseudo count
                                                       opts['recurrent'],
-                                                      opts['fraction'])
+                                                      opts['fraction'],
+                                                      null_store=null_store)
             result.append(tmp_result + [total_mut, unmapped_muts])
         elif opts['kind'] == 'tsg':
             # calculate results for deleterious mutation permutation test
@@ -102,7 +124,8 @@ def singleprocess_permutation(info):
                                                          opts['stop_criteria'],
                                                          opts['deleterious'],
                                                          0,  # no deleterious mutation pseudo count
-                                                         opts['seed'])
+                                                         opts['seed'],
+                                                         null_store=null_store)
             result.append(tmp_result + [num_mapped_muts, unmapped_muts])
                                         #fs_ct, fs_unmapped])
         elif opts['kind'] == 'protein':
@@ -118,51 +141,114 @@ def singleprocess_permutation(info):
             # calc results for entropy-on-effect permutation test
             tmp_result = mypval.calc_effect_p_value(mut_info, unmapped_mut_info,
                                                     sc, gs, bed, num_permutations,
+                                                    opts['stop_criteria'],
                                                     0, #  no recurrent mutation pseudo count
                                                     opts['recurrent'],
-                                                    opts['fraction'])
+                                                    opts['fraction'],
+                                                    null_store=null_store)
             result.append(tmp_result + [total_mut, unmapped_muts])
 
+        # record finished gene
+        if cache_dir:
+            result_cache.save_result(cache_dir, cache_key, result[-1])
+        if journal_handle is not None:
+            journal.write_row(journal_handle, result[-1])
+
     gene_fa.close()
-    logger.info('Finished working on chromosome: {0}.'.format(current_chrom))
+    logger.info('Finished working on {0} genes ({1} . . .).'.format(len(bed_list),
+                                                                 bed_list[0].gene_name))
     return result
 
 
+def _indexed_permutation(info):
+    """Runs singleprocess_permutation on a task and also returns the index
+    of the task, since tasks finish in any order."""
+    task_ix, task_info = info
+    return task_ix, singleprocess_permutation(task_info)
+
+
 def multiprocess_permutation(bed_dict, mut_df, opts,
-                             fs_cts_df=None, p_inactivating=None):
+                             fs_cts_df=None, p_inactivating=None,
+                             gene_index=None, journal_file=None):
     """Handles parallelization of permutations by splitting work
-    by chromosome.
+    into batches of genes.
+
+    Genes are grouped into tasks of similar cost (number of mutations
+    times CDS length). A single pool of processes is used, where each
+    process pulls the next most expensive task once it becomes free.
+
+    If a journal file is given, the result of each gene is recorded as
+    soon as it finishes. With the resume option, genes already in the
+    journal are not computed again. Only this process writes the journal,
+    worker processes send their results back to it.
     """
+    # results are ordered by the index of their BED line, since several
+    # BED lines may have the same gene name
     chroms = sorted(bed_dict.keys(), key=lambda x: len(bed_dict[x]), reverse=True)
+    bed_order = dict((id(b), i)
+                     for i, b in enumerate(b for c in chroms for b in bed_dict[c]))
+    gene_order = {}
+    for c in reversed(chroms):
+        for b in reversed(bed_dict[c]):
+            gene_order[b.gene_name] = bed_order[id(b)]
+
+    # skip genes finished in a previous run
+    result_list = []
+    journal_handle = None
+    if journal_file:
+        finished = journal.start_journal(journal_file, opts,
+                                         resume=opts.get('resume', False))
+        result_list += [(gene_order[gene], row) for gene, row in finished.items()
+                        if gene in gene_order]
+        bed_dict = dict((c, [b for b in bed_dict[c] if b.gene_name not in finished])
+                        for c in bed_dict)
+        journal_handle = open(journal_file, 'a')
     multiprocess_flag = opts['processes']>0
     if multiprocess_flag:
         num_processes = opts['processes']
     else:
         num_processes = 1
-    result_list = []
-    for i in range(0, len(chroms), num_processes):
-        if multiprocess_flag:
-            pool = Pool(processes=num_processes)
-            tmp_num_proc = len(chroms) - i if i + num_processes > len(chroms) else num_processes
-            info_repeat = ((bed_dict[chroms[tmp_ix]], mut_df, opts, fs_cts_df, p_inactivating)
-                            for tmp_ix in range(i, i+tmp_num_proc))
-            process_results = pool.imap(singleprocess_permutation, info_repeat)
-            process_results.next = utils.keyboard_exit_wrapper(process_results.next)
-            try:
-                for chrom_result in process_results:
-                    result_list += chrom_result
-            except KeyboardInterrupt:
-                pool.close()
-                pool.join()
-                logger.info('Exited by user. ctrl-c')
-                sys.exit(0)
+
+    # split genes into tasks
+    if gene_index is None:
+        mut_df, gene_index = utils.index_mutations_by_gene(mut_df)
+    mut_counts = dict((g, end-start) for g, (start, end) in gene_index.items())
+    task_list = utils.group_genes_by_cost(bed_dict, mut_counts, num_processes)
+    task_order = [[bed_order[id(b)] for b in bed_list] for bed_list in task_list]
+
+    if multiprocess_flag:
+        pool = Pool(processes=num_processes)
+        info_repeat = ((i, (bed_list, utils.select_gene_mutations(mut_df, bed_list, gene_index),
+                            opts, fs_cts_df, p_inactivating, None))
+                       for i, bed_list in enumerate(task_list))
+        process_results = pool.imap_unordered(_indexed_permutation, info_repeat)
+        process_results.next = utils.keyboard_exit_wrapper(process_results.next)
+        try:
+            for task_ix, task_result in process_results:
+                result_list += zip(task_order[task_ix], task_result)
+                if journal_handle is not None:
+                    for row in task_result:
+                        journal.write_row(journal_handle, row)
+        except KeyboardInterrupt:
             pool.close()
             pool.join()
-        else:
-            info = (bed_dict[chroms[i]], mut_df, opts, fs_cts_df, p_inactivating)
-            result_list += singleprocess_permutation(info)
+            logger.info('Exited by user. ctrl-c')
+            sys.exit(0)
+        pool.close()
+        pool.join()
+    else:
+        for task_ix, bed_list in enumerate(task_list):
+            # genes are journaled as they finish, since they run in this process
+            info = (bed_list, utils.select_gene_mutations(mut_df, bed_list, gene_index),
+                    opts, fs_cts_df, p_inactivating, journal_handle)
+            result_list += zip(task_order[task_ix], singleprocess_permutation(info))
+    if journal_handle is not None:
+        journal_handle.close()
+
+    # keep the same gene order regardless of when tasks finished
+    result_list.sort(key=lambda x: x[0])
 
-    return result_list
+    return [row for _, row in result_list]
 
 
 def parse_arguments():
@@ -300,6 +386,41 @@ def parse_arguments():
     parser.add_argument('-seed', '--seed',
                         type=int, default=None,
                         help=help_str)
+    help_str = ('Record the result of each finished gene in a journal (output '
+                'file name with a ".journal" suffix), so that an interrupted run '
+                'can be resumed with --resume. The journal is removed once the '
+                'output is written.')
+    parser.add_argument('--journal',
+                        action='store_true',
+                        default=False,
+                        help=help_str)
+    help_str = ('Resume an interrupted run from the journal of finished genes '
+                '(output file name with a ".journal" suffix). Options affecting the '
+                'results must be the same as the interrupted run. Implies --journal.')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        default=False,
+                        help=help_str)
+    help_str = ('Directory to cache the result of each gene. Genes with the same '
+                'sequence, mutations and options as a previous run reuse the '
+                'cached result. Requires a seed (Default: None).')
+    parser.add_argument('--cache-dir',
+                        type=str, default=None,
+                        help=help_str)
+    help_str = ('Directory to store the simulated null distribution of each gene. '
+                'Genes with the same sequence, number of mutations per context '
+                'and somatic bases (e.g. in cohort subsets or reruns with '
+                'different thresholds) reuse or extend the stored null '
+                'distribution (Default: None).')
+    parser.add_argument('--null-store',
+                        type=str, default=None,
+                        help=help_str)
+    help_str = ('Maximum size of the null distribution store in MB. The least '
+                'recently used null distributions are removed once it is '
+                'exceeded (Default: 1024).')
+    parser.add_argument('--null-store-size',
+                        type=float, default=1024,
+                        help=help_str)
     help_str = 'Output of probabilistic 20/20 results'
     parser.add_argument('-o', '--output',
                         type=str, required=True,
@@ -375,35 +496,53 @@ def main(opts, mut_df=None, frameshift_df=None):
 
     # select valid single nucleotide variants only
     mut_df = utils._fix_mutation_df(mut_df, opts['unique'])
+    mut_df, gene_index = utils.index_mutations_by_gene(mut_df)
 
     # log random number seed choice if provided
     if opts['seed'] is not None:
         logger.info('Pseudo Random Number Generator Seed: {0}'.format(opts['seed']))
+    elif opts.get('cache_dir'):
+        # results with a random seed can not be reused
+        logger.info('Results are not cached, since no seed was specified')
+        opts['cache_dir'] = None
 
     # don't filter out genes for tsg randomization-based test
     non_tested_genes = []
     bed_dict = utils.read_bed(opts['bed'], non_tested_genes)
 
+    # record finished genes if requested, so an interrupted run can be resumed
+    journal_file = journal.journal_path(opts)
+
     # Perform BH p-value adjustment and tidy up data for output
     if opts['kind'] == 'oncogene':
-        permutation_result = multiprocess_permutation(bed_dict, mut_df, opts)
+        permutation_result = multiprocess_permutation(bed_dict, mut_df, opts,
+                                                      gene_index=gene_index,
+                                                      journal_file=journal_file)
         permutation_df = pr.handle_oncogene_results(permutation_result,
                                                     non_tested_genes,
                                                     opts['num_iterations'])
     elif opts['kind'] == 'tsg':
         permutation_result = multiprocess_permutation(bed_dict, mut_df, opts,
-                                                      frameshift_df, p_inactivating)
+                                                      frameshift_df, p_inactivating,
+                                                      gene_index=gene_index,
+                                                      journal_file=journal_file)
         permutation_df = pr.handle_tsg_results(permutation_result)
     elif opts['kind'] == 'protein':
-        permutation_result = multiprocess_permutation(bed_dict, mut_df, opts)
+        permutation_result = multiprocess_permutation(bed_dict, mut_df, opts,
+                                                      gene_index=gene_index,
+                                                      journal_file=journal_file)
         permutation_df = pr.handle_protein_results(permutation_result)
     elif opts['kind'] == 'effect':
-        permutation_result = multiprocess_permutation(bed_dict, mut_df, opts)
+        permutation_result = multiprocess_permutation(bed_dict, mut_df, opts,
+                                                      gene_index=gene_index,
+                                                      journal_file=journal_file)
         permutation_df = pr.handle_effect_results(permutation_result)
 
-    # save output
+    # save output, the journal is no longer needed once it is written.
+    # Otherwise the caller removes the journal after writing the output.
     if opts['output']:
         permutation_df.to_csv(opts['output'], sep='\t', index=False)
+        journal.remove_journal(journal_file)
 
     return permutation_df
 
@@ -12,6 +12,7 @@ import prob2020.python.utils as utils
 from prob2020.python.gene_sequence import GeneSequence
 import prob2020.cython.cutils as cutils
 import prob2020.python.mutation_context as mc
+import prob2020.python.scores as scores
 
 # external imports
 import numpy as np
@@ -29,7 +30,16 @@ cols = ['non-silent count', 'silent count', 'nonsense count',
         'lost stop count', 'splice site count', 'lost start count',
         'missense count']
 
-def multiprocess_permutation(bed_dict, mut_df, opts):
+# column in the observed counts for each type of mutation, non-silent
+# mutations are also counted in the first column
+effect2col = {'Silent': 1, 'Nonsense_Mutation': 2, 'Nonstop_Mutation': 3,
+              'Splice_Site': 4, 'Translation_Start_Site': 5,
+              'Missense_Mutation': 6}
+
+# columns of summary_permutation with the simulated scores
+score_cols = ['Total Missense MGAEntropy', 'Total Missense VEST Score']
+
+def multiprocess_permutation(bed_dict, mut_df, opts, gene_index=None):
     """Handles parallelization of permutations by splitting work
     by chromosome.
     """
@@ -39,6 +49,8 @@ def multiprocess_permutation(bed_dict, mut_df, opts):
         num_processes = opts['processes']
     else:
         num_processes = 1
+    if gene_index is None:
+        mut_df, gene_index = utils.index_mutations_by_gene(mut_df)
     num_permutations = opts['num_permutations']
     if not opts['by_sample']:
         obs_result = []
@@ -47,39 +59,30 @@ def multiprocess_permutation(bed_dict, mut_df, opts):
         obs_result = pd.DataFrame(np.zeros((len(uniq_samp), len(cols))),
                                   index=uniq_samp, columns=cols)
 
-    # initialize list containing output
-    if not opts['score_dir']:
-        result_list = [[0, 0, 0, 0, 0, 0, 0] for k in range(num_permutations)]
-    else:
-        result_list = [[0, 0, 0, 0, 0, 0, 0, 0, 0] for k in range(num_permutations)]
+    # initialize arrays containing output
+    sim_cts, sim_scores = _init_sim_result(num_permutations, opts['score_dir'])
 
     # iterate over each chromosome
     for i in range(0, len(chroms), num_processes):
         if multiprocess_flag:
             pool = Pool(processes=num_processes)
             tmp_num_proc = len(chroms) - i if i + num_processes > len(chroms) else num_processes
-            info_repeat = ((bed_dict[chroms[tmp_ix]], mut_df, opts)
-                            for tmp_ix in range(i, i+tmp_num_proc))
+            info_repeat = ((bed_dict[chroms[tmp_ix]],
+                            utils.select_gene_mutations(mut_df, bed_dict[chroms[tmp_ix]], gene_index),
+                            opts)
+                           for tmp_ix in range(i, i+tmp_num_proc))
             process_results = pool.imap(singleprocess_permutation, info_repeat)
             process_results.next = utils.keyboard_exit_wrapper(process_results.next)
             try:
-                for chrom_result, obs_mutations in process_results:
-                    for j in range(num_permutations):
-                        result_list[j][0] += chrom_result[j][0]
-                        result_list[j][1] += chrom_result[j][1]
-                        result_list[j][2] += chrom_result[j][2]
-                        result_list[j][3] += chrom_result[j][3]
-                        result_list[j][4] += chrom_result[j][4]
-                        result_list[j][5] += chrom_result[j][5]
-                        result_list[j][6] += chrom_result[j][6]
-                        if opts['score_dir']:
-                            result_list[j][7] += chrom_result[j][7]
-                            result_list[j][8] += chrom_result[j][8]
+                for (chrom_cts, chrom_scores), obs_mutations in process_results:
+                    sim_cts += chrom_cts
+                    if opts['score_dir']:
+                        sim_scores += chrom_scores
 
                     if not opts['by_sample']:
                         obs_result.append(obs_mutations)
                     else:
-                        obs_result = obs_result + obs_mutations
+                        obs_result = obs_result.add(obs_mutations, fill_value=0)
             except KeyboardInterrupt:
                 pool.close()
                 pool.join()
@@ -88,25 +91,32 @@ def multiprocess_permutation(bed_dict, mut_df, opts):
             pool.close()
             pool.join()
         else:
-            info = (bed_dict[chroms[i]], mut_df, opts)
-            chrom_result, obs_mutations = singleprocess_permutation(info)
-            for j in range(num_permutations):
-                result_list[j][0] += chrom_result[j][0]
-                result_list[j][1] += chrom_result[j][1]
-                result_list[j][2] += chrom_result[j][2]
-                result_list[j][3] += chrom_result[j][3]
-                result_list[j][4] += chrom_result[j][4]
-                result_list[j][5] += chrom_result[j][5]
-                result_list[j][6] += chrom_result[j][6]
-                if opts['score_dir']:
-                    result_list[j][7] += chrom_result[j][7]
-                    result_list[j][8] += chrom_result[j][8]
+            info = (bed_dict[chroms[i]],
+                    utils.select_gene_mutations(mut_df, bed_dict[chroms[i]], gene_index),
+                    opts)
+            (chrom_cts, chrom_scores), obs_mutations = singleprocess_permutation(info)
+            sim_cts += chrom_cts
+            if opts['score_dir']:
+                sim_scores += chrom_scores
             if not opts['by_sample']:
                 obs_result.append(obs_mutations)
             else:
-                obs_result = obs_result + obs_mutations
+                obs_result = obs_result.add(obs_mutations, fill_value=0)
+
+    return (sim_cts, sim_scores), obs_result
+
 
-    return result_list, obs_result
+def _init_sim_result(num_permutations, score_dir):
+    """Creates arrays for accumulating the simulated counts and, if
+    a score directory is used, the simulated scores of each permutation.
+    """
+    sim_cts = np.zeros((num_permutations, len(pm.summary_count_cols)),
+                       dtype=np.int64)
+    if score_dir:
+        sim_scores = np.zeros((num_permutations, len(score_cols)))
+    else:
+        sim_scores = None
+    return sim_cts, sim_scores
 
 
 @utils.log_error_decorator
@@ -117,6 +127,7 @@ def singleprocess_permutation(info):
     num_permutations = opts['num_permutations']
     gene_fa = pysam.Fastafile(opts['input'])
     gs = GeneSequence(gene_fa, nuc_context=opts['context'])
+    mut_df, gene_index = utils.index_mutations_by_gene(mut_df)
 
     # variables for recording the actual observed number of non-silent
     # vs. silent mutations
@@ -131,18 +142,16 @@ def singleprocess_permutation(info):
         obs_vest = 0
         obs_mga_entropy = 0
     else:
-        uniq_samp = mut_df['Tumor_Sample'].unique()
-        obs_df = pd.DataFrame(np.zeros((len(uniq_samp), len(cols))),
-                              index=uniq_samp, columns=cols)
+        # integer code the samples once for the chromosome
+        uniq_samp = pd.Index(pd.factorize(mut_df['Tumor_Sample'])[1])
+        obs_array = np.zeros((len(uniq_samp), len(cols)))
 
     # go through each gene to permform simulation
-    if opts['score_dir']:
-        result = [[0, 0, 0, 0, 0, 0, 0, 0, 0] for k in range(num_permutations)]
-    else:
-        result = [[0, 0, 0, 0, 0, 0, 0] for k in range(num_permutations)]
+    sim_cts, sim_scores = _init_sim_result(num_permutations, opts['score_dir'])
     for bed in bed_list:
         # compute context counts and somatic bases for each context
-        gene_tuple = mc.compute_mutation_context(bed, gs, mut_df, opts)
+        gene_tuple = mc.compute_mutation_context(bed, gs, mut_df, opts,
+                                                 gene_index=gene_index)
         context_cts, context_to_mutations, mutations_df, gs, sc = gene_tuple
 
         if context_to_mutations:
@@ -179,29 +188,9 @@ def singleprocess_permutation(info):
                     obs_vest += tmp_result[-2]
                     obs_mga_entropy += tmp_result[-3]
             else:
-                for tsamp in mutations_df['Tumor_Sample'].unique():
-                    ixs = np.where(mutations_df['Tumor_Sample']==tsamp)[0]
-                    ref_aa = [r for i, r in enumerate(tmp_mut_info['Reference AA']) if i in ixs]
-                    somatic_aa = [s for i, s in enumerate(tmp_mut_info['Somatic AA']) if i in ixs]
-                    codon_pos = [c for i, c in enumerate(tmp_mut_info['Codon Pos']) if i in ixs]
-                    #tmp_non_silent = cutils.calc_non_silent_info(ref_aa,
-                                                                 #somatic_aa,
-                                                                 #codon_pos)
-                    # get summary info
-                    tmp_result = cutils.calc_summary_info(ref_aa,
-                                                          somatic_aa,
-                                                          codon_pos,
-                                                          bed.gene_name,
-                                                          opts['score_dir'],
-                                                          min_frac=0.0,
-                                                          min_recur=3)
-                    if opts['score_dir']:
-                        tmp_result.pop(-4)
-                        tmp_result.pop(-4)
-                        tmp_result.pop(-1)
-                    # update df
-                    #obs_df.loc[tsamp,:] = obs_df.loc[tsamp,:] + np.array(tmp_non_silent)
-                    obs_df.loc[tsamp,:] = obs_df.loc[tsamp,:] + np.array(tmp_result)
+                samp_ix = uniq_samp.get_indexer(mutations_df['Tumor_Sample'])
+                _add_sample_counts(obs_array, samp_ix, tmp_mut_info,
+                                   bed.gene_name, opts['score_dir'])
 
             ## Do permutations
             # calculate non silent count
@@ -210,31 +199,17 @@ def singleprocess_permutation(info):
                                                          #sc,  # sequence context obj
                                                          #gs,  # gene sequence obj
                                                          #num_permutations)
-            tmp_result = pm.summary_permutation(context_cts,
-                                                context_to_mutations,
-                                                sc,  # sequence context obj
-                                                gs,  # gene sequence obj
-                                                opts['score_dir'],
-                                                num_permutations)
-        else:
+            tmp_result, _ = pm.summary_permutation(context_cts,
+                                                   context_to_mutations,
+                                                   sc,  # sequence context obj
+                                                   gs,  # gene sequence obj
+                                                   opts['score_dir'],
+                                                   num_permutations)
+
+            # increment the non-silent/silent counts for each permutation
+            sim_cts += np.column_stack([tmp_result[col] for col in pm.summary_count_cols])
             if opts['score_dir']:
-                tmp_result = [[0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0] for k in range(num_permutations)]
-            else:
-                tmp_result = [[0, 0, 0, 0, 0, 0, 0, 0, 0, 0] for k in range(num_permutations)]
-
-        # increment the non-silent/silent counts for each permutation
-        offset = 3
-        for j in range(num_permutations):
-            result[j][0] += tmp_result[j][0+offset]
-            result[j][1] += tmp_result[j][1+offset]
-            result[j][2] += tmp_result[j][2+offset]
-            result[j][3] += tmp_result[j][3+offset]
-            result[j][4] += tmp_result[j][4+offset]
-            result[j][5] += tmp_result[j][5+offset]
-            result[j][6] += tmp_result[j][6+offset]
-            if opts['score_dir']:
-                result[j][7] += tmp_result[j][9+offset]
-                result[j][8] += tmp_result[j][10+offset]
+                sim_scores += np.column_stack([tmp_result[col] for col in score_cols])
 
     gene_fa.close()
     if not opts['by_sample']:
@@ -243,9 +218,68 @@ def singleprocess_permutation(info):
         if opts['score_dir']:
             obs_result.extend([obs_mga_entropy, obs_vest])
     else:
-        obs_result = obs_df
+        obs_result = pd.DataFrame(obs_array, index=uniq_samp, columns=cols)
     logger.info('Finished working on chromosome: {0}.'.format(current_chrom))
-    return result, obs_result
+    return (sim_cts, sim_scores), obs_result
+
+
+def _add_sample_counts(obs_array, samp_ix, aa_info, gene_name, score_dir):
+    """Adds the observed mutation counts (and scores) of a gene to the
+    total of each tumor sample.
+
+    Parameters
+    ----------
+    obs_array : np.array
+        samples X columns (see cols) array of observed totals, updated in place
+    samp_ix : np.array
+        row in obs_array of the sample for each mutation
+    aa_info : dict
+        mutation info from mc.get_aa_mut_info
+    gene_name : str
+        name of gene, used to fetch score information
+    score_dir : str
+        directory containing score information
+    """
+    # count each type of mutation
+    var_class = cutils.get_variant_classification(aa_info['Reference AA'],
+                                                  aa_info['Somatic AA'],
+                                                  aa_info['Codon Pos'])
+    col_ix = np.array([effect2col.get(v, -1) for v in var_class],
+                      dtype=int)
+    is_known = col_ix >= 0
+    np.add.at(obs_array, (samp_ix[is_known], col_ix[is_known]), 1)
+    is_non_silent = is_known & (col_ix != effect2col['Silent'])
+    np.add.at(obs_array[:, 0], samp_ix[is_non_silent], 1)
+
+    # add scores of the samples mutated in the gene
+    if score_dir:
+        gene_samp, gene_samp_ix = np.unique(samp_ix, return_inverse=True)
+        num_samp = len(gene_samp)
+
+        # score each mutation on its own
+        codon_pos = np.array([p if p is not None else -1
+                              for p in aa_info['Codon Pos']]).reshape(-1, 1)
+        ref_aa = utils.encode_aas(aa_info['Reference AA']).reshape(-1, 1)
+        somatic_aa = utils.encode_aas(aa_info['Somatic AA']).reshape(-1, 1)
+        missense_mask = mc.get_missense_mask({'Reference AA': ref_aa,
+                                              'Somatic AA': somatic_aa})
+        mut_mga, mut_vest = scores.retrieve_scores_batch(gene_name, score_dir,
+                                                         codon_pos, ref_aa,
+                                                         somatic_aa, missense_mask,
+                                                         default_mga=np.nan)
+
+        # samples without a scored missense mutation get the default MGA
+        # entropy, like scores.retrieve_scores
+        has_mga = ~np.isnan(mut_mga)
+        samp_mga = np.bincount(gene_samp_ix[has_mga], weights=mut_mga[has_mga],
+                               minlength=num_samp).astype(float)
+        samp_has_mga = np.bincount(gene_samp_ix[has_mga], minlength=num_samp) > 0
+        samp_mga[~samp_has_mga] = 5.0
+        samp_vest = np.bincount(gene_samp_ix, weights=mut_vest,
+                                minlength=num_samp).astype(float)
+        num_cts = len(pm.summary_count_cols)
+        obs_array[gene_samp, num_cts] += samp_mga
+        obs_array[gene_samp, num_cts+1] += samp_vest
 
 
 def parse_arguments():
@@ -371,13 +405,15 @@ def main(opts):
 
     # select valid single nucleotide variants only
     mut_df = utils._fix_mutation_df(mut_df)
+    mut_df, gene_index = utils.index_mutations_by_gene(mut_df)
 
     # read in bed info
     bed_dict = utils.read_bed(opts['bed'], [])
 
     # perform permutation test
     #permutation_result = multiprocess_permutation(bed_dict, mut_df, opts)
-    sim_result, obs_result = multiprocess_permutation(bed_dict, mut_df, opts)
+    sim_result, obs_result = multiprocess_permutation(bed_dict, mut_df, opts,
+                                                      gene_index=gene_index)
 
     # report number of observed non-silent and silent mutations
     #obs_result = [x[1] for x in permutation_result]  # actually observed num mutations
@@ -409,8 +445,12 @@ def main(opts):
     #sim_result = permutation_result[0]
 
     # convert to dataframe to save to file
-    non_silent_ratio_df = pd.DataFrame(sim_result,
-                                       columns=cols)
+    sim_cts, sim_scores = sim_result
+    non_silent_ratio_df = pd.DataFrame(sim_cts,
+                                       columns=cols[:sim_cts.shape[1]])
+    if opts['score_dir']:
+        for k, col in enumerate(cols[sim_cts.shape[1]:]):
+            non_silent_ratio_df[col] = sim_scores[:, k]
     # save simulation output
     non_silent_ratio_df.to_csv(opts['output'], sep='\t', index=False)
 
@@ -1,6 +1,8 @@
 #include <map>
 #include <cmath>
 #include <string>
+#include <vector>
+#include <algorithm>
 
 #define M_LOG2E 1.44269504088896340736L //log2(e)
 
@@ -94,6 +96,111 @@ std::map<std::string, double> calc_position_statistics(std::map<int, int> pos_ct
 }
 
 
+/* Precomputes n*log(n) for every n from 0 to max_n.
+ *
+ * Parameters
+ * ----------
+ * max_n : int
+ *      largest number of mutations at a single position
+ *
+ * Returns
+ * -------
+ * nlogn : vector<long double>
+ *      n*log(n), where 0*log(0) is defined as 0
+ */
+std::vector<long double> nlogn_table(int max_n){
+    std::vector<long double> nlogn(max_n+1, 0.0L);
+    for (int n=2; n<=max_n; n++){
+        nlogn[n] = n * log((long double) n);
+    }
+    return(nlogn);
+}
+
+
+/* Calculates the same position-based statistics as calc_position_statistics,
+ * but from a list of mutated positions instead of a map counting them. The
+ * positions are sorted and the counts at each position are found from runs
+ * of the same position. Entropy is then calculated from a precomputed
+ * table of n*log(n) values.
+ *
+ * Parameters
+ * ----------
+ * pos : vector<int>
+ *      positions of each mutation, sorted in place
+ * pseudo_count : int
+ *      pseudo-count added as an extra position
+ * nlogn : vector<long double>
+ *      output of nlogn_table, covering the size of pos and pseudo_count
+ * out : double*
+ *      array of length three which is filled with the number of
+ *      recurrent mutations, fraction of uniform entropy and delta entropy
+ */
+void calc_position_statistics_sorted(std::vector<int> &pos,
+                                     int pseudo_count,
+                                     const std::vector<long double> &nlogn,
+                                     float min_frac,
+                                     int min_recurrent,
+                                     int is_observed,
+                                     double *out){
+    int recurrent_sum = 0, val = 0, min_frac_thresh = 0;
+    long double mysum = pos.size() + pseudo_count, sum_nlogn = 0.0L;
+    long double myent_e = 0.0L, frac_of_uniform_ent = 1.0L, num_pos = 0.0L;
+    long double delta_ent = 0.0L;
+    std::vector<int> counts;
+
+    // count mutations at each position using runs of sorted positions
+    std::sort(pos.begin(), pos.end());
+    for (size_t i=0; i<pos.size(); i+=val){
+        val = 1;
+        while (i+val < pos.size() && pos[i+val] == pos[i]) val++;
+        counts.push_back(val);
+    }
+    if (pseudo_count) counts.push_back(pseudo_count);
+
+    // set definition of recurrent count number based either on the minimum or
+    // on some percentage of the total missense mutations (specified by min_frac)
+    min_frac_thresh = (int) (mysum*min_frac + .99);
+    min_recurrent = ((min_recurrent>min_frac_thresh) ?  min_recurrent:min_frac_thresh);
+
+    for (size_t i=0; i<counts.size(); i++){
+        val = counts[i];
+
+        // add to recurrent count if defined as recurrently mutated position
+        if (val>=min_recurrent && is_observed==1){
+            recurrent_sum += val;
+        } else if(val>=2 && is_observed==0){
+            recurrent_sum += val;
+        }
+
+        // update entropy metrics, where non-recurrent positions in the
+        // observed data are treated as separate positions (1*log(1) = 0)
+        if (val<min_recurrent && is_observed==1){
+            num_pos += val;
+        } else {
+            sum_nlogn += nlogn[val];
+            num_pos += 1;
+        }
+    }
+
+    // entropy = log(sum) - sum(n*log(n)) / sum
+    if (mysum > 0) {
+        myent_e = log(mysum) - sum_nlogn / mysum;
+    }
+
+    // normalize the entropy metrics
+    if (num_pos > 1) {
+        delta_ent = log(num_pos) - myent_e;
+    }
+    if (mysum > 1) {
+        frac_of_uniform_ent = myent_e / log(mysum);
+    }
+
+    out[0] = recurrent_sum;
+    out[1] = frac_of_uniform_ent;
+    out[2] = delta_ent;
+}
+
+
 /* Calculates the effect-based statistics in one function.
  *
  * Parameters
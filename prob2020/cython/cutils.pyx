@@ -24,6 +24,14 @@ cdef extern from "permutation.hpp":
                                                double min_frac,
                                                int min_recurrent,
                                                int is_obs)
+    vector[long double] nlogn_table(int max_n)
+    void calc_position_statistics_sorted(vector[int] &pos,
+                                         int pseudo_count,
+                                         vector[long double] &nlogn,
+                                         double min_frac,
+                                         int min_recurrent,
+                                         int is_obs,
+                                         double *out)
 
 
 @cython.cdivision(True)
@@ -112,6 +120,74 @@ def calc_pos_info(aa_mut_pos,
     return num_recur, frac_pos_ent, delta_pos_ent, pos_ctr
 
 
+def calc_pos_info_batch(DTYPE_INT_t[:, :] codon_pos,
+                        np.uint8_t[:, :] missense_mask,
+                        int pseudo_count=0,
+                        double min_frac=0.0,
+                        int min_recur=2,
+                        int is_obs=1):
+    """Calculates position-based statistics for a batch of permutations.
+
+    This is the batched counterpart of calc_pos_info, and only the
+    statistics (not the position counts) are returned.
+
+    Parameters
+    ----------
+    codon_pos : np.array
+        N x M matrix of codon positions, one row per permutation
+    missense_mask : np.array
+        N x M matrix, non-zero for missense mutations
+    pseudo_count : int, default: 0
+        pseudo-count of mutations added as an extra position
+    min_frac : float, default: 0.0
+        fraction of total mutations to be recurrent position
+    min_recur : int, default: 2
+        minimum number of missense at same position to be defined as recurrent
+    is_obs : int, default: 1
+        whether the mutations are observed (1) or simulated (0)
+
+    Returns
+    -------
+    num_recur : np.array
+        number of recurrent missense mutations for each permutation
+    frac_pos_ent : np.array
+        fraction of uniform missense position entropy
+    delta_pos_ent : np.array
+        delta entropy of missense positions compared to uniform
+    """
+    cdef:
+        int i, j
+        int num_perm = codon_pos.shape[0], num_mutations = codon_pos.shape[1]
+        vector[int] pos
+        vector[long double] nlogn = nlogn_table(max(num_mutations, pseudo_count))
+        double pos_info[3]
+        DTYPE_INT_t[:] recur_view
+        double[:] ent_view, delta_view
+
+    if missense_mask.shape[0] != num_perm or missense_mask.shape[1] != num_mutations:
+        raise ValueError('The missense mask should match the codon positions')
+
+    num_recur = np.zeros(num_perm, dtype=DTYPE_INT)
+    frac_pos_ent = np.zeros(num_perm, dtype=np.float64)
+    delta_pos_ent = np.zeros(num_perm, dtype=np.float64)
+    recur_view, ent_view, delta_view = num_recur, frac_pos_ent, delta_pos_ent
+    pos.reserve(num_mutations)
+    for i in range(num_perm):
+        # collect the missense positions of the permutation
+        pos.clear()
+        for j in range(num_mutations):
+            if missense_mask[i, j]:
+                pos.push_back(codon_pos[i, j])
+
+        calc_position_statistics_sorted(pos, pseudo_count, nlogn, min_frac,
+                                        min_recur, is_obs, pos_info)
+        recur_view[i] = <DTYPE_INT_t> pos_info[0]
+        ent_view[i] = pos_info[1]
+        delta_view[i] = pos_info[2]
+
+    return num_recur, frac_pos_ent, delta_pos_ent
+
+
 def calc_effect_info(aa_mut_pos,
                      germ_aa,
                      somatic_aa,
@@ -269,7 +345,131 @@ def get_variant_classification(germ_aa_list, somatic_aa_list, codon_pos):
         else:
             var_class.push_back(na)
 
-    return var_class
+    # strings are returned as bytes on python 3
+    if str is bytes:
+        return var_class
+    return [v.decode('UTF-8') for v in var_class]
+
+
+def calc_deleterious_info_batch(DTYPE_INT_t[:, :] effect_table,
+                                DTYPE_INT_t[:, :] mut_pos,
+                                DTYPE_INT_t[:] base_ix):
+    """Counts deleterious mutations for a batch of permutations.
+
+    Parameters
+    ----------
+    effect_table : np.array
+        integer coded mutation effect for each position (rows) and
+        somatic base (columns), see GeneSequence.effect_array
+    mut_pos : np.array
+        N x M matrix of mutated positions, one row per permutation
+    base_ix : np.array
+        column in effect_table for the somatic base of the M mutations
+
+    Returns
+    -------
+    num_deleterious : np.array
+        number of deleterious mutations in each permutation
+    """
+    cdef:
+        int i, j, effect
+        int num_perm = mut_pos.shape[0], num_mutations = mut_pos.shape[1]
+        int nonsense = utils.nonsense_int, lost_stop = utils.lost_stop_int
+        int lost_start = utils.lost_start_int, splice_site = utils.splice_site_int
+        DTYPE_INT_t[:] num_del_view
+
+    if base_ix.shape[0] != num_mutations:
+        raise ValueError('There should be a somatic base for each mutation')
+
+    num_deleterious = np.zeros(num_perm, dtype=DTYPE_INT)
+    num_del_view = num_deleterious
+    for i in range(num_perm):
+        for j in range(num_mutations):
+            effect = effect_table[mut_pos[i, j], base_ix[j]]
+            if effect == nonsense or effect == lost_stop or \
+               effect == lost_start or effect == splice_site:
+                num_del_view[i] += 1
+
+    return num_deleterious
+
+
+def calc_non_silent_info_batch(DTYPE_INT_t[:, :] effect_table,
+                               DTYPE_INT_t[:, :] mut_pos,
+                               DTYPE_INT_t[:] base_ix):
+    """Counts mutation types for a batch of permutations.
+
+    Parameters
+    ----------
+    effect_table : np.array
+        integer coded mutation effect for each position (rows) and
+        somatic base (columns), see GeneSequence.effect_array
+    mut_pos : np.array
+        N x M matrix of mutated positions, one row per permutation
+    base_ix : np.array
+        column in effect_table for the somatic base of the M mutations
+
+    Returns
+    -------
+    non_silent_info : np.array
+        N x 7 matrix with the same columns as the output of
+        calc_non_silent_info (non-silent, silent, nonsense, lost stop,
+        splice site, lost start, missense)
+    """
+    cdef:
+        int i, j, effect
+        int num_perm = mut_pos.shape[0], num_mutations = mut_pos.shape[1]
+        int num_effects = len(utils.effect_list)
+        DTYPE_INT_t[:, :] effect_ct_view
+        DTYPE_INT_t[:, :] info_view
+
+    if base_ix.shape[0] != num_mutations:
+        raise ValueError('There should be a somatic base for each mutation')
+
+    # count each type of effect
+    effect_ct = np.zeros((num_perm, num_effects), dtype=DTYPE_INT)
+    effect_ct_view = effect_ct
+    for i in range(num_perm):
+        for j in range(num_mutations):
+            effect = effect_table[mut_pos[i, j], base_ix[j]]
+            effect_ct_view[i, effect] += 1
+
+    # arrange in the same order as calc_non_silent_info
+    non_silent_info = np.empty((num_perm, 7), dtype=DTYPE_INT)
+    info_view = non_silent_info
+    for i in range(num_perm):
+        info_view[i, 1] = effect_ct_view[i, utils.silent_int]
+        info_view[i, 2] = effect_ct_view[i, utils.nonsense_int]
+        info_view[i, 3] = effect_ct_view[i, utils.lost_stop_int]
+        info_view[i, 4] = effect_ct_view[i, utils.splice_site_int]
+        info_view[i, 5] = effect_ct_view[i, utils.lost_start_int]
+        info_view[i, 6] = effect_ct_view[i, utils.missense_int]
+        info_view[i, 0] = (info_view[i, 2] + info_view[i, 3] + info_view[i, 4] +
+                           info_view[i, 5] + info_view[i, 6])
+
+    return non_silent_info
+
+
+def get_variant_classification_batch(effect_table, mut_pos, base_ix):
+    """Return the variant classification for a batch of permutations.
+
+    Parameters
+    ----------
+    effect_table : np.array
+        integer coded mutation effect for each position (rows) and
+        somatic base (columns), see GeneSequence.effect_array
+    mut_pos : np.array
+        N x M matrix of mutated positions, one row per permutation
+    base_ix : np.array
+        column in effect_table for the somatic base of the M mutations
+
+    Returns
+    -------
+    var_class : np.array
+        N x M matrix of strings classifying variant type, empty strings
+        are used for mutations with an unknown effect
+    """
+    effect = np.asarray(effect_table)[np.asarray(mut_pos), np.asarray(base_ix)]
+    return utils.effect_array[effect]
 
 
 def calc_summary_info(germ_aa, somatic_aa, codon_pos,
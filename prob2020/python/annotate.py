@@ -5,7 +5,7 @@ from ..cython import cutils
 
 def annotate_maf(coding_pos, somatic_base, gene_seq):
     # make sure numpy array
-    coding_pos = np.array(coding_pos)
+    coding_pos = np.asarray(coding_pos, dtype=int)
 
     # info about gene
     gene_name = gene_seq.bed.gene_name
@@ -17,8 +17,7 @@ def annotate_maf(coding_pos, somatic_base, gene_seq):
     maf_list = []
 
     # get genome coordinate
-    pos2genome = np.vectorize(lambda x: gene_seq.bed.seqpos2genome[x]+1)
-    genome_coord = pos2genome(coding_pos)
+    genome_coord = gene_seq.bed.seqpos_to_genome(coding_pos) + 1
 
     # get info about mutations
     tmp_mut_info = mc.get_aa_mut_info(coding_pos,
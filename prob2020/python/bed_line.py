@@ -1,5 +1,6 @@
 """Parses an individual line in a BED file."""
 from collections import namedtuple
+import numpy as np
 import logging
 
 # Initialize a global named tuple to make handling BED lines less awkward
@@ -155,46 +156,57 @@ class BedLine(object):
         return self.num_exons
 
     def init_genome_coordinates(self) :
-        """Creates the self.seqpos2genome dictionary that converts positions
-        relative to the sequence to genome coordinates."""
-        self.seqpos2genome = {}
+        """Creates the self.seqpos2genome array that converts positions
+        relative to the sequence to genome coordinates.
+
+        The array is indexed by sequence position (coding positions
+        followed by 5' and 3' splice sites) and holds the 0-based genome
+        coordinate as an int64.
+        """
+        seq_len = self.cds_len + self.five_ss_len + self.three_ss_len
+        self.seqpos2genome = -np.ones(seq_len, dtype=np.int64)
 
         # record genome positions for each sequence position
-        seq_pos = 0
-        for estart, eend in self.exons:
-            for genome_pos in range(estart, eend):
-                if self.strand == '+':
-                    self.seqpos2genome[seq_pos] = genome_pos
-                elif self.strand == '-':
-                    tmp = self.cds_len - seq_pos - 1
-                    self.seqpos2genome[tmp] = genome_pos
-                seq_pos += 1
-
-        # recode 5' splice site locations
-        for i in range(0, self.five_ss_len):
-            seq_pos = self.cds_len + i
-            ss_ix = i // 2  # the ss_ix'th 5'ss starting from upstream tx
-            pos_in_ss = i % 2  # whether first/second nuc in splice site
-
-            # determine genome coordinates for 5' splice site
+        if self.exons:
+            genome_pos = np.concatenate([np.arange(estart, eend, dtype=np.int64)
+                                         for estart, eend in self.exons])
             if self.strand == '+':
-                self.seqpos2genome[seq_pos] = self.exons[ss_ix][1] + pos_in_ss
-            else:
-                exon_pos = -1 - ss_ix
-                self.seqpos2genome[seq_pos] = self.exons[exon_pos][0] - pos_in_ss - 1
+                self.seqpos2genome[:self.cds_len] = genome_pos
+            elif self.strand == '-':
+                self.seqpos2genome[:self.cds_len] = genome_pos[::-1]
+
+        # recode 5' and 3' splice site locations
+        ss_ix = np.arange(self.five_ss_len) // 2  # the ss_ix'th ss starting from upstream tx
+        pos_in_ss = np.arange(self.five_ss_len) % 2  # whether first/second nuc in splice site
+        exon_starts = np.array([e[0] for e in self.exons], dtype=np.int64)
+        exon_ends = np.array([e[1] for e in self.exons], dtype=np.int64)
+        five_ss_start = self.cds_len
+        three_ss_start = self.cds_len + self.five_ss_len
+        if self.strand == '+':
+            self.seqpos2genome[five_ss_start:three_ss_start] = exon_ends[ss_ix] + pos_in_ss
+            self.seqpos2genome[three_ss_start:] = exon_starts[ss_ix+1] - 2 + pos_in_ss
+        else:
+            exon_pos = -1 - ss_ix
+            self.seqpos2genome[five_ss_start:three_ss_start] = exon_starts[exon_pos] - pos_in_ss - 1
+            self.seqpos2genome[three_ss_start:] = exon_ends[exon_pos-1] + 1 - pos_in_ss
 
-        # recode 3' splice site locations
-        for i in range(0, self.three_ss_len):
-            seq_pos = self.cds_len + self.five_ss_len + i
-            ss_ix = i // 2  # the ss_ix'th 3'ss starting from upstream tx
-            pos_in_ss = i % 2  # whether first/second nuc in splice site
+    def seqpos_to_genome(self, seq_pos):
+        """Converts positions relative to the sequence into 0-based genome
+        coordinates.
 
-            # determine genome coordinates for 3' splice site
-            if self.strand == '+':
-                self.seqpos2genome[seq_pos] = self.exons[ss_ix+1][0] - 2 + pos_in_ss
-            else:
-                exon_pos = -1 - ss_ix
-                self.seqpos2genome[seq_pos] = self.exons[exon_pos-1][1] + 1 - pos_in_ss
+        Parameters
+        ----------
+        seq_pos : int or np.array
+            positions relative to the sequence
+
+        Returns
+        -------
+        genome_pos : int or np.array
+            0-based genome coordinates
+        """
+        if not hasattr(self, 'seqpos2genome'):
+            self.init_genome_coordinates()
+        return self.seqpos2genome[seq_pos]
 
     def query_position(self, strand, chr, genome_coord):
         """Provides the relative position on the coding sequence for a given
@@ -258,3 +270,93 @@ class BedLine(object):
                 return pos
 
         return pos
+
+    def query_positions(self, strand, chroms, genome_coords):
+        """Provides the relative positions on the coding sequence for an
+        array of genomic positions.
+
+        This is the vectorized version of :meth:`query_position`, which
+        uses a binary search over the exon boundaries rather than scanning
+        every exon for every position. Positions that do not map to the
+        coding sequence or a splice site are given a value of -1.
+
+        Parameters
+        ----------
+        strand : str
+            strand of the gene, {'+', '-'}
+        chroms : iterable of str
+            chromosomes, provided for symmetry with query_position
+        genome_coords : iterable of int
+            0-based positions for mutations
+
+        Returns
+        -------
+        pos : np.array
+            position of mutations in coding sequence, -1 if the mutation
+            does not match a region found in self.exons
+        """
+        coords = np.asarray(genome_coords, dtype=float).reshape(-1)
+        pos = -np.ones(len(coords), dtype=np.int64)
+        if not self.num_exons or not len(coords) or strand not in ['+', '-']:
+            return pos
+
+        # missing coordinates are placed far enough upstream to not match
+        starts = np.array([e[0] for e in self.exons], dtype=np.int64)
+        coords = np.where(np.isnan(coords), starts[0] - 10, coords).astype(np.int64)
+        ends = np.array([e[1] for e in self.exons], dtype=np.int64)
+        prev_lens = np.concatenate([[0], np.cumsum(self.exon_lens)[:-1]])
+        last_exon = self.num_exons - 1
+
+        # in query_position the first exon (in genomic order) to match a
+        # position wins, and for the same exon a coding position wins over
+        # the splice site after the exon end, which in turn wins over the
+        # splice site before the exon start. Each candidate is scored as
+        # 3*exon + rule to keep the same precedence.
+        no_match = 3 * self.num_exons
+        best = no_match * np.ones(len(coords), dtype=np.int64)
+
+        # coding region
+        ix = np.searchsorted(starts, coords, side='right') - 1
+        safe_ix = np.clip(ix, 0, last_exon)
+        is_coding = (ix >= 0) & (coords < ends[safe_ix])
+        best[is_coding] = 3 * ix[is_coding]
+
+        # splice site after the end of an exon
+        ix = np.searchsorted(ends, coords, side='right') - 1
+        for tmp_ix in [ix - 1, ix]:
+            safe_ix = np.clip(tmp_ix, 0, last_exon)
+            is_ss = ((tmp_ix >= 0) & (tmp_ix != last_exon) &
+                     (ends[safe_ix] <= coords) & (coords < ends[safe_ix] + 2))
+            best = np.where(is_ss, np.minimum(best, 3*tmp_ix + 1), best)
+
+        # splice site before the start of an exon
+        ix = np.searchsorted(starts, coords, side='right')
+        for tmp_ix in [ix, ix + 1]:
+            safe_ix = np.clip(tmp_ix, 0, last_exon)
+            is_ss = ((tmp_ix <= last_exon) & (tmp_ix != 0) &
+                     (starts[safe_ix] - 2 <= coords) & (coords < starts[safe_ix]))
+            best = np.where(is_ss, np.minimum(best, 3*tmp_ix + 2), best)
+
+        # convert to positions
+        exon_ix = np.clip(best // 3, 0, last_exon)
+        rule = best % 3
+        is_mapped = best < no_match
+        is_coding = is_mapped & (rule == 0)
+        is_after_end = is_mapped & (rule == 1)
+        is_before_start = is_mapped & (rule == 2)
+        coding_pos = prev_lens[exon_ix] + (coords - starts[exon_ix])
+        after_end_offset = coords - ends[exon_ix]
+        before_start_offset = coords - (starts[exon_ix] - 2)
+        if strand == '+':
+            pos[is_coding] = coding_pos[is_coding]
+            pos[is_after_end] = (self.cds_len + 2*exon_ix + after_end_offset)[is_after_end]
+            pos[is_before_start] = (self.cds_len + self.five_ss_len + 2*(exon_ix-1) +
+                                    before_start_offset)[is_before_start]
+        else:
+            pos[is_coding] = (self.cds_len - coding_pos - 1)[is_coding]
+            pos[is_after_end] = (self.cds_len + self.five_ss_len +
+                                 2*(self.num_exons-(exon_ix+2)) +
+                                 after_end_offset)[is_after_end]
+            pos[is_before_start] = (self.cds_len + 2*(self.num_exons-(exon_ix+2)) +
+                                    before_start_offset)[is_before_start]
+        return pos
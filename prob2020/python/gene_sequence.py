@@ -1,5 +1,6 @@
 """Fetches gene sequence from gene fasta created by extract_genes.py"""
 import prob2020.python.utils as utils
+import numpy as np
 
 
 class GeneSequence(object):
@@ -30,6 +31,7 @@ class GeneSequence(object):
         self.three_prime_seq = three_ss_seq_list
         self.five_prime_seq =  five_ss_seq_list
         self._to_upper()  # make sure all sequences are in upper case
+        self._init_seq_arrays()  # integer encoded version of the sequence
 
     def add_germline_variants(self, germline_nucs, coding_pos):
         """Add potential germline variants into the nucleotide sequence.
@@ -58,6 +60,106 @@ class GeneSequence(object):
             if cpos >= 0:
                 es[cpos] = gl_nuc
         self.exon_seq = ''.join(es)
+        self._init_seq_arrays()
+
+    def _init_seq_arrays(self):
+        """Integer encodes the gene sequence for fast lookups.
+
+        Arrays are indexed by the position convention used throughout
+        the permutations, i.e. the coding sequence followed by the 5' and
+        then 3' splice site positions. Nucleotides are encoded as 0-3 for
+        A, C, G, T and 4 for any other letter. Amino acids are encoded
+        according to utils.aa_list.
+
+        NOTE: the following attributes are updated, no return value
+
+        nuc_array : np.array, uint8
+            integer encoded nucleotide at each position
+        codon_pos_array : np.array
+            0-based codon position, -1 for splice sites
+        pos_in_codon_array : np.array
+            0-based position within the codon, -1 for splice sites
+        ref_codon_array : np.array
+            integer encoded reference codon, 64 if unknown or a splice site
+        ref_aa_array : np.array
+            integer encoded reference amino acid
+        somatic_aa_array : np.array
+            integer encoded amino acid after mutating each position
+            (rows) to an A, C, G, T or other letter (columns)
+        effect_array : np.array
+            integer encoded effect (see utils.effect_list) of mutating
+            each position (rows) to an A, C, G, T or other letter (columns)
+        """
+        cds_len = len(self.exon_seq)
+        ss_seq = ''.join([s[1:3] for s in self.five_prime_seq] +
+                         [s[1:3] for s in self.three_prime_seq])
+        seq = (self.exon_seq + ss_seq).encode('ascii')
+        self.nuc_array = utils.nuc_ascii_table[np.frombuffer(seq, dtype=np.uint8)]
+        seq_len = len(self.nuc_array)
+
+        # position of codons
+        coding_pos = np.arange(cds_len)
+        self.codon_pos_array = -np.ones(seq_len, dtype=int)
+        self.codon_pos_array[:cds_len] = coding_pos // 3
+        self.pos_in_codon_array = -np.ones(seq_len, dtype=int)
+        self.pos_in_codon_array[:cds_len] = coding_pos % 3
+
+        # encode the reference codons, incomplete codons at the end of the
+        # coding sequence are treated as unknown
+        num_codons = cds_len // 3
+        codon_nucs = self.nuc_array[:3*num_codons].reshape(num_codons, 3).astype(int)
+        codon_ix = 16*codon_nucs[:, 0] + 4*codon_nucs[:, 1] + codon_nucs[:, 2]
+        codon_ix[(codon_nucs == utils.unknown_nuc_int).any(axis=1)] = utils.unknown_codon_int
+        self.ref_codon_array = utils.unknown_codon_int * np.ones(seq_len, dtype=int)
+        self.ref_codon_array[:3*num_codons] = np.repeat(codon_ix, 3)
+
+        # reference amino acids
+        self.ref_aa_array = utils.codon_aa_table[self.ref_codon_array]
+        self.ref_aa_array[cds_len:] = utils.splice_int
+
+        # amino acids after mutating each position
+        num_nucs = len(utils.nuc_list)
+        self.somatic_aa_array = utils.unknown_aa_int * np.ones((seq_len, num_nucs+1), dtype=int)
+        self.somatic_aa_array[cds_len:, :] = utils.splice_int
+        is_known = self.ref_codon_array[:cds_len] != utils.unknown_codon_int
+        known_pos = coding_pos[is_known]
+        self.somatic_aa_array[known_pos, :num_nucs] = \
+            utils.mutated_codon_aa_table[self.ref_codon_array[known_pos],
+                                         self.pos_in_codon_array[known_pos]]
+
+        # codons containing an unknown letter may still be a valid codon
+        # after the unknown letter is mutated
+        unknown_pos = coding_pos[~is_known & (coding_pos < 3*num_codons)]
+        if len(unknown_pos):
+            unknown_nucs = codon_nucs[self.codon_pos_array[unknown_pos]]
+            for nuc_ix in range(num_nucs):
+                mut_nucs = unknown_nucs.copy()
+                mut_nucs[np.arange(len(unknown_pos)), self.pos_in_codon_array[unknown_pos]] = nuc_ix
+                mut_codon_ix = 16*mut_nucs[:, 0] + 4*mut_nucs[:, 1] + mut_nucs[:, 2]
+                mut_codon_ix[(mut_nucs == utils.unknown_nuc_int).any(axis=1)] = utils.unknown_codon_int
+                self.somatic_aa_array[unknown_pos, nuc_ix] = utils.codon_aa_table[mut_codon_ix]
+
+        # classify the effect of each possible substitution, in the same
+        # order of precedence as cutils.calc_non_silent_info
+        ref_aa = self.ref_aa_array[:, np.newaxis]
+        somatic_aa = self.somatic_aa_array
+        is_diff = somatic_aa != ref_aa
+        is_splice = (somatic_aa == utils.splice_int) | (ref_aa == utils.splice_int)
+        is_known = ((ref_aa != utils.unknown_aa_int) & (somatic_aa != utils.unknown_aa_int)) | is_splice
+        is_start = (self.codon_pos_array == 0)[:, np.newaxis]
+        self.effect_array = np.select([~is_known,
+                                       is_diff & (somatic_aa == utils.stop_int),
+                                       is_diff & (ref_aa == utils.stop_int),
+                                       is_splice,
+                                       is_diff & is_start,
+                                       is_diff],
+                                      [utils.unknown_effect_int,
+                                       utils.nonsense_int,
+                                       utils.lost_stop_int,
+                                       utils.splice_site_int,
+                                       utils.lost_start_int,
+                                       utils.missense_int],
+                                      default=utils.silent_int)
 
     def _to_upper(self):
         """Convert sequences to upper case."""
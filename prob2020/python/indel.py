@@ -10,6 +10,33 @@ import pandas as pd
 def simulate_indel_counts(indel_df, bed_dict,
                           num_permutations=1,
                           seed=None):
+    """Simulates the number of frameshift and inframe indels in each gene.
+
+    Indels are randomly assigned to genes with a probability proportional
+    to the coding length of the gene. Since each indel is assigned
+    independently, the frameshift and inframe counts of all permutations
+    are drawn as two multinomial samples.
+
+    Parameters
+    ----------
+    indel_df : pd.DataFrame
+        indel mutations, with a 'indel len' column
+    bed_dict : dict
+        dictionary mapping chromosome to BedLine objects of genes
+    num_permutations : int, default: 1
+        number of permutations
+    seed : int or None
+        seed for the random number generator
+
+    Returns
+    -------
+    fs_cts : np.array
+        number of frameshift indels, permutations X genes
+    inframe_cts : np.array
+        number of inframe indels, permutations X genes
+    gene_names : pd.Index
+        gene name for each column
+    """
     # count indels
     bed_genes = [mybed
                  for chrom in bed_dict
@@ -24,102 +51,108 @@ def simulate_indel_counts(indel_df, bed_dict,
 
     # generate random indel assignments
     gene_prob = gene_lengths.astype(float) / gene_lengths.sum()
-    indel_lens = indel_df['indel len'].copy().values
-    is_fs = (indel_lens % 3) > 0
-    indel_ixs = np.arange(len(indel_lens))
+    indel_lens = indel_df['indel len'].values
+    num_fs = int(np.sum((indel_lens % 3) > 0))
+    num_inframe = len(indel_lens) - num_fs
     prng = np.random.RandomState(seed=seed)
 
     # randomly reassign indels
-    mygene_cts = prng.multinomial(len(indel_lens), gene_prob, size=num_permutations)
-    inframe_cts = mygene_cts.copy()
-    for row in range(mygene_cts.shape[0]):
-        nonzero_ix = np.nonzero(mygene_cts[row,:])[0]
-
-        # randomly shuffle indel lengths
-        prng.shuffle(indel_ixs)
-        is_fs = is_fs[indel_ixs]
-
-        # iterate over each gene
-        indel_ix = 0
-        for j in range(len(nonzero_ix)):
-            prev_indel_ix = indel_ix
-            num_gene_indels = mygene_cts[row, nonzero_ix[j]]
-            indel_ix += num_gene_indels
-            inframe_cts[row, nonzero_ix[j]] = num_gene_indels - np.sum(is_fs[prev_indel_ix:indel_ix])
-    mygene_cts -= inframe_cts
-    return mygene_cts, inframe_cts, gene_lengths.index
+    fs_cts = prng.multinomial(num_fs, gene_prob.values, size=num_permutations)
+    inframe_cts = prng.multinomial(num_inframe, gene_prob.values, size=num_permutations)
+    return fs_cts, inframe_cts, gene_lengths.index
 
 
 def simulate_indel_maf(indel_df, bed_dict,
                        num_permutations=1,
-                       seed=None):
-    # count indels
+                       seed=None,
+                       max_rows=100000):
+    """Simulates indels in a MAF like format.
+
+    Each simulated indel keeps the length and type (insertion or deletion)
+    of an observed indel, but is placed at a random coding position
+    across all genes. Positions are drawn uniformly from the concatenated
+    coding sequences, so genes are chosen proportional to their coding
+    length. Lines are yielded in blocks of whole permutations, with at
+    most max_rows lines per block (at least one permutation is always
+    included).
+
+    Parameters
+    ----------
+    indel_df : pd.DataFrame
+        indel mutations, with 'indel len' and 'indel type' columns
+    bed_dict : dict
+        dictionary mapping chromosome to BedLine objects of genes
+    num_permutations : int, default: 1
+        number of permutations
+    seed : int or None
+        seed for the random number generator
+    max_rows : int, default: 100000
+        maximum number of MAF lines in a block
+
+    Yields
+    ------
+    maf_list : list of lists
+        simulated indels of a block of permutations in a MAF like format
+    """
+    # map positions along the concatenated coding sequence of all genes
+    # to genome coordinates
     bed_genes = [mybed
-                for chrom in bed_dict
-                for mybed in bed_dict[chrom]]
-    tmp = []
+                 for chrom in bed_dict
+                 for mybed in bed_dict[chrom]]
     for b in bed_genes:
         b.init_genome_coordinates()
-        tmp.append(b)
-    bed_genes = tmp
-    gene_lengths = pd.Series([b.cds_len for b in bed_genes],
-                                index=[b.gene_name for b in bed_genes])
-
-    # generate random indel assignments
-    gene_prob = gene_lengths.astype(float) / gene_lengths.sum()
-    indel_lens = indel_df['indel len'].copy().values
-    indel_types = indel_df['indel type'].copy().values
-    indel_ixs = np.arange(len(indel_lens))
+    gene_lengths = np.array([b.cds_len for b in bed_genes], dtype=np.int64)
+    gene_offsets = np.concatenate([[0], np.cumsum(gene_lengths)])
+    seqpos2genome = np.concatenate([b.seqpos2genome[:b.cds_len] for b in bed_genes])
+    gene_info = [(b.gene_name, b.strand, b.chrom) for b in bed_genes]
+
+    # info about the observed indels
+    indel_lens = indel_df['indel len'].values.astype(int)
+    is_ins = indel_df['indel type'].values == 'INS'
+    is_frame_shift = (indel_lens % 3) > 0
+    num_indels = len(indel_lens)
+    if not num_indels:
+        return
+    indel_seq = dict((l, 'N'*l) for l in np.unique(indel_lens))
+    var_class = np.where(is_ins,
+                         np.where(is_frame_shift, 'Frame_Shift_Ins', 'In_Frame_Ins'),
+                         np.where(is_frame_shift, 'Frame_Shift_Del', 'In_Frame_Del'))
     prng = np.random.RandomState(seed=seed)
 
-    for i in range(num_permutations):
-        # randomly reassign indels
-        mygene_cts = prng.multinomial(len(indel_lens), gene_prob)
-        nonzero_ix = np.nonzero(mygene_cts)[0]
-
-        # randomly shuffle indel lengths
-        prng.shuffle(indel_ixs)
-        indel_lens = indel_lens[indel_ixs]
-        indel_types = indel_types[indel_ixs]
-
-        # iterate over each gene
-        indel_ix = 0
-        for j in range(len(nonzero_ix)):
-            prev_indel_ix = indel_ix
-            num_gene_indels = mygene_cts[nonzero_ix[j]]
-            indel_ix += num_gene_indels
-            maf_lines = counts2maf(num_gene_indels,
-                                   indel_lens[prev_indel_ix:indel_ix],
-                                   indel_types[prev_indel_ix:indel_ix],
-                                   bed_genes[nonzero_ix[j]])
-            yield maf_lines
-
-
-def counts2maf(num_indels, myindel_lens, myindel_types, gene_bed, seed=None):
-    maf_list = []
-    prng = np.random.RandomState(seed=seed)
-    pos = prng.randint(low=0, high=gene_bed.cds_len, size=num_indels)
-    genome_pos = [gene_bed.seqpos2genome[p] for p in pos]
-    is_frame_shift = myindel_lens%3
-    for i, gpos in enumerate(genome_pos):
-        if myindel_types[i] == 'INS':
-            var_class = 'Frame_Shift_Ins' if is_frame_shift[i] else 'In_Frame_Ins'
-            dna_change = 'c.{0}_{1}ins'.format(pos[i], pos[i])
-            prot_change = 'p.?'
-            tmp = [gene_bed.gene_name, gene_bed.strand, gene_bed.chrom,
-                   gpos, gpos, '-', 'N'*myindel_lens[i], '-', dna_change,
-                   prot_change, var_class]
-            maf_list.append(tmp)
-        else:
-            var_class = 'Frame_Shift_Del' if is_frame_shift[i] else 'In_Frame_Del'
-            dna_change = 'c.{0}_{1}del'.format(pos[i], pos[i]+myindel_lens[i])
-            prot_change = 'p.?'
-            tmp = [gene_bed.gene_name, gene_bed.strand, gene_bed.chrom,
-                   gpos+1, gpos+myindel_lens[i], 'N'*myindel_lens[i], '-', '-', dna_change,
-                   prot_change, var_class]
-            maf_list.append(tmp)
-
-    return maf_list
+    block_size = max(1, max_rows // num_indels)
+    for num_done in range(0, num_permutations, block_size):
+        num_block = min(block_size, num_permutations - num_done)
+
+        # randomly place indels, ordered by gene within each permutation
+        all_pos = prng.randint(low=0, high=gene_offsets[-1],
+                               size=(num_block, num_indels))
+        row_ix = np.repeat(np.arange(num_block), num_indels)
+        indel_ix = np.tile(np.arange(num_indels), num_block)
+        all_pos = all_pos.ravel()
+        order = np.lexsort((all_pos, row_ix))
+        all_pos, indel_ix = all_pos[order], indel_ix[order]
+        gene_ix = np.searchsorted(gene_offsets, all_pos, side='right') - 1
+        pos = all_pos - gene_offsets[gene_ix]
+        genome_pos = seqpos2genome[all_pos]
+
+        # format MAF lines
+        maf_list = []
+        for k in range(len(all_pos)):
+            i = indel_ix[k]
+            gene_name, strand, chrom = gene_info[gene_ix[k]]
+            gpos, mylen = genome_pos[k], indel_lens[i]
+            if is_ins[i]:
+                dna_change = 'c.{0}_{1}ins'.format(pos[k], pos[k])
+                maf_line = [gene_name, strand, chrom,
+                            gpos, gpos, '-', indel_seq[mylen], '-', dna_change,
+                            'p.?', var_class[i]]
+            else:
+                dna_change = 'c.{0}_{1}del'.format(pos[k], pos[k]+mylen)
+                maf_line = [gene_name, strand, chrom,
+                            gpos+1, gpos+mylen, indel_seq[mylen], '-', '-', dna_change,
+                            'p.?', var_class[i]]
+            maf_list.append(maf_line)
+        yield maf_list
 
 
 def compute_indel_length(fs_df):
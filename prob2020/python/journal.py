@@ -0,0 +1,141 @@
+"""This module handles the journal of finished genes for the
+randomization-based tests.
+
+Result rows of each gene are appended to the journal as JSON lines as soon
+as the gene is finished, so that an interrupted run can be resumed without
+repeating finished genes. The first line of the journal is a header
+recording the options that affect the results.
+"""
+import prob2020.python.utils as utils
+import json
+import os
+import logging
+
+logger = logging.getLogger(__name__)  # module logger
+
+# options which need to match for journaled results to be reused
+journal_opts = ['input', 'mutations', 'bed', 'kind', 'num_iterations',
+                'stop_criteria', 'context', 'seed', 'score_dir',
+                'neighbor_graph_dir', 'recurrent', 'fraction', 'deleterious',
+                'use_unmapped', 'genome', 'unique', 'null_store']
+
+
+def _journal_opts(opts):
+    journal_info = dict((k, opts.get(k)) for k in journal_opts)
+    # stored nulls are simulated in a canonical order, regardless of the
+    # directory of the store
+    journal_info['null_store'] = bool(opts.get('null_store'))
+    return journal_info
+
+
+def journal_path(opts):
+    """Returns the path of the journal if it was requested with the journal
+    or resume options, otherwise None.
+
+    The journal is either at the path of the journal_file option or next
+    to the output file. None is also returned if neither is available.
+    """
+    if not (opts.get('journal') or opts.get('resume')):
+        return None
+    elif opts.get('journal_file'):
+        return opts['journal_file']
+    elif opts.get('output'):
+        return opts['output'] + '.journal'
+    else:
+        return None
+
+
+def remove_journal(path):
+    """Removes the journal once the final output is written."""
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def _journal_header(opts):
+    return {'journal': 'prob2020',
+            'opts': _journal_opts(opts)}
+
+
+def write_row(handle, row):
+    """Appends the result row of a gene to an open journal file.
+
+    The row is flushed right away, so it is kept if the run is interrupted.
+    """
+    handle.write(json.dumps(row, default=utils.json_default) + '\n')
+    handle.flush()
+
+
+def read_journal(path):
+    """Reads the header and result rows of a journal.
+
+    An incomplete last line, as left by an interrupted write, is ignored.
+
+    Parameters
+    ----------
+    path : str
+        path to journal
+
+    Returns
+    -------
+    header : dict
+        journal header
+    rows : list of lists
+        result rows in the journal
+    """
+    with open(path) as handle:
+        lines = handle.readlines()
+    if not lines:
+        raise ValueError('Journal ({0}) is empty'.format(path))
+    header = json.loads(lines[0])
+    rows = []
+    for i, line in enumerate(lines[1:], 1):
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            if i < len(lines) - 1:
+                raise ValueError('Line {0} of journal ({1}) is corrupted'.format(i+1, path))
+            logger.info('Ignoring incomplete last line of journal ({0})'.format(path))
+    return header, rows
+
+
+def start_journal(path, opts, resume=False):
+    """Starts a journal, optionally keeping the results of a previous
+    interrupted run.
+
+    Parameters
+    ----------
+    path : str
+        path to journal
+    opts : dict
+        options of the run, the options in journal_opts must match those
+        of a resumed journal
+    resume : bool
+        whether to keep the results of an existing journal
+
+    Returns
+    -------
+    finished : dict
+        result row of each gene already in the journal
+    """
+    header = _journal_header(opts)
+    rows = []
+    if resume and os.path.exists(path):
+        old_header, rows = read_journal(path)
+        old_opts = old_header.get('opts', {})
+        diff_opts = [k for k in journal_opts if old_opts.get(k) != header['opts'][k]]
+        if old_header.get('journal') != 'prob2020' or diff_opts:
+            raise ValueError('Can not resume from journal ({0}), options differ: '
+                             '{1}'.format(path, ', '.join(diff_opts)))
+        logger.info('Resuming {0} finished genes from journal ({1})'.format(len(rows), path))
+    elif resume:
+        logger.info('No journal ({0}) to resume from, starting a new run'.format(path))
+
+    # (re-)write the journal, which drops a possibly incomplete last line
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as handle:
+        handle.write(json.dumps(header) + '\n')
+        for row in rows:
+            write_row(handle, row)
+    os.rename(tmp_path, path)
+
+    return dict((row[0], row) for row in rows)
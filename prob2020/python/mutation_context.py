@@ -33,9 +33,12 @@ def get_all_context_names(context_num):
         return trinucs
 
 
-def compute_mutation_context(bed, gs, df, opts):
+def compute_mutation_context(bed, gs, df, opts, gene_index=None):
     # prepare info for running permutation test
-    gene_mut = df[df['Gene']==bed.gene_name]
+    if gene_index is None:
+        gene_mut = df[df['Gene']==bed.gene_name]
+    else:
+        gene_mut = utils.get_gene_mutations(df, gene_index, bed.gene_name)
     cols = ['Chromosome', 'Start_Position', 'Reference_Allele',
             'Tumor_Allele', 'Variant_Classification', 'Protein_Change',
             'Tumor_Sample', 'Tumor_Type']
@@ -57,11 +60,10 @@ def compute_mutation_context(bed, gs, df, opts):
 
     # get coding positions, mutations unmapped to the reference tx will have
     # NA for a coding position
-    pos_list = []
-    for ix, row in mut_info.iterrows():
-        coding_pos = bed.query_position(bed.strand, row['Chromosome'], row['Start_Position'])
-        pos_list.append(coding_pos)
-    mut_info['Coding Position'] = pos_list
+    coding_pos = bed.query_positions(bed.strand,
+                                     mut_info['Chromosome'].values,
+                                     mut_info['Start_Position'].values)
+    mut_info['Coding Position'] = np.where(coding_pos >= 0, coding_pos, np.nan)
 
     # recover mutations that could not be mapped to the reference transcript
     # for a gene before being dropped (next step)
@@ -233,6 +235,126 @@ def get_aa_mut_info(coding_pos, somatic_base, gene_seq):
     return aa_info
 
 
+def get_aa_mut_info_batch(coding_pos, somatic_base, gene_seq):
+    """Retrieves information about the effect of somatic SNVs on the
+    amino acids of a gene for many permutations at once.
+
+    This is the batched counterpart of :func:`get_aa_mut_info`. Each row
+    of `coding_pos` is one permutation, while each column corresponds to
+    an entry of `somatic_base`. Amino acids are integer coded according
+    to utils.aa_list.
+
+    Parameters
+    ----------
+    coding_pos : np.array
+        N x M matrix of base positions (0-based) of the mutations
+    somatic_base : list of str
+        Contains the somatic nucleotide for the M mutations
+    gene_seq : GeneSequence
+        gene sequence
+
+    Returns
+    -------
+    aa_info : dict
+        N x M matrices with the codon position (-1 for splice sites),
+        reference nucleotide, and integer coded reference/somatic AA
+    """
+    coding_pos = np.asarray(coding_pos, dtype=int)
+    if coding_pos.ndim == 1:
+        coding_pos = coding_pos.reshape(1, -1)
+
+    # if no mutations return empty result
+    if not len(somatic_base):
+        empty = np.empty((coding_pos.shape[0], 0), dtype=int)
+        aa_info = {'Codon Pos': empty,
+                   'Reference Nuc': empty.astype(object),
+                   'Reference AA': empty,
+                   'Somatic AA': empty}
+        return aa_info
+
+    # lookup codon info for each position from the integer encoded gene
+    base_ix = utils.encode_nucs(somatic_base)
+    aa_info = {'Codon Pos': gene_seq.codon_pos_array[coding_pos],
+               'Reference Nuc': utils.nuc_array[gene_seq.nuc_array[coding_pos]],
+               'Reference AA': gene_seq.ref_aa_array[coding_pos],
+               'Somatic AA': gene_seq.somatic_aa_array[coding_pos, base_ix]}
+    return aa_info
+
+
+def get_missense_mask(aa_info):
+    """Finds the missense mutations in the output of
+    :func:`get_aa_mut_info_batch`.
+
+    Parameters
+    ----------
+    aa_info : dict
+        output of get_aa_mut_info_batch
+
+    Returns
+    -------
+    missense_mask : np.array
+        N x M uint8 matrix, 1 for missense mutations and 0 otherwise
+    """
+    ref_aa, somatic_aa = aa_info['Reference AA'], aa_info['Somatic AA']
+    is_missense = ((ref_aa < utils.stop_int) & (somatic_aa < utils.stop_int) &
+                   (ref_aa != somatic_aa))
+    return is_missense.astype(np.uint8)
+
+
+def count_missense_positions(codon_pos, missense_mask):
+    """Counts the missense mutations at each mutated codon for a batch
+    of permutations.
+
+    Parameters
+    ----------
+    codon_pos : np.array
+        N x M matrix of codon positions
+    missense_mask : np.array
+        N x M matrix, non-zero for missense mutations
+
+    Returns
+    -------
+    pos_ct : np.array
+        number of missense mutations at each mutated codon, concatenated
+        over the permutations (ordered by codon position)
+    offsets : np.array
+        pos_ct[offsets[i]:offsets[i+1]] are the counts of permutation i
+    """
+    num_perm = len(missense_mask)
+    row_ix, col_ix = np.nonzero(missense_mask)
+    pos = codon_pos[row_ix, col_ix]
+    stride = pos.max() + 1 if len(pos) else 1
+    row_pos, pos_ct = np.unique(row_ix*stride + pos, return_counts=True)
+    offsets = np.searchsorted(row_pos // stride, np.arange(num_perm+1))
+    return pos_ct, offsets
+
+
+def decode_aa_mut_info(aa_info, row_ix):
+    """Converts a single permutation from the integer coded output of
+    :func:`get_aa_mut_info_batch` into the representation used by
+    :func:`get_aa_mut_info`.
+
+    Parameters
+    ----------
+    aa_info : dict
+        output of get_aa_mut_info_batch
+    row_ix : int
+        row (permutation) to decode
+
+    Returns
+    -------
+    decoded_info : dict
+        lists where AA are single letter strings (or 'Splice_Site'/None)
+        and splice site codon positions are None
+    """
+    codon_pos = aa_info['Codon Pos'][row_ix].tolist()
+    decoded_info = {'Codon Pos': [(c if c >= 0 else None) for c in codon_pos],
+                    'Reference Nuc': aa_info['Reference Nuc'][row_ix].tolist(),
+                    'Reference AA': utils.aa_array[aa_info['Reference AA'][row_ix]].tolist(),
+                    'Somatic AA': utils.aa_array[aa_info['Somatic AA'][row_ix]].tolist()}
+    return decoded_info
+
+
 def get_unmapped_aa_mut_info(mut_info, genome_fa, strand, chr, context_type):
 
     # get information on the nucleotide context
@@ -346,11 +468,12 @@ def is_nonsilent(mut_df, bed_dict, opts):
     indel_flag = indel.is_indel_annotation(mut_df)
     mut_df.loc[indel_flag, 'is_nonsilent'] = 1
     snv_df = mut_df[~indel_flag]
+    snv_df, gene_index = utils.index_mutations_by_gene(snv_df)
 
     # iterate over each gene
     for bed in gene_beds:
         # initiate for this gene
-        tmp_df = snv_df[snv_df['Gene']==bed.gene_name]
+        tmp_df = utils.get_gene_mutations(snv_df, gene_index, bed.gene_name)
         gs.set_gene(bed)
 
         # compute context counts and somatic bases for each context
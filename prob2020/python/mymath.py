@@ -85,6 +85,52 @@ def normalized_mutation_entropy(counts, total_cts=None):
     return norm_ent
 
 
+def normalized_mutation_entropy_batch(pos_ct, pos_row_ix, num_singles, other_cts):
+    """Calculate the normalized mutation entropy (see
+    normalized_mutation_entropy) for many sets of mutation counts.
+
+    Parameters
+    ----------
+    pos_ct : np.array
+        mutation counts of all sets, concatenated
+    pos_row_ix : np.array
+        set that each entry of pos_ct belongs to
+    num_singles : np.array
+        number of additional mutations in each set with a count of one
+    other_cts : list of np.array
+        additional mutation counts, one entry for each set
+
+    Returns
+    -------
+    norm_ent : np.array
+        normalized entropy of mutation count distribution of each set.
+    """
+    num_singles = np.asarray(num_singles, dtype=float)
+    other_cts = [np.asarray(cts, dtype=float) for cts in other_cts]
+    num_rows = len(num_singles)
+    total_cts = np.bincount(pos_row_ix, weights=pos_ct,
+                            minlength=num_rows).astype(float) + num_singles
+    for cts in other_cts:
+        total_cts += cts
+
+    # entropy of the concatenated counts, the single counts and the
+    # additional counts
+    safe_total = np.where(total_cts > 1, total_cts, 2.)
+    p = pos_ct / safe_total[pos_row_ix]
+    ent = -np.bincount(pos_row_ix, weights=p*np.log2(p),
+                       minlength=num_rows).astype(float)
+    ent -= num_singles / safe_total * np.log2(1. / safe_total)
+    for cts in other_cts:
+        p = cts / safe_total
+        ent -= np.where(p > 0, p * np.log2(np.where(p > 0, p, 1.)), 0)
+
+    # normalize by the max entropy
+    norm_ent = np.ones(num_rows)
+    is_valid = total_cts > 1
+    norm_ent[is_valid] = ent[is_valid] / np.log2(total_cts[is_valid])
+    return norm_ent
+
+
 def kl_divergence(p, q):
     """Compute the Kullback-Leibler (KL) divergence for discrete distributions.
 
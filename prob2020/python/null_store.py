@@ -0,0 +1,270 @@
+"""This module handles an optional on-disk store of the simulated null
+distributions of the randomization-based tests.
+
+The null distribution of a gene only depends on the gene sequence, the
+number of mutations in each sequence context and the somatic bases of each
+context, not on which samples carried the mutations. Nulls are therefore
+stored under a key of that signature (see null_key), so that reanalyses
+(e.g. cohort subsets, tumor type splits or different recurrence thresholds)
+can reuse or extend a previously simulated null.
+
+Each entry keeps the simulated null statistics as compact arrays in the
+order they were drawn. If the stopping criteria was reached, only the
+permutations up to that point are kept. Otherwise the state of the random
+number generator is kept as well, so the entry can later be extended with
+the same stream of permutations. The store is kept below a size cap by
+evicting the least recently used entries.
+"""
+import prob2020
+import hashlib
+import json
+import os
+import sys
+import numpy as np
+import logging
+
+# import pickle module
+try:
+    import cPickle as pickle
+except:
+    import pickle as pickle
+
+logger = logging.getLogger(__name__)  # module logger
+
+
+def canonical_signature(context_counts, context_to_mut):
+    """Orders the mutation contexts and the somatic bases of each context.
+
+    Permutations within a context are exchangeable, so the null distribution
+    does not depend on the order of contexts or of the somatic bases within
+    a context. Using a canonical order lets genes with the same signature
+    share the same stored null.
+
+    Parameters
+    ----------
+    context_counts : pd.Series
+        number of mutations for each context
+    context_to_mut : dict
+        dictionary mapping nucleotide context to a list of observed
+        somatic base changes.
+
+    Returns
+    -------
+    context_counts : pd.Series
+        number of mutations for each context, sorted by context
+    context_to_mut : dict
+        sorted list of somatic base changes for each context
+    """
+    context_counts = context_counts.sort_index()
+    context_to_mut = dict((c, sorted(context_to_mut[c]))
+                          for c in context_counts.index)
+    return context_counts, context_to_mut
+
+
+def null_key(kind, context_counts, context_to_mut, seq_context, gene_seq,
+             **params):
+    """Computes the key of a null distribution.
+
+    Parameters
+    ----------
+    kind : str
+        type of null statistic (e.g. 'deleterious')
+    context_counts : pd.Series
+        number of mutations for each context (see canonical_signature)
+    context_to_mut : dict
+        sorted list of somatic base changes for each context
+    seq_context : SequenceContext
+        sequence context of the gene, the random number generator of which
+        is used for the simulations
+    gene_seq : GeneSequence
+        sequence of the gene of interest
+    params : dict
+        other parameters affecting the null statistic
+
+    Returns
+    -------
+    key : str
+        hex digest identifying the null distribution
+    """
+    bed = gene_seq.bed
+    seq = '|'.join([gene_seq.exon_seq] + gene_seq.five_prime_seq + gene_seq.three_prime_seq)
+    key_info = {'version': prob2020.__version__,
+                'kind': kind,
+                'gene': [bed.gene_name, bed.chrom, bed.strand],
+                'sequence': hashlib.sha1(seq.encode('utf-8')).hexdigest(),
+                'nuc context': gene_seq.nuc_context,
+                'seed': seq_context.seed,
+                'prng': type(seq_context.prng).__name__,
+                'contexts': [[c, int(n), list(context_to_mut[c])]
+                             for c, n in context_counts.iteritems()],
+                'params': params}
+    key_str = json.dumps(key_info, sort_keys=True)
+    return hashlib.sha1(key_str.encode('utf-8')).hexdigest()
+
+
+def array_digest(arr):
+    """Hashes the content of an array for use in a null key (None for no
+    array)."""
+    if arr is None:
+        return None
+    arr = np.ascontiguousarray(arr)
+    return hashlib.sha1(str(arr.dtype).encode('utf-8') + arr.tobytes()).hexdigest()
+
+
+def compact_null(null):
+    """Converts null statistics to compact arrays for storage (np.float32
+    for real valued and np.int32 for integer statistics)."""
+    compact = []
+    for x in null:
+        x = np.asarray(x)
+        compact.append(x.astype(np.float32 if x.dtype.kind == 'f' else np.int32))
+    return tuple(compact)
+
+
+def get_prng_state(prng):
+    """Gets the state of a np.random.Generator or np.random.RandomState."""
+    if hasattr(prng, 'bit_generator'):
+        return prng.bit_generator.state
+    else:
+        return prng.get_state()
+
+
+def set_prng_state(prng, state):
+    """Sets the state of a np.random.Generator or np.random.RandomState."""
+    if hasattr(prng, 'bit_generator'):
+        prng.bit_generator.state = state
+    else:
+        prng.set_state(state)
+
+
+class NullStore(object):
+    """On-disk store of simulated null distributions with least recently
+    used eviction.
+
+    Parameters
+    ----------
+    store_dir : str
+        directory of the store
+    max_size : float or None
+        maximum size of the store in MB (None for no limit)
+    """
+
+    def __init__(self, store_dir, max_size=None):
+        self.store_dir = store_dir
+        self.max_size = max_size
+
+        # running total of the size of the store, so that it only needs to
+        # be scanned again when it exceeds the cap
+        self.total_size = 0
+        for path in self._entry_paths():
+            try:
+                self.total_size += os.stat(path).st_size
+            except OSError:
+                pass
+
+    def _path(self, key):
+        return os.path.join(self.store_dir, key[:2], key + '.null')
+
+    def _entry_paths(self):
+        for dirpath, dirnames, filenames in os.walk(self.store_dir):
+            for f in filenames:
+                if f.endswith('.null'):
+                    yield os.path.join(dirpath, f)
+
+    def load(self, key):
+        """Returns the stored entry for a key, or None if there is none.
+
+        Loading an entry marks it as recently used.
+
+        Returns
+        -------
+        entry : dict or None
+            'null' contains a tuple of arrays with the null statistics in
+            the order they were simulated, and 'prng_state' the state of
+            the random number generator after the last simulation (None
+            if the null can not be extended).
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as handle:
+                if sys.version_info < (3,):
+                    entry = pickle.load(handle)
+                else:
+                    entry = pickle.load(handle, encoding='latin-1')
+            os.utime(path, None)
+        except (IOError, OSError):
+            # missing or concurrently evicted entry
+            return None
+        except (EOFError, ValueError, pickle.UnpicklingError):
+            logger.info('Ignoring corrupted null store entry ({0})'.format(path))
+            return None
+        return entry
+
+    def save(self, key, null, prng_state=None):
+        """Saves the null statistics for a key and evicts the least recently
+        used entries if the store exceeds its size cap.
+
+        The file is written under a temporary name and then renamed, so that
+        concurrent processes never read a partially written entry.
+
+        Parameters
+        ----------
+        key : str
+            key of the null distribution (see null_key)
+        null : tuple of np.array
+            null statistics in the order they were simulated
+        prng_state : object or None
+            state of the random number generator after the last simulated
+            permutation, None if the stored permutations can not be
+            extended
+        """
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(path)):
+                raise
+        try:
+            old_size = os.stat(path).st_size
+        except OSError:
+            old_size = 0
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as handle:
+            pickle.dump({'null': compact_null(null), 'prng_state': prng_state},
+                        handle, protocol=2)
+        new_size = os.stat(tmp_path).st_size
+        os.rename(tmp_path, path)
+        self.total_size += new_size - old_size
+
+        if self.max_size is not None and self.total_size > self.max_size * 1024 * 1024:
+            self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries until the store is below
+        its size cap.
+
+        Parameters
+        ----------
+        keep : str or None
+            path of an entry which should not be removed
+        """
+        entries = []
+        for path in self._entry_paths():
+            try:
+                mystat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((mystat.st_mtime, mystat.st_size, path))
+        self.total_size = sum(e[1] for e in entries)
+        max_bytes = self.max_size * 1024 * 1024
+        for mtime, size, path in sorted(entries):
+            if self.total_size <= max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                self.total_size -= size
+                logger.debug('Evicted null store entry ({0})'.format(path))
+            except OSError:
+                pass
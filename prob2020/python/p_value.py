@@ -55,7 +55,7 @@ def bh_fdr(pval):
 
     # calculate the needed alpha
     n = float(len(pval))
-    pval_adj = np.zeros(n)
+    pval_adj = np.zeros(int(n))
     i = np.arange(1, n+1, dtype=float)[::-1]  # largest to smallest
     pval_adj = np.minimum(1, cummin(n/i * pval_array[::-1]))[::-1]
     return pval_adj[original_order]
@@ -70,7 +70,8 @@ def calc_deleterious_p_value(mut_info,
                              stop_thresh,
                              del_threshold,
                              pseudo_count,
-                             seed=None):
+                             seed=None,
+                             null_store=None):
     """Calculates the p-value for the number of inactivating SNV mutations.
 
     Calculates p-value based on how many simulations exceed the observed value.
@@ -99,6 +100,8 @@ def calc_deleterious_p_value(mut_info,
         means more precision on the p-value.
     seed : int (Default: None)
         seed number to random number generator (None to be randomly set)
+    null_store : NullStore (Default: None)
+        store of null distributions to reuse (None to always simulate)
     """
     #prng = np.random.RandomState(seed)
     if len(mut_info) > 0:
@@ -135,7 +138,8 @@ def calc_deleterious_p_value(mut_info,
                                                         gs,  # gene sequence obj
                                                         num_permutations,
                                                         stop_thresh,
-                                                        pseudo_count)
+                                                        pseudo_count,
+                                                        null_store=null_store)
             #else:
                 # no SNV mutation case
                 #null_del_list = [0 for i in range(num_permutations)]
@@ -165,7 +169,8 @@ def calc_position_p_value(mut_info,
                           stop_thresh,
                           pseudo_count,
                           min_recurrent,
-                          min_fraction):
+                          min_fraction,
+                          null_store=None):
     if len(mut_info) > 0:
         mut_info['Coding Position'] = mut_info['Coding Position'].astype(int)
         mut_info['Context'] = mut_info['Coding Position'].apply(lambda x: sc.pos2context[x])
@@ -180,7 +185,7 @@ def calc_position_p_value(mut_info,
 
         # get vest scores for gene if directory provided
         if score_dir:
-            gene_vest = scores.read_vest_pickle(bed.gene_name, score_dir)
+            gene_vest = scores.read_vest_array(bed.gene_name, score_dir)
             if gene_vest is None:
                 logger.warning('Could not find VEST scores for {0}, skipping . . .'.format(bed.gene_name))
         else:
@@ -199,10 +204,12 @@ def calc_position_p_value(mut_info,
                                                                      min_frac=min_fraction,
                                                                      min_recur=min_recurrent)
         # get vest score for actual mutations
-        vest_score = scores.compute_vest_stat(gene_vest,
-                                              aa_mut_info['Reference AA'],
-                                              aa_mut_info['Somatic AA'],
-                                              aa_mut_info['Codon Pos'])
+        obs_codon_pos = [p if p is not None else -1
+                         for p in aa_mut_info['Codon Pos']]
+        vest_score = scores.compute_vest_stat_batch(gene_vest,
+                                                    utils.encode_aas(aa_mut_info['Reference AA']),
+                                                    utils.encode_aas(aa_mut_info['Somatic AA']),
+                                                    obs_codon_pos)[0]
 
         # perform simulations to get p-value
         observed_stats = (num_recurrent, pos_ent, delta_pos_ent, vest_score)
@@ -214,7 +221,8 @@ def calc_position_p_value(mut_info,
                                                      gene_vest,
                                                      num_permutations,
                                                      stop_thresh,
-                                                     pseudo_count)
+                                                     pseudo_count,
+                                                     null_store=null_store)
         ent_p_value, vest_p_value = permutation_result
     else:
         num_recurrent = 0
@@ -291,7 +299,8 @@ def calc_protein_p_value(mut_info,
                 context_to_mutations,
                 sc,  # sequence context obj
                 gs,  # gene sequence obj
-                gene_graph, num_permutations, stop_thresh
+                scores.neighbor_graph_to_csr(gene_graph),
+                num_permutations, stop_thresh
             )
         except Exception as err:
             exc_info = sys.exc_info()
@@ -314,9 +323,11 @@ def calc_effect_p_value(mut_info,
                         gs,
                         bed,
                         num_permutations,
+                        stop_criteria,
                         pseudo_count,
                         min_recurrent,
-                        min_fraction):
+                        min_fraction,
+                        null_store=None):
     if len(mut_info) > 0:
         mut_info['Coding Position'] = mut_info['Coding Position'].astype(int)
         mut_info['Context'] = mut_info['Coding Position'].apply(lambda x: sc.pos2context[x])
@@ -329,15 +340,6 @@ def calc_effect_p_value(mut_info,
         context_to_mutations = dict((name, group['Tumor_Allele'])
                                     for name, group in tmp_df.groupby('Context'))
 
-        # perform permutations
-        permutation_result = pm.effect_permutation(context_cts,
-                                                   context_to_mutations,
-                                                   sc,  # sequence context obj
-                                                   gs,  # gene sequence obj
-                                                   num_permutations,
-                                                   pseudo_count)
-        effect_entropy_list, recur_list, inactivating_list = permutation_result  # unpack results
-
         # get effect info for actual mutations
         aa_mut_info = mc.get_aa_mut_info(mut_info['Coding Position'],
                                          mut_info['Tumor_Allele'].tolist(),
@@ -351,10 +353,16 @@ def calc_effect_p_value(mut_info,
                                                                           min_frac=min_fraction,
                                                                           min_recur=min_recurrent)
 
-        # calculate permutation p-value
-        entropy_num_nulls = sum([1 for null_ent in effect_entropy_list
-                                 if null_ent-utils.epsilon <= effect_ent])
-        ent_p_value = entropy_num_nulls / float(num_permutations)
+        # perform permutations to get p-value
+        ent_p_value = pm.effect_permutation(effect_ent,
+                                            context_cts,
+                                            context_to_mutations,
+                                            sc,  # sequence context obj
+                                            gs,  # gene sequence obj
+                                            num_permutations,
+                                            stop_criteria,
+                                            pseudo_count,
+                                            null_store=null_store)
     else:
         num_recur = 0
         num_inactivating = 0
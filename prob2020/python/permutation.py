@@ -3,6 +3,157 @@ import prob2020.python.utils as utils
 from ..cython import cutils
 import prob2020.python.mutation_context as mc
 import prob2020.python.scores as scores
+import prob2020.python.null_store as ns
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)  # module logger
+
+
+# columns of mutation type counts in the output of summary_permutation,
+# in the order of cutils.calc_non_silent_info
+summary_count_cols = ['non-silent snv', 'silent snv', 'nonsense', 'lost stop',
+                      'splice site', 'lost start', 'missense']
+
+
+def _growing_batch_sizes(num_permutations, max_batch, min_batch=100, growth=2):
+    """Generates batch sizes which start small and grow geometrically.
+
+    Most genes reach the stopping criteria after a small number of
+    permutations, so small initial batches avoid simulating permutations
+    which are never used.
+
+    Parameters
+    ----------
+    num_permutations : int
+        total number of permutations
+    max_batch : int
+        largest allowed batch size
+    min_batch : int, default: 100
+        size of the first batch
+    growth : int, default: 2
+        factor by which the batch size grows after each batch
+
+    Returns
+    -------
+    batch_sizes : generator
+        sizes of each batch, summing to num_permutations
+    """
+    batch_size = max(min(min_batch, max_batch), 1)
+    num_left = num_permutations
+    while num_left > 0:
+        yield min(batch_size, num_left)
+        num_left -= batch_size
+        batch_size = min(batch_size*growth, max_batch)
+
+
+def _early_stop_counts(extreme_list, stop_criteria):
+    """Counts null statistics at least as extreme as the observed ones, up to
+    the permutation where sufficient precision was reached.
+
+    Parameters
+    ----------
+    extreme_list : list of np.array
+        boolean arrays indicating whether each permutation is at least as
+        extreme as the observed value, one array for each statistic
+    stop_criteria : int
+        stop after stop_criteria permutations are at least as extreme as
+        the observed value, for every statistic
+
+    Returns
+    -------
+    null_cts : list of int
+        number of permutations at least as extreme for each statistic
+    num_sim : int
+        number of permutations used
+    is_done : bool
+        whether the stopping criteria was reached
+    """
+    if not len(extreme_list[0]):
+        return [0]*len(extreme_list), 0, False
+    cum_cts = [np.cumsum(x) for x in extreme_list]
+    is_done = np.logical_and.reduce([c >= stop_criteria for c in cum_cts])
+    done = bool(is_done.any())
+    i = np.argmax(is_done) if done else len(is_done) - 1
+    return [c[i] for c in cum_cts], i+1, done
+
+
+def _stored_null_counts(null_store, null_key, seq_context, simulate,
+                        is_extreme, num_permutations, stop_criteria,
+                        max_batch):
+    """Counts null statistics at least as extreme as the observed ones using
+    a stored null distribution, which is extended by simulation if it does
+    not reach the stopping criteria.
+
+    Parameters
+    ----------
+    null_store : NullStore
+        store of null distributions
+    null_key : str
+        key of the null distribution (see null_store.null_key)
+    seq_context : SequenceContext
+        sequence context whose random number generator is used for
+        simulations
+    simulate : function
+        takes a batch size and returns a tuple of arrays with the null
+        statistics of each permutation
+    is_extreme : function
+        takes the tuple of null statistic arrays and returns a list of
+        boolean arrays (see _early_stop_counts)
+    num_permutations : int
+        number of permutations to create for null
+    stop_criteria : int
+        stop after stop_criteria iterations are more significant
+        then the observed statistic.
+    max_batch : int
+        largest number of permutations simulated at once
+
+    Returns
+    -------
+    null_cts : list of int
+        number of permutations at least as extreme for each statistic
+    num_sim : int
+        number of permutations used
+    """
+    entry = null_store.load(null_key)
+    null, num_stored = None, 0
+    if entry is not None:
+        null_cts, num_sim, is_done = _early_stop_counts(is_extreme([x[:num_permutations] for x in entry['null']]),
+                                                        stop_criteria)
+        if is_done or len(entry['null'][0]) >= num_permutations:
+            return null_cts, num_sim
+
+        # extend the stored null with the same stream of permutations, or
+        # simulate it again from the start if it was truncated
+        if entry['prng_state'] is not None:
+            null = entry['null']
+            num_stored = len(null[0])
+            ns.set_prng_state(seq_context.prng, entry['prng_state'])
+
+    for batch_size in _growing_batch_sizes(num_permutations - num_stored,
+                                           max_batch,
+                                           min_batch=max(num_stored, 100)):
+        tmp_null = ns.compact_null(simulate(batch_size))
+        if null is None:
+            null = tmp_null
+        else:
+            null = tuple(np.concatenate([x, y]) for x, y in zip(null, tmp_null))
+        null_cts, num_sim, is_done = _early_stop_counts(is_extreme(null),
+                                                        stop_criteria)
+        if is_done:
+            break
+
+    # only keep the permutations used once the stopping criteria is reached,
+    # the random number generator state then no longer matches the end of
+    # the stored null
+    if is_done:
+        null_store.save(null_key, [x[:num_sim] for x in null])
+    else:
+        null_store.save(null_key, null, ns.get_prng_state(seq_context.prng))
+    logger.debug('Null distribution {0} extended from {1} to {2} permutations'.format(
+        null_key, num_stored, num_sim))
+
+    return null_cts, num_sim
 
 
 def deleterious_permutation(obs_del,
@@ -13,7 +164,8 @@ def deleterious_permutation(obs_del,
                             num_permutations=10000,
                             stop_criteria=100,
                             pseudo_count=0,
-                            max_batch=25000):
+                            max_batch=25000,
+                            null_store=None):
     """Performs null-permutations for deleterious mutation statistics
     in a single gene.
 
@@ -36,60 +188,73 @@ def deleterious_permutation(obs_del,
         Pseudo-count for number of deleterious mutations for each
         permutation of the null distribution. Increasing pseudo_count
         makes the statistical test more stringent.
+    null_store : NullStore or None
+        store of null distributions to reuse and extend (None to always
+        simulate the null distribution)
 
     Returns
     -------
     del_count_list : list
         list of deleterious mutation counts under the null
     """
+    if null_store is not None:
+        context_counts, context_to_mut = ns.canonical_signature(context_counts,
+                                                                context_to_mut)
     mycontexts = context_counts.index.tolist()
     somatic_base = [base
                     for one_context in mycontexts
                     for base in context_to_mut[one_context]]
-
-    # calculate the # of batches for simulations
-    max_batch = min(num_permutations, max_batch)
-    num_batches = num_permutations // max_batch
-    remainder = num_permutations % max_batch
-    batch_sizes = [max_batch] * num_batches
-    if remainder:
-        batch_sizes += [remainder]
-
-    num_sim = 0
+    base_ix = utils.encode_nucs(somatic_base)
+
+    if null_store is not None:
+        def simulate(batch_size):
+            tmp_mut_pos = seq_context.random_pos(context_counts.iteritems(),
+                                                 batch_size)
+            return (cutils.calc_deleterious_info_batch(gene_seq.effect_array,
+                                                       tmp_mut_pos,
+                                                       base_ix),)
+        null_key = ns.null_key('deleterious', context_counts, context_to_mut,
+                               seq_context, gene_seq)
+        null_cts, num_sim = _stored_null_counts(null_store, null_key, seq_context,
+                                                simulate,
+                                                lambda null: [null[0] >= obs_del],
+                                                num_permutations, stop_criteria,
+                                                max_batch)
+        return float(null_cts[0]) / num_sim
+
+    num_sim, num_drawn = 0, 0
     null_del_ct = 0
-    for j, batch_size in enumerate(batch_sizes):
+    for batch_size in _growing_batch_sizes(num_permutations, max_batch):
         # stop iterations if reached sufficient precision
         if null_del_ct >= stop_criteria:
-            #j = j - 1
             break
+        num_drawn += batch_size
 
         # get random positions determined by sequence context
-        tmp_contxt_pos = seq_context.random_pos(context_counts.iteritems(),
-                                                batch_size)
-        tmp_mut_pos = np.hstack(pos_array for base, pos_array in tmp_contxt_pos)
-
-        # determine result of random positions
-        for i, row in enumerate(tmp_mut_pos):
-            # get info about mutations
-            tmp_mut_info = mc.get_aa_mut_info(row,
-                                              somatic_base,
-                                              gene_seq)
-
-            # calc deleterious mutation info
-            tmp_del_count = cutils.calc_deleterious_info(tmp_mut_info['Reference AA'],
-                                                         tmp_mut_info['Somatic AA'],
-                                                         tmp_mut_info['Codon Pos'])
-
-            # update empricial null distribution
-            if tmp_del_count >= obs_del: null_del_ct += 1
+        tmp_mut_pos = seq_context.random_pos(context_counts.iteritems(),
+                                             batch_size)
+
+        # calc deleterious mutation info for the whole batch
+        tmp_del_count = cutils.calc_deleterious_info_batch(gene_seq.effect_array,
+                                                           tmp_mut_pos,
+                                                           base_ix)
+
+        # update empricial null distribution, stopping at the permutation
+        # where sufficient precision on the p-value was reached
+        cum_null_del_ct = np.cumsum(tmp_del_count >= obs_del)
+        num_needed = stop_criteria - null_del_ct
+        if cum_null_del_ct[-1] >= num_needed:
+            i = np.searchsorted(cum_null_del_ct, num_needed)
+            null_del_ct = stop_criteria
+        else:
+            i = batch_size - 1
+            null_del_ct += cum_null_del_ct[-1]
 
-            # stop if reach sufficient precision on p-value
-            if null_del_ct >= stop_criteria:
-                break
         # update number of simulations
         num_sim += i + 1
 
-    #num_sim = j*max_batch + i+1
+    logger.debug('{0}: {1} deleterious permutations drawn, {2} used'.format(
+        gene_seq.bed.gene_name, num_drawn, num_sim))
     del_pval = float(null_del_ct) / (num_sim)
 
     return del_pval
@@ -104,7 +269,8 @@ def position_permutation(obs_stat,
                          num_permutations=10000,
                          stop_criteria=100,
                          pseudo_count=0,
-                         max_batch=25000):
+                         max_batch=25000,
+                         null_store=None):
     """Performs null-permutations for position-based mutation statistics
     in a single gene.
 
@@ -123,6 +289,8 @@ def position_permutation(obs_stat,
         identified at positions along the gene.
     gene_seq : GeneSequence
         Sequence of gene of interest
+    gene_vest : np.array or None
+        dense VEST scores for the gene (see scores.vest_dict_to_array)
     num_permutations : int, default: 10000
         number of permutations to create for null
     stop_criteria : int
@@ -132,6 +300,9 @@ def position_permutation(obs_stat,
         Pseudo-count for number of recurrent missense mutations for each
         permutation for the null distribution. Increasing pseudo_count
         makes the statistical test more stringent.
+    null_store : NullStore or None
+        store of null distributions to reuse and extend (None to always
+        simulate the null distribution)
 
     Returns
     -------
@@ -141,64 +312,92 @@ def position_permutation(obs_stat,
         list of position entropy values under the null
     """
     # get contexts and somatic base
+    if null_store is not None:
+        context_counts, context_to_mut = ns.canonical_signature(context_counts,
+                                                                context_to_mut)
     mycontexts = context_counts.index.tolist()
     somatic_base = [base
                     for one_context in mycontexts
                     for base in context_to_mut[one_context]]
 
-    # calculate the # of batches for simulations
-    max_batch = min(num_permutations, max_batch)
-    num_batches = num_permutations // max_batch
-    remainder = num_permutations % max_batch
-    batch_sizes = [max_batch] * num_batches
-    if remainder:
-        batch_sizes += [remainder]
-
     obs_recur, obs_ent, obs_delta_ent, obs_vest = obs_stat
+
+    if null_store is not None:
+        def simulate(batch_size):
+            tmp_mut_pos = seq_context.random_pos(context_counts.iteritems(),
+                                                 batch_size)
+            batch_mut_info = mc.get_aa_mut_info_batch(tmp_mut_pos,
+                                                      somatic_base,
+                                                      gene_seq)
+            missense_mask = mc.get_missense_mask(batch_mut_info)
+            _, tmp_entropy, _ = cutils.calc_pos_info_batch(batch_mut_info['Codon Pos'],
+                                                           missense_mask,
+                                                           pseudo_count=pseudo_count,
+                                                           is_obs=0)
+            tmp_vest = scores.compute_vest_stat_batch(gene_vest,
+                                                      batch_mut_info['Reference AA'],
+                                                      batch_mut_info['Somatic AA'],
+                                                      batch_mut_info['Codon Pos'])
+            return tmp_entropy, tmp_vest
+
+        def is_extreme(null):
+            return [null[0]-utils.epsilon <= obs_ent,
+                    null[1]+utils.epsilon >= obs_vest]
+
+        null_key = ns.null_key('position', context_counts, context_to_mut,
+                               seq_context, gene_seq,
+                               pseudo_count=pseudo_count,
+                               vest=ns.array_digest(gene_vest))
+        null_cts, num_sim = _stored_null_counts(null_store, null_key, seq_context,
+                                                simulate, is_extreme,
+                                                num_permutations, stop_criteria,
+                                                max_batch)
+        ent_pval = float(null_cts[0]) / num_sim
+        vest_pval = float(null_cts[1]) / num_sim
+        return ent_pval, vest_pval
     num_sim = 0 # number of simulations
+    num_drawn = 0  # number of simulated positions, including unused ones
     null_num_recur_ct, null_entropy_ct, null_delta_entropy_ct, null_vest_ct = 0, 0, 0, 0
-    for j, batch_size in enumerate(batch_sizes):
+    for batch_size in _growing_batch_sizes(num_permutations, max_batch):
         # stop iterations if reached sufficient precision
         if null_vest_ct >= stop_criteria and null_entropy_ct >= stop_criteria:
             break
+        num_drawn += batch_size
 
         # get random positions determined by sequence context
-        tmp_contxt_pos = seq_context.random_pos(context_counts.iteritems(),
-                                                batch_size)
-        tmp_mut_pos = np.hstack(pos_array for base, pos_array in tmp_contxt_pos)
+        tmp_mut_pos = seq_context.random_pos(context_counts.iteritems(),
+                                             batch_size)
+        batch_mut_info = mc.get_aa_mut_info_batch(tmp_mut_pos,
+                                                  somatic_base,
+                                                  gene_seq)
+
+        # calculate position-based statistics for the whole batch
+        missense_mask = mc.get_missense_mask(batch_mut_info)
+        _, tmp_entropy, _ = cutils.calc_pos_info_batch(batch_mut_info['Codon Pos'],
+                                                       missense_mask,
+                                                       pseudo_count=pseudo_count,
+                                                       is_obs=0)
+
+        # get vest scores
+        tmp_vest = scores.compute_vest_stat_batch(gene_vest,
+                                                  batch_mut_info['Reference AA'],
+                                                  batch_mut_info['Somatic AA'],
+                                                  batch_mut_info['Codon Pos'])
+
+        # update empirical null distribution counts, stopping at the
+        # permutation where sufficient precision was reached
+        cum_entropy_ct = null_entropy_ct + np.cumsum(tmp_entropy-utils.epsilon <= obs_ent)
+        cum_vest_ct = null_vest_ct + np.cumsum(tmp_vest+utils.epsilon >= obs_vest)
+        is_done = (cum_entropy_ct >= stop_criteria) & (cum_vest_ct >= stop_criteria)
+        i = np.argmax(is_done) if is_done.any() else batch_size - 1
+        null_entropy_ct, null_vest_ct = cum_entropy_ct[i], cum_vest_ct[i]
 
-        # calculate position-based statistics as a result of random positions
-        for i, row in enumerate(tmp_mut_pos):
-            # get info about mutations
-            tmp_mut_info = mc.get_aa_mut_info(row,
-                                              somatic_base,
-                                              gene_seq)
-
-            # calculate position info
-            tmp_recur_ct, tmp_entropy, tmp_delta_entropy, _ = cutils.calc_pos_info(tmp_mut_info['Codon Pos'],
-                                                                                tmp_mut_info['Reference AA'],
-                                                                                tmp_mut_info['Somatic AA'],
-                                                                                pseudo_count=pseudo_count,
-                                                                                is_obs=0)
-            # get vest scores
-            if gene_vest:
-                tmp_vest = scores.compute_vest_stat(gene_vest,
-                                                    tmp_mut_info['Reference AA'],
-                                                    tmp_mut_info['Somatic AA'],
-                                                    tmp_mut_info['Codon Pos'])
-            else:
-                tmp_vest = 0.0
-
-            # update empirical null distribution counts
-            if tmp_entropy-utils.epsilon <= obs_ent: null_entropy_ct += 1
-            if tmp_vest+utils.epsilon >= obs_vest: null_vest_ct += 1
-
-            # stop iterations if reached sufficient precision
-            if null_vest_ct >= stop_criteria and null_entropy_ct >= stop_criteria:
-                break
         # update the number of simulations
         num_sim += i+1
 
+    logger.debug('{0}: {1} position permutations drawn, {2} used'.format(
+        gene_seq.bed.gene_name, num_drawn, num_sim))
+
     # calculate p-value from empirical null-distribution
     ent_pval = float(null_entropy_ct) / (num_sim)
     vest_pval = float(null_vest_ct) / (num_sim)
@@ -206,6 +405,51 @@ def position_permutation(obs_stat,
     return ent_pval, vest_pval
 
 
+def _normalize_graph_stat(graph_entropy, num_mut_codons, exp_rel_inc):
+    """Normalizes graph-smoothed entropy by the expected entropy given the
+    number of mutated codons, see protein_permutation."""
+    norm_stat = np.ones(len(graph_entropy))
+    has_mut = num_mut_codons > 0
+    norm_stat[has_mut] = graph_entropy[has_mut] / np.log2(exp_rel_inc*num_mut_codons[has_mut])
+    return norm_stat
+
+
+def _calibrate_graph_stat(graph_score, num_codons_obs,
+                          graph_entropy, coverage, num_mut_codons):
+    """Calibrates the graph statistic on a set of permutations, see
+    protein_permutation.
+
+    Returns
+    -------
+    exp_rel_inc : float
+        expected relative increase in coverage from smoothing on the graph
+    obs_stat : float
+        normalized statistic for the observed data
+    null_ct : int
+        number of calibration permutations at least as clustered as
+        the observed data
+    """
+    graph_entropy = np.hstack(graph_entropy)
+    coverage = np.hstack(coverage)
+    num_mut_codons = np.hstack(num_mut_codons)
+
+    # calculate the expected value of the relative increase in coverage
+    has_coverage = coverage > 0
+    rel_inc = coverage[has_coverage] / num_mut_codons[has_coverage].astype(float)
+    exp_rel_inc = np.mean(rel_inc)
+
+    # calculate observed statistic
+    if num_codons_obs:
+        obs_stat = graph_score / np.log2(exp_rel_inc*num_codons_obs)
+    else:
+        obs_stat = 1.0
+
+    # calculate statistics for simulated data
+    sim_stat = _normalize_graph_stat(graph_entropy, num_mut_codons, exp_rel_inc)
+    null_ct = np.sum(sim_stat-utils.epsilon <= obs_stat)
+    return exp_rel_inc, obs_stat, null_ct
+
+
 def protein_permutation(graph_score,
                         num_codons_obs,
                         context_counts,
@@ -215,7 +459,8 @@ def protein_permutation(graph_score,
                         gene_graph,
                         num_permutations=10000,
                         stop_criteria=100,
-                        pseudo_count=0):
+                        pseudo_count=0,
+                        max_batch=25000):
     """Performs null-simulations for position-based mutation statistics
     in a single gene.
 
@@ -236,6 +481,8 @@ def protein_permutation(graph_score,
         identified at positions along the gene.
     gene_seq : GeneSequence
         Sequence of gene of interest
+    gene_graph : scipy.sparse.csr_matrix
+        neighbor graph smoothing matrix (see scores.neighbor_graph_to_csr)
     num_permutations : int, default: 10000
         number of permutations to create for null
     stop_criteria : int
@@ -254,95 +501,92 @@ def protein_permutation(graph_score,
                     for one_context in mycontexts
                     for base in context_to_mut[one_context]]
 
-    # get random positions determined by sequence context
-    tmp_contxt_pos = seq_context.random_pos(context_counts.iteritems(),
-                                            num_permutations)
-    tmp_mut_pos = np.hstack(pos_array for base, pos_array in tmp_contxt_pos)
+    # the first permutations calibrate the expected relative increase
+    # in coverage from smoothing on the graph
+    num_calib = max(stop_criteria-1, 0)
+    calib_entropy, calib_coverage, calib_num_mut = [], [], []
+    exp_rel_inc, obs_stat = None, 1.0
 
-    # calculate position-based statistics as a result of random positions
+    num_sim = 0
     null_graph_entropy_ct = 0
-    coverage_list = []
-    num_mut_list = []
-    graph_entropy_list = []
-    for i, row in enumerate(tmp_mut_pos):
-        # calculate the expected value of the relative increase in coverage
-        if i == stop_criteria-1:
-            rel_inc = [coverage_list[k] / float(num_mut_list[k])
-                       for k in range(stop_criteria-1)
-                       if coverage_list[k]]
-            exp_rel_inc = np.mean(rel_inc)
-
-            # calculate observed statistic
-            if num_codons_obs:
-                obs_stat = graph_score / np.log2(exp_rel_inc*num_codons_obs)
-            else:
-                obs_stat = 1.0
-
-            # calculate statistics for simulated data
-            sim_stat_list = [ent / np.log2(exp_rel_inc*num_mut_list[l])
-                             for l, ent in enumerate(graph_entropy_list)]
-            null_graph_entropy_ct = len([s for s in sim_stat_list
-                                         if s-utils.epsilon <= obs_stat])
-
-        # get info about mutations
-        tmp_mut_info = mc.get_aa_mut_info(row,
-                                          somatic_base,
-                                          gene_seq)
-
-        # calculate position info
-        tmp_tuple = cutils.calc_pos_info(tmp_mut_info['Codon Pos'],
-                                         tmp_mut_info['Reference AA'],
-                                         tmp_mut_info['Somatic AA'],
-                                         pseudo_count=pseudo_count,
-                                         is_obs=0)
-        _, _, _, tmp_pos_ct = tmp_tuple
-
-        # record num of mut codons
-        if i < stop_criteria-1:
-            tmp_num_mut_codons = len(tmp_pos_ct)
-            num_mut_list.append(tmp_num_mut_codons)
-
-        # get entropy on graph-smoothed probability distribution
-        tmp_graph_entropy, tmp_coverage = scores.compute_ng_stat(gene_graph, tmp_pos_ct)
-
-        # record the "coverage" in the graph
-        if i < stop_criteria-1:
-            coverage_list.append(tmp_coverage)
-            graph_entropy_list.append(tmp_graph_entropy)
-
-        # update empirical null distribution counts
-        if i >= stop_criteria:
-            #if tmp_graph_entropy-utils.epsilon <= graph_score:
-            if tmp_num_mut_codons:
-                sim_stat = tmp_graph_entropy / np.log2(exp_rel_inc*tmp_num_mut_codons)
-            else:
-                sim_stat = 1.0
-
-            # add count
-            if sim_stat-utils.epsilon <= obs_stat:
-                null_graph_entropy_ct += 1
-
+    for batch_size in _growing_batch_sizes(num_permutations, max_batch):
         # stop iterations if reached sufficient precision
         if null_graph_entropy_ct >= stop_criteria:
             break
 
+        # get random positions determined by sequence context
+        tmp_mut_pos = seq_context.random_pos(context_counts.iteritems(),
+                                             batch_size)
+        batch_mut_info = mc.get_aa_mut_info_batch(tmp_mut_pos,
+                                                  somatic_base,
+                                                  gene_seq)
+
+        # get entropy on graph-smoothed probability distribution
+        missense_mask = mc.get_missense_mask(batch_mut_info)
+        tmp_graph_entropy, tmp_coverage, tmp_num_mut = scores.compute_ng_stat_batch(
+            gene_graph, batch_mut_info['Codon Pos'], missense_mask)
+
+        # record the permutations used for calibration
+        num_calib_batch = min(max(num_calib - num_sim, 0), batch_size)
+        if exp_rel_inc is None:
+            calib_entropy.append(tmp_graph_entropy[:num_calib_batch])
+            calib_coverage.append(tmp_coverage[:num_calib_batch])
+            calib_num_mut.append(tmp_num_mut[:num_calib_batch])
+            if num_sim + num_calib_batch < num_calib:
+                num_sim += batch_size
+                continue
+            exp_rel_inc, obs_stat, null_graph_entropy_ct = _calibrate_graph_stat(
+                graph_score, num_codons_obs, calib_entropy,
+                calib_coverage, calib_num_mut)
+
+        # all permutations after the calibration permutations are used
+        # for the null distribution
+        start = num_calib_batch
+        if start == batch_size:
+            num_sim += batch_size
+            continue
+
+        # update empirical null distribution counts, stopping at the
+        # permutation where sufficient precision was reached
+        sim_stat = _normalize_graph_stat(tmp_graph_entropy[start:],
+                                         tmp_num_mut[start:],
+                                         exp_rel_inc)
+        cum_null_ct = null_graph_entropy_ct + np.cumsum(sim_stat-utils.epsilon <= obs_stat)
+        is_done = cum_null_ct >= stop_criteria
+        i = np.argmax(is_done) if is_done.any() else len(cum_null_ct) - 1
+        null_graph_entropy_ct = cum_null_ct[i]
+        num_sim += start + i + 1
+
+    # calibrate on all permutations if there were too few
+    if exp_rel_inc is None:
+        exp_rel_inc, obs_stat, null_graph_entropy_ct = _calibrate_graph_stat(
+            graph_score, num_codons_obs, calib_entropy,
+            calib_coverage, calib_num_mut)
+
     # calculate p-value from empirical null-distribution
-    protein_pval = float(null_graph_entropy_ct) / (i+1)
+    protein_pval = float(null_graph_entropy_ct) / num_sim
 
     return protein_pval, obs_stat
 
 
-def effect_permutation(context_counts,
+def effect_permutation(obs_ent,
+                       context_counts,
                        context_to_mut,
                        seq_context,
                        gene_seq,
                        num_permutations=10000,
-                       pseudo_count=0):
+                       stop_criteria=100,
+                       pseudo_count=0,
+                       max_batch=25000,
+                       return_null=False,
+                       null_store=None):
     """Performs null-permutations for effect-based mutation statistics
     in a single gene.
 
     Parameters
     ----------
+    obs_ent : float
+        entropy of effect for the observed mutations
     context_counts : pd.Series
         number of mutations for each context
     context_to_mut : dict
@@ -356,49 +600,145 @@ def effect_permutation(context_counts,
         Sequence of gene of interest
     num_permutations : int, default: 10000
         number of permutations to create for null
+    stop_criteria : int
+        stop after stop_criteria iterations are more significant
+        then the observed statistic.
     pseudo_count : int, default: 0
         Pseudo-count for number of recurrent missense mutations for each
         permutation for the null distribution. Increasing pseudo_count
         makes the statistical test more stringent.
+    return_null : bool, default: False
+        return the null distribution of all num_permutations instead of
+        the p-value, without early stopping
+    null_store : NullStore or None
+        store of null distributions to reuse and extend when computing the
+        p-value (None to always simulate the null distribution)
 
     Returns
     -------
-    effect_entropy_list : list
-        list of entropy of effect values under the null
-    recur_list : list
-        number of recurrent missense mutations
-    inactivating_list : list
-        number of inactivating mutations
+    ent_pval : float
+        p-value for the entropy of effect
+    effect_entropy_array : np.array
+        entropy of effect values under the null (only if return_null)
+    recur_array : np.array
+        number of recurrent missense mutations (only if return_null)
+    inactivating_array : np.array
+        number of inactivating mutations (only if return_null)
     """
+    use_store = null_store is not None and not return_null
+    if use_store:
+        context_counts, context_to_mut = ns.canonical_signature(context_counts,
+                                                                context_to_mut)
     mycontexts = context_counts.index.tolist()
     somatic_base = [base
                     for one_context in mycontexts
                     for base in context_to_mut[one_context]]
 
-    # get random positions determined by sequence context
-    tmp_contxt_pos = seq_context.random_pos(context_counts.iteritems(),
-                                            num_permutations)
-    tmp_mut_pos = np.hstack(pos_array for base, pos_array in tmp_contxt_pos)
-
-    # calculate position-based statistics as a result of random positions
-    effect_entropy_list, recur_list, inactivating_list = [], [], []
-    for row in tmp_mut_pos:
-        # get info about mutations
-        tmp_mut_info = mc.get_aa_mut_info(row,
-                                          somatic_base,
-                                          gene_seq)
-
-        # calculate position info
-        tmp_entropy, tmp_recur, tmp_inactivating = cutils.calc_effect_info(tmp_mut_info['Codon Pos'],
-                                                                           tmp_mut_info['Reference AA'],
-                                                                           tmp_mut_info['Somatic AA'],
-                                                                           pseudo_count=pseudo_count,
-                                                                           is_obs=0)
-        effect_entropy_list.append(tmp_entropy)
-        recur_list.append(tmp_recur)
-        inactivating_list.append(tmp_inactivating)
-
-    return effect_entropy_list, recur_list, inactivating_list
+    if use_store:
+        def simulate(batch_size):
+            tmp_mut_pos = seq_context.random_pos(context_counts.iteritems(),
+                                                 batch_size)
+            batch_mut_info = mc.get_aa_mut_info_batch(tmp_mut_pos,
+                                                      somatic_base,
+                                                      gene_seq)
+            return _calc_effect_info_batch(batch_mut_info, pseudo_count)[:1]
+        null_key = ns.null_key('effect', context_counts, context_to_mut,
+                               seq_context, gene_seq,
+                               pseudo_count=pseudo_count)
+        null_cts, num_sim = _stored_null_counts(null_store, null_key, seq_context,
+                                                simulate,
+                                                lambda null: [null[0]-utils.epsilon <= obs_ent],
+                                                num_permutations, stop_criteria,
+                                                max_batch)
+        return float(null_cts[0]) / num_sim
+
+    num_sim = 0
+    null_entropy_ct = 0
+    null_list = []
+    for batch_size in _growing_batch_sizes(num_permutations, max_batch):
+        # stop iterations if reached sufficient precision
+        if null_entropy_ct >= stop_criteria and not return_null:
+            break
+
+        # get random positions determined by sequence context
+        tmp_mut_pos = seq_context.random_pos(context_counts.iteritems(),
+                                             batch_size)
+        batch_mut_info = mc.get_aa_mut_info_batch(tmp_mut_pos,
+                                                  somatic_base,
+                                                  gene_seq)
+
+        # calculate effect-based statistics for the whole batch
+        tmp_entropy, tmp_recur, tmp_inactivating = _calc_effect_info_batch(batch_mut_info,
+                                                                           pseudo_count)
+        if return_null:
+            null_list.append((tmp_entropy, tmp_recur, tmp_inactivating))
+            continue
+
+        # update empirical null distribution counts, stopping at the
+        # permutation where sufficient precision was reached
+        cum_entropy_ct = null_entropy_ct + np.cumsum(tmp_entropy-utils.epsilon <= obs_ent)
+        is_done = cum_entropy_ct >= stop_criteria
+        i = np.argmax(is_done) if is_done.any() else batch_size - 1
+        null_entropy_ct = cum_entropy_ct[i]
+
+        # update the number of simulations
+        num_sim += i+1
+
+    if return_null:
+        effect_entropy_array, recur_array, inactivating_array = [np.hstack(x) for x in zip(*null_list)]
+        return effect_entropy_array, recur_array, inactivating_array
+
+    # calculate p-value from empirical null-distribution
+    ent_pval = float(null_entropy_ct) / (num_sim)
+
+    return ent_pval
+
+
+def _calc_effect_info_batch(aa_info, pseudo_count=0):
+    """Calculates the simulated effect-based statistics of
+    cutils.calc_effect_info for a batch of permutations.
+
+    Inactivating mutations are treated as mutations at a single extra
+    position (codon position -1), so the statistics can be computed with
+    cutils.calc_pos_info_batch.
+
+    Parameters
+    ----------
+    aa_info : dict
+        output of mutation_context.get_aa_mut_info_batch
+    pseudo_count : int, default: 0
+        Pseudo-count for number of recurrent missense mutations
+
+    Returns
+    -------
+    effect_entropy : np.array
+        entropy of effect for each permutation
+    num_recur : np.array
+        number of recurrent missense mutations
+    num_inactivating : np.array
+        number of inactivating mutations
+    """
+    codon_pos = aa_info['Codon Pos']
+    ref_aa, somatic_aa = aa_info['Reference AA'], aa_info['Somatic AA']
+
+    # classify mutations like cutils.calc_effect_info
+    is_missense = mc.get_missense_mask(aa_info).astype(bool) & (codon_pos != 0)
+    is_inactivating = ~is_missense & (
+        (((ref_aa == utils.stop_int) | (somatic_aa == utils.stop_int) |
+          (codon_pos == 0)) & (ref_aa != somatic_aa)) |
+        (ref_aa == utils.splice_int) | (somatic_aa == utils.splice_int))
+
+    effect_pos = np.where(is_inactivating, -1, codon_pos)
+    effect_mask = (is_missense | is_inactivating).astype(np.uint8)
+    num_recur, effect_entropy, _ = cutils.calc_pos_info_batch(effect_pos,
+                                                              effect_mask,
+                                                              pseudo_count=pseudo_count,
+                                                              is_obs=0)
+
+    # inactivating mutations are not counted as recurrent missense mutations
+    num_inactivating = is_inactivating.sum(axis=1)
+    num_recur = num_recur - np.where(num_inactivating >= 2, num_inactivating, 0)
+    return effect_entropy, num_recur, num_inactivating
 
 
 def non_silent_ratio_permutation(context_counts,
@@ -435,23 +775,14 @@ def non_silent_ratio_permutation(context_counts,
                     for base in context_to_mut[one_context]]
 
     # get random positions determined by sequence context
-    tmp_contxt_pos = seq_context.random_pos(context_counts.iteritems(),
-                                            num_permutations)
-    tmp_mut_pos = np.hstack(pos_array for base, pos_array in tmp_contxt_pos)
+    tmp_mut_pos = seq_context.random_pos(context_counts.iteritems(),
+                                         num_permutations)
 
     # determine result of random positions
-    non_silent_count_list = []
-    for row in tmp_mut_pos:
-        # get info about mutations
-        tmp_mut_info = mc.get_aa_mut_info(row,
-                                          somatic_base,
-                                          gene_seq)
-
-        # calc deleterious mutation info
-        tmp_non_silent = cutils.calc_non_silent_info(tmp_mut_info['Reference AA'],
-                                                     tmp_mut_info['Somatic AA'],
-                                                     tmp_mut_info['Codon Pos'])
-        non_silent_count_list.append(tmp_non_silent)
+    non_silent_count_array = cutils.calc_non_silent_info_batch(gene_seq.effect_array,
+                                                               tmp_mut_pos,
+                                                               utils.encode_nucs(somatic_base))
+    non_silent_count_list = non_silent_count_array.tolist()
     return non_silent_count_list
 
 
@@ -484,46 +815,63 @@ def summary_permutation(context_counts,
 
     Returns
     -------
-    summary_info_list : list of lists
-        list of non-silent and silent mutation counts under the null along
-        with information on recurrent missense counts and missense positional
-        entropy.
+    summary_info : OrderedDict
+        column arrays (one entry per permutation) of non-silent and silent
+        mutation counts under the null along with information on recurrent
+        missense counts, missense positional entropy and scores
+    missense_pos_ct : tuple
+        number of missense mutations at each mutated codon for every
+        permutation (see mutation_context.count_missense_positions)
     """
     mycontexts = context_counts.index.tolist()
     somatic_base = [base
                     for one_context in mycontexts
                     for base in context_to_mut[one_context]]
+    base_ix = utils.encode_nucs(somatic_base)
 
     # get random positions determined by sequence context
-    tmp_contxt_pos = seq_context.random_pos(context_counts.iteritems(),
-                                            num_permutations)
-    tmp_mut_pos = np.hstack(pos_array for base, pos_array in tmp_contxt_pos)
+    tmp_mut_pos = seq_context.random_pos(context_counts.iteritems(),
+                                         num_permutations)
+    batch_mut_info = mc.get_aa_mut_info_batch(tmp_mut_pos,
+                                              somatic_base,
+                                              gene_seq)
+    codon_pos = batch_mut_info['Codon Pos']
+    missense_mask = mc.get_missense_mask(batch_mut_info)
 
     # determine result of random positions
     gene_name = gene_seq.bed.gene_name
     gene_len = gene_seq.bed.cds_len
-    summary_info_list = []
-    for i, row in enumerate(tmp_mut_pos):
-        # get info about mutations
-        tmp_mut_info = mc.get_aa_mut_info(row,
-                                          somatic_base,
-                                          gene_seq)
-
-        # Get all metrics summarizing each gene
-        tmp_summary = cutils.calc_summary_info(tmp_mut_info['Reference AA'],
-                                               tmp_mut_info['Somatic AA'],
-                                               tmp_mut_info['Codon Pos'],
-                                               gene_name,
-                                               score_dir,
-                                               min_frac=min_frac,
-                                               min_recur=min_recur)
-
-        # limit the precision of floats
-        #pos_ent = tmp_summary[-1]
-        #tmp_summary[-1] = '{0:.5f}'.format(pos_ent)
-
-        summary_info_list.append([gene_name, i+1, gene_len]+tmp_summary)
-    return summary_info_list
+    summary_info = OrderedDict()
+    summary_info['Gene'] = np.array([gene_name]*num_permutations, dtype=object)
+    summary_info['ID'] = np.arange(1, num_permutations+1)
+    summary_info['gene length'] = np.repeat(gene_len, num_permutations)
+
+    # count the mutation types
+    non_silent_info = cutils.calc_non_silent_info_batch(gene_seq.effect_array,
+                                                        tmp_mut_pos,
+                                                        base_ix)
+    for k, col in enumerate(summary_count_cols):
+        summary_info[col] = non_silent_info[:, k]
+
+    # missense position metrics
+    num_recur, pos_ent, _ = cutils.calc_pos_info_batch(codon_pos,
+                                                       missense_mask,
+                                                       min_frac=min_frac,
+                                                       min_recur=min_recur)
+    summary_info['recurrent missense'] = num_recur
+    summary_info['normalized missense position entropy'] = pos_ent
+
+    # add score information if user specified a directory
+    if score_dir:
+        total_mga_ent, total_vest = scores.retrieve_scores_batch(gene_name, score_dir, codon_pos,
+                                                                 batch_mut_info['Reference AA'],
+                                                                 batch_mut_info['Somatic AA'],
+                                                                 missense_mask)
+        summary_info['Total Missense MGAEntropy'] = total_mga_ent
+        summary_info['Total Missense VEST Score'] = total_vest
+
+    missense_pos_ct = mc.count_missense_positions(codon_pos, missense_mask)
+    return summary_info, missense_pos_ct
 
 
 def maf_permutation(context_counts,
@@ -558,62 +906,120 @@ def maf_permutation(context_counts,
     maf_list : list of tuples
         list of null mutations with mutation info in a MAF like format
     """
+    maf_list = []
+    for maf_block in maf_permutation_blocks(context_counts,
+                                            context_to_mut,
+                                            seq_context,
+                                            gene_seq,
+                                            num_permutations):
+        maf_list.extend(maf_block)
+    return maf_list
+
+
+def maf_permutation_blocks(context_counts,
+                           context_to_mut,
+                           seq_context,
+                           gene_seq,
+                           num_permutations=10000,
+                           max_rows=100000):
+    """Generator version of :func:`maf_permutation` which yields the
+    simulated MAF lines in blocks, so that all permutations of a gene
+    never need to be held in memory at once.
+
+    Each block contains all of the mutations for a consecutive set of
+    permutations. The number of permutations in a block is chosen so that
+    a block holds at most max_rows lines (at least one permutation is
+    always included).
+
+    Parameters
+    ----------
+    context_counts : pd.Series
+        number of mutations for each context
+    context_to_mut : dict
+        dictionary mapping nucleotide context to a list of observed
+        somatic base changes.
+    seq_context : SequenceContext
+        Sequence context for the entire gene sequence (regardless
+        of where mutations occur). The nucleotide contexts are
+        identified at positions along the gene.
+    gene_seq : GeneSequence
+        Sequence of gene of interest
+    num_permutations : int, default: 10000
+        number of permutations to create for null
+    max_rows : int, default: 100000
+        maximum number of MAF lines in a block
+
+    Yields
+    ------
+    maf_list : list of lists
+        null mutations of a block of permutations in a MAF like format
+    """
     mycontexts = context_counts.index.tolist()
     somatic_base, base_context = zip(*[(base, one_context)
                                        for one_context in mycontexts
                                        for base in context_to_mut[one_context]])
+    base_ix = utils.encode_nucs(somatic_base)
 
-    # get random positions determined by sequence context
-    tmp_contxt_pos = seq_context.random_pos(context_counts.iteritems(),
-                                            num_permutations)
-    tmp_mut_pos = np.hstack(pos_array for base, pos_array in tmp_contxt_pos)
+    # somatic base as reported on the genomic strand
+    strand = gene_seq.bed.strand
+    if strand == '-':
+        genome_base = [utils.rev_comp(b) for b in somatic_base]
+    else:
+        genome_base = list(somatic_base)
 
     # info about gene
     gene_name = gene_seq.bed.gene_name
-    strand = gene_seq.bed.strand
     chrom = gene_seq.bed.chrom
     gene_seq.bed.init_genome_coordinates()  # map seq pos to genome
 
-    # determine result of random positions
-    maf_list = []
-    for row in tmp_mut_pos:
-        # get genome coordinate
-        pos2genome = np.vectorize(lambda x: gene_seq.bed.seqpos2genome[x]+1)
-        genome_coord = pos2genome(row)
-
-        # get info about mutations
-        tmp_mut_info = mc.get_aa_mut_info(row,
-                                          somatic_base,
-                                          gene_seq)
-
-        # get string describing variant
-        var_class = cutils.get_variant_classification(tmp_mut_info['Reference AA'],
-                                                      tmp_mut_info['Somatic AA'],
-                                                      tmp_mut_info['Codon Pos'])
-
-        # prepare output
-        for k, mysomatic_base in enumerate(somatic_base):
-            # format DNA change
-            ref_nuc = tmp_mut_info['Reference Nuc'][k]
-            nuc_pos = row[k]
-            dna_change = 'c.{0}{1}>{2}'.format(ref_nuc, nuc_pos, mysomatic_base)
-
-            # format protein change
-            ref_aa = tmp_mut_info['Reference AA'][k]
-            somatic_aa = tmp_mut_info['Somatic AA'][k]
-            codon_pos = tmp_mut_info['Codon Pos'][k]
-            protein_change = 'p.{0}{1}{2}'.format(ref_aa, codon_pos, somatic_aa)
-
-            # reverse complement if on negative strand
-            if strand == '-':
-                ref_nuc = utils.rev_comp(ref_nuc)
-                mysomatic_base = utils.rev_comp(mysomatic_base)
-
-
-            # append results
-            maf_line = [gene_name, strand, chrom, genome_coord[k], genome_coord[k],
-                        ref_nuc, mysomatic_base, base_context[k], dna_change,
-                        protein_change, var_class[k].decode()]
-            maf_list.append(maf_line)
+    block_size = max(1, max_rows // len(somatic_base))
+    for num_done in range(0, num_permutations, block_size):
+        num_block = min(block_size, num_permutations - num_done)
 
-    return maf_list
+        # get random positions determined by sequence context
+        tmp_mut_pos = seq_context.random_pos(context_counts.iteritems(),
+                                             num_block)
+        batch_mut_info = mc.get_aa_mut_info_batch(tmp_mut_pos,
+                                                  somatic_base,
+                                                  gene_seq)
+        var_class_array = cutils.get_variant_classification_batch(gene_seq.effect_array,
+                                                                  tmp_mut_pos,
+                                                                  base_ix)
+
+        # determine result of random positions
+        maf_list = []
+        genome_coord_array = gene_seq.bed.seqpos_to_genome(tmp_mut_pos) + 1
+        for i, row in enumerate(tmp_mut_pos):
+            # get genome coordinate
+            genome_coord = genome_coord_array[i]
+
+            # get info about mutations
+            tmp_mut_info = mc.decode_aa_mut_info(batch_mut_info, i)
+
+            # get string describing variant
+            var_class = var_class_array[i]
+
+            # prepare output
+            for k, mysomatic_base in enumerate(somatic_base):
+                # format DNA change
+                ref_nuc = tmp_mut_info['Reference Nuc'][k]
+                nuc_pos = row[k]
+                dna_change = 'c.{0}{1}>{2}'.format(ref_nuc, nuc_pos, mysomatic_base)
+
+                # format protein change
+                ref_aa = tmp_mut_info['Reference AA'][k]
+                somatic_aa = tmp_mut_info['Somatic AA'][k]
+                codon_pos = tmp_mut_info['Codon Pos'][k]
+                protein_change = 'p.{0}{1}{2}'.format(ref_aa, codon_pos, somatic_aa)
+
+                # reverse complement if on negative strand
+                if strand == '-':
+                    ref_nuc = utils.rev_comp(ref_nuc)
+
+                # append results
+                maf_line = [gene_name, strand, chrom, genome_coord[k], genome_coord[k],
+                            ref_nuc, genome_base[k], base_context[k], dna_change,
+                            protein_change, var_class[k]]
+                maf_list.append(maf_line)
+
+        yield maf_list
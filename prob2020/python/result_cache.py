@@ -0,0 +1,99 @@
+"""This module handles an optional on-disk cache of the per-gene results of
+the randomization-based tests.
+
+A result is stored under a key hashing everything that determines it: the
+gene and its sequence, the mutations of the gene, and the options of the
+test (see cache_opts). Reruns with identical settings can therefore reuse
+the results of genes whose mutations did not change. Runs without a seed
+are not cached, since their results are random. Note that the key
+does not cover the content of score files, so the cache should be cleared
+if scores are updated.
+"""
+import prob2020
+import prob2020.python.utils as utils
+import hashlib
+import json
+import os
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)  # module logger
+
+# options which change the result of a gene
+cache_opts = ['kind', 'num_iterations', 'stop_criteria', 'context', 'seed',
+              'score_dir', 'neighbor_graph_dir', 'recurrent', 'fraction',
+              'deleterious', 'use_unmapped', 'genome']
+
+
+def gene_cache_key(gene_seq, mut_info, opts):
+    """Computes the cache key of a gene's result.
+
+    Parameters
+    ----------
+    gene_seq : GeneSequence
+        sequence of the gene, already set to the gene of interest
+    mut_info : pd.DataFrame
+        mutations of the gene with a 'Coding Position' column (NA for
+        mutations not mapped to the reference transcript)
+    opts : dict
+        options of the test
+
+    Returns
+    -------
+    cache_key : str
+        hex digest identifying the result
+    """
+    bed = gene_seq.bed
+    seq = '|'.join([gene_seq.exon_seq] + gene_seq.five_prime_seq + gene_seq.three_prime_seq)
+    coding_pos = mut_info['Coding Position'].values.astype(float)
+    key_info = {'version': prob2020.__version__,
+                'gene': [bed.gene_name, bed.chrom, bed.strand],
+                'sequence': hashlib.sha1(seq.encode('utf-8')).hexdigest(),
+                'coding position': np.where(np.isnan(coding_pos), -1, coding_pos).astype(int).tolist(),
+                'tumor allele': [str(a) for a in mut_info['Tumor_Allele']],
+                'opts': dict((k, opts.get(k)) for k in cache_opts),
+                # stored nulls are simulated in a canonical order
+                'null store': bool(opts.get('null_store'))}
+
+    # unmapped mutations are recovered from their genomic information
+    if opts.get('use_unmapped') and opts.get('genome'):
+        unmapped = mut_info[np.isnan(coding_pos)]
+        key_info['unmapped'] = unmapped.astype(str).values.tolist()
+
+    key_str = json.dumps(key_info, sort_keys=True)
+    return hashlib.sha1(key_str.encode('utf-8')).hexdigest()
+
+
+def _cache_path(cache_dir, cache_key):
+    return os.path.join(cache_dir, cache_key[:2], cache_key + '.json')
+
+
+def load_result(cache_dir, cache_key):
+    """Returns the cached result for a key, or None if there is none."""
+    path = _cache_path(cache_dir, cache_key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except ValueError:
+        logger.info('Ignoring corrupted cache file ({0})'.format(path))
+        return None
+
+
+def save_result(cache_dir, cache_key, result):
+    """Saves the result for a key.
+
+    The file is written under a temporary name and then renamed, so that
+    concurrent processes never read a partially written result.
+    """
+    path = _cache_path(cache_dir, cache_key)
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        if not os.path.isdir(os.path.dirname(path)):
+            raise
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as handle:
+        json.dump(result, handle, default=utils.json_default)
+    os.rename(tmp_path, path)
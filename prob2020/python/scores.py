@@ -1,8 +1,14 @@
 #from ..cython import cutils
 import numpy as np
+import scipy.sparse as sparse
 import os
 import prob2020.python.mymath as mymath
+import prob2020.python.utils as utils
+from collections import OrderedDict
+import json
+import struct
 import sys
+import logging
 
 # import pickle module
 try:
@@ -12,11 +18,244 @@ except:
         print('Falling back to regular pickle module')
     import pickle as pickle
 
+logger = logging.getLogger(__name__)  # module logger
+
+# identifies files written by write_score_store
+score_store_magic = b'PROB2020SCORES1\n'
+
+# layout of the VEST scores kept in a score store
+vest_record_dtype = np.dtype([('pos', '<i4'), ('ref', 'u1'),
+                              ('alt', 'u1'), ('score', '<f8')])
+
+# maximum number of genes kept by load_gene_scores
+score_cache_size = 256
+_score_cache = OrderedDict()
+
+# maximum number of dense VEST arrays kept by load_vest_array
+vest_array_cache_size = 32
+_vest_array_cache = OrderedDict()
+_score_stores = {}
+
+
+def _read_pickle(path):
+    """Reads a pickle file, returning None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    if sys.version_info < (3,):
+        # python 2.7 way
+        with open(path) as handle:
+            return pickle.load(handle)
+    else:
+        # python 3.X way
+        with open(path, 'rb') as handle:
+            return pickle.load(handle, encoding='latin-1')
+
+
+def _align(num_bytes, alignment=8):
+    return num_bytes + (-num_bytes % alignment)
+
+
+def write_score_store(score_dir, output_path, gene_names=None):
+    """Writes the MGA entropy and VEST scores of many genes into a single
+    score store file.
+
+    The file starts with a JSON index giving, for each gene, the range of
+    its MGA entropy scores and VEST score records. The scores themselves
+    follow as flat arrays that can be memory mapped (see ScoreStore).
+
+    Parameters
+    ----------
+    score_dir : str
+        directory containing the per gene pickle files
+    output_path : str
+        path to write the score store
+    gene_names : list or None
+        genes to include, by default all genes in score_dir
+    """
+    suffixes = ['.mgaentropy.pickle', '.vest.pickle']
+    if gene_names is None:
+        gene_names = sorted(set(f[:-len(suffix)]
+                                for f in os.listdir(score_dir)
+                                for suffix in suffixes
+                                if f.endswith(suffix)))
+
+    index, mga_list, vest_list = {}, [], []
+    num_mga, num_vest = 0, 0
+    for gname in gene_names:
+        mga_ent = _read_pickle(os.path.join(score_dir, gname+suffixes[0]))
+        vest_dict = _read_pickle(os.path.join(score_dir, gname+suffixes[1]))
+
+        # missing scores are marked by a range of -1
+        mga_range, vest_range = [-1, -1], [-1, -1]
+        if mga_ent is not None:
+            mga_ent = np.asarray(mga_ent, dtype='<f8')
+            mga_range = [num_mga, num_mga + len(mga_ent)]
+            num_mga += len(mga_ent)
+            mga_list.append(mga_ent)
+        if vest_dict is not None:
+            records = [(pos, utils.aa2int[ref_aa], utils.aa2int[somatic_aa], score)
+                       for pos in sorted(vest_dict)
+                       for ref_aa in vest_dict[pos]
+                       for somatic_aa, score in vest_dict[pos][ref_aa].items()
+                       if ref_aa in utils.aa2int and somatic_aa in utils.aa2int]
+            vest_range = [num_vest, num_vest + len(records)]
+            num_vest += len(records)
+            vest_list.append(np.array(records, dtype=vest_record_dtype))
+        index[gname] = mga_range + vest_range
+
+    header = json.dumps({'genes': index, 'num_mga': num_mga,
+                         'num_vest': num_vest}).encode('utf-8')
+    header_end = len(score_store_magic) + 8 + len(header)
+    with open(output_path, 'wb') as handle:
+        handle.write(score_store_magic)
+        handle.write(struct.pack('<Q', len(header)))
+        handle.write(header)
+        handle.write(b'\0' * (_align(header_end) - header_end))
+        for mga_ent in mga_list:
+            handle.write(mga_ent.tobytes())
+        for records in vest_list:
+            handle.write(records.tobytes())
+
+
+class ScoreStore(object):
+    """Memory mapped MGA entropy and VEST scores for many genes, as
+    written by write_score_store.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as handle:
+            magic = handle.read(len(score_store_magic))
+            if magic != score_store_magic:
+                raise ValueError('{0} is not a score store'.format(path))
+            header_len, = struct.unpack('<Q', handle.read(8))
+            header = json.loads(handle.read(header_len).decode('utf-8'))
+        self.index = header['genes']
+
+        # memory map the scores
+        mga_offset = _align(len(score_store_magic) + 8 + header_len)
+        vest_offset = mga_offset + 8*header['num_mga']
+        self.mga_data = self._memmap(path, np.dtype('<f8'),
+                                     mga_offset, header['num_mga'])
+        self.vest_data = self._memmap(path, vest_record_dtype,
+                                      vest_offset, header['num_vest'])
+
+    @staticmethod
+    def _memmap(path, dtype, offset, num):
+        if not num:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r',
+                         offset=offset, shape=(num,))
+
+    def __contains__(self, gname):
+        return gname in self.index
+
+    def read_mga(self, gname):
+        """Get the MGA entropy scores for a gene, None if not available."""
+        if gname not in self.index or self.index[gname][0] < 0:
+            return None
+        start, end = self.index[gname][:2]
+        return np.array(self.mga_data[start:end])
+
+    def read_vest(self, gname):
+        """Get the VEST scores for a gene as a nested dictionary (the
+        format of the VEST pickle files), None if not available."""
+        if gname not in self.index or self.index[gname][2] < 0:
+            return None
+        start, end = self.index[gname][2:]
+        vest_dict = {}
+        for pos, ref_ix, alt_ix, score in self.vest_data[start:end].tolist():
+            ref_dict = vest_dict.setdefault(pos, {})
+            ref_dict.setdefault(utils.aa_list[ref_ix], {})[utils.aa_list[alt_ix]] = score
+        return vest_dict
+
+
+def load_gene_scores(gname, score_dir):
+    """Load the MGA entropy and VEST scores for a gene.
+
+    Scores are kept in a least recently used cache, so they are only read
+    once per process for each gene.
+
+    Parameters
+    ----------
+    gname : str
+        name of gene
+    score_dir : str
+        directory containing the per gene pickle files, or a score store
+        file written by write_score_store
+
+    Returns
+    -------
+    mga_ent : np.array or None
+        MGA entropy scores for the gene, None if not found
+    vest_dict : dict or None
+        VEST scores for the gene, None if not found
+    """
+    key = (score_dir, gname)
+    if key in _score_cache:
+        gene_scores = _score_cache.pop(key)
+    else:
+        if os.path.isfile(score_dir):
+            if score_dir not in _score_stores:
+                _score_stores[score_dir] = ScoreStore(score_dir)
+            store = _score_stores[score_dir]
+            gene_scores = (store.read_mga(gname), store.read_vest(gname))
+        else:
+            mga_path = os.path.join(score_dir, gname+".mgaentropy.pickle")
+            vest_path = os.path.join(score_dir, gname+".vest.pickle")
+            gene_scores = (_read_pickle(mga_path), _read_pickle(vest_path))
+
+        # drop the least recently used genes
+        while len(_score_cache) >= score_cache_size:
+            _score_cache.popitem(last=False)
+    _score_cache[key] = gene_scores
+    return gene_scores
+
+
+def load_vest_array(gname, score_dir, dtype=np.float32):
+    """Load the VEST scores for a gene as a dense array.
+
+    Like load_gene_scores, the dense arrays are kept in a least recently
+    used cache, so they are only built once per process for each gene. The
+    returned array is read-only since it is shared between callers.
+
+    Parameters
+    ----------
+    gname : str
+        name of gene
+    score_dir : str
+        directory containing vest scores, or a score store file
+    dtype : np.dtype, default: np.float32
+        data type of the returned array
+
+    Returns
+    -------
+    vest_array : np.array or None
+        VEST scores for the gene (see vest_dict_to_array), None if not
+        found
+    """
+    key = (score_dir, gname, np.dtype(dtype).str)
+    if key in _vest_array_cache:
+        vest_array = _vest_array_cache.pop(key)
+    else:
+        vest_dict = load_gene_scores(gname, score_dir)[1]
+        if vest_dict is None:
+            vest_array = None
+        else:
+            vest_array = vest_dict_to_array(vest_dict, dtype=dtype)
+            vest_array.flags.writeable = False
+
+        # drop the least recently used genes
+        while len(_vest_array_cache) >= vest_array_cache_size:
+            _vest_array_cache.popitem(last=False)
+    _vest_array_cache[key] = vest_array
+    return vest_array
+
+
 def retrieve_scores(gname, sdir,
                     codon_pos, germ_aa, somatic_aa,
                     default_mga=5., default_vest=0,
                     no_file_flag=-1):
-    """Retrieves scores from pickle files.
+    """Retrieves scores from pickle files or a score store.
 
     Used by summary script.
 
@@ -25,18 +264,7 @@ def retrieve_scores(gname, sdir,
     #var_class = cutils.get_variant_classification(germ_aa, somatic_aa, codon_pos)
 
     # get information about MGA entropy
-    mga_path = os.path.join(sdir, gname+".mgaentropy.pickle")
-    if os.path.exists(mga_path):
-        if sys.version_info < (3,):
-            # python 2.7 way
-            with open(mga_path) as handle:
-                mga_ent = pickle.load(handle)
-        else:
-            # python 3.X way
-            with open(mga_path, 'rb') as handle:
-                mga_ent = pickle.load(handle, encoding='latin-1')
-    else:
-        mga_ent = None
+    mga_ent, vest_score = load_gene_scores(gname, sdir)
     missense_pos = [p for i, p in enumerate(codon_pos)
                     if (germ_aa[i]!=somatic_aa[i]) and
                        (germ_aa[i] not in ['-', '*', 'Splice_Site']) and
@@ -55,18 +283,6 @@ def retrieve_scores(gname, sdir,
         #total_mga_ent = no_file_flag
 
     # get information about VEST scores
-    vest_path = os.path.join(sdir, gname+".vest.pickle")
-    if os.path.exists(vest_path):
-        if sys.version_info < (3,):
-            # python 2.7 way
-            with open(vest_path) as handle:
-                vest_score = pickle.load(handle)
-        else:
-            # python 3.X way
-            with open(vest_path, 'rb') as handle:
-                vest_score = pickle.load(handle, encoding='latin-1')
-    else:
-        vest_score = None
     total_vest = compute_vest_stat(vest_score,
                                    germ_aa, somatic_aa, codon_pos,
                                    stat_func=sum, default_val=default_vest)
@@ -79,6 +295,71 @@ def retrieve_scores(gname, sdir,
     return total_mga_ent, total_vest
 
 
+def retrieve_scores_batch(gname, sdir,
+                          codon_pos, germ_aa, somatic_aa, missense_mask,
+                          default_mga=5., default_vest=0):
+    """Retrieves total scores for a batch of permutations.
+
+    This is the batched counterpart of retrieve_scores, using integer
+    coded amino acids (see utils.aa_list) and codon positions.
+
+    Parameters
+    ----------
+    gname : str
+        name of gene
+    sdir : str
+        directory containing pickle files, or a score store file
+    codon_pos : np.array
+        N x M matrix of codon positions
+    germ_aa : np.array
+        N x M matrix of reference amino acids
+    somatic_aa : np.array
+        N x M matrix of somatic amino acids
+    missense_mask : np.array
+        N x M matrix, non-zero for missense mutations
+
+    Returns
+    -------
+    total_mga_ent : np.array
+        total MGA entropy of missense mutations for each permutation
+    total_vest : np.array
+        total VEST score for each permutation
+    """
+    mga_ent = load_gene_scores(gname, sdir)[0]
+    num_perm, num_mut = codon_pos.shape
+
+    # sum MGA entropy of missense mutations in range of the scores
+    total_mga_ent = default_mga * np.ones(num_perm)
+    if mga_ent is not None:
+        is_valid = (missense_mask > 0) & (codon_pos < len(mga_ent))
+        row_ix, col_ix = np.nonzero(is_valid)
+        mga_sum = np.bincount(row_ix, weights=mga_ent[codon_pos[row_ix, col_ix]],
+                              minlength=num_perm)
+        has_score = np.bincount(row_ix, minlength=num_perm) > 0
+        total_mga_ent[has_score] = mga_sum[has_score]
+
+    # sum VEST scores of all mutations, like retrieve_scores
+    total_vest = default_vest * np.ones(num_perm)
+    vest_array = load_vest_array(gname, sdir, dtype=np.float64)
+    if vest_array is not None and num_mut:
+        num_codons, num_aa = vest_array.shape[:2]
+        is_valid = ((codon_pos >= 0) & (codon_pos < num_codons) &
+                    (germ_aa < num_aa) & (somatic_aa < num_aa))
+        myscores = vest_array[np.where(is_valid, codon_pos, 0),
+                              np.where(is_valid, germ_aa, 0),
+                              np.where(is_valid, somatic_aa, 0)]
+        myscores[~is_valid] = 0
+        # add up the scores one mutation at a time, which is the same order
+        # as the python sum in retrieve_scores. Summing along the rows
+        # (e.g. with myscores.sum(axis=1)) uses pairwise summation, which
+        # can round differently and so change ties with the observed score.
+        total_vest = np.zeros(num_perm)
+        for j in range(num_mut):
+            total_vest += myscores[:, j]
+
+    return total_mga_ent, total_vest
+
+
 def read_vest_pickle(gname, score_dir):
     """Read in VEST scores for given gene.
 
@@ -87,24 +368,121 @@ def read_vest_pickle(gname, score_dir):
     gname : str
         name of gene
     score_dir : str
-        directory containing vest scores
+        directory containing vest scores, or a score store file
 
     Returns
     -------
     gene_vest : dict or None
         dict containing vest scores for gene. Returns None if not found.
     """
-    vest_path = os.path.join(score_dir, gname+".vest.pickle")
-    if os.path.exists(vest_path):
-        if sys.version_info < (3,):
-            with open(vest_path) as handle:
-                gene_vest = pickle.load(handle)
-        else:
-            with open(vest_path, 'rb') as handle:
-                gene_vest = pickle.load(handle, encoding='latin-1')
-        return gene_vest
-    else:
-        return None
+    gene_vest = load_gene_scores(gname, score_dir)[1]
+    return gene_vest
+
+
+def vest_dict_to_array(vest_dict, dtype=np.float32):
+    """Converts the VEST scores of a gene from a nested dictionary into a
+    dense array.
+
+    Parameters
+    ----------
+    vest_dict : dict
+        dictionary containing vest scores across the gene of interest,
+        keyed by codon position (1-based), reference AA and somatic AA
+    dtype : np.dtype, default: np.float32
+        data type of the returned array
+
+    Returns
+    -------
+    vest_array : np.array
+        array of shape (number of codons, 21, 21) indexed by the
+        codon position (0-based), and the integer coded reference and
+        somatic AA (see utils.aa_list). Missing scores are zero.
+    """
+    num_aa = utils.stop_int + 1
+    num_codons = max(max(vest_dict), 0) if vest_dict else 0
+    vest_array = np.zeros((num_codons, num_aa, num_aa), dtype=dtype)
+    for pos in vest_dict:
+        # codon positions are 1-based, other positions are never looked up
+        if not 1 <= pos <= num_codons:
+            logger.warning('Skipping VEST scores at invalid codon position '
+                           '{0}'.format(pos))
+            continue
+        for ref_aa in vest_dict[pos]:
+            ref_ix = utils.aa2int.get(ref_aa, num_aa)
+            for somatic_aa, score in vest_dict[pos][ref_aa].items():
+                somatic_ix = utils.aa2int.get(somatic_aa, num_aa)
+                if ref_ix < num_aa and somatic_ix < num_aa:
+                    vest_array[pos-1, ref_ix, somatic_ix] = score
+    return vest_array
+
+
+def read_vest_array(gname, score_dir):
+    """Read in VEST scores for given gene as a dense array.
+
+    Parameters
+    ----------
+    gname : str
+        name of gene
+    score_dir : str
+        directory containing vest scores, or a score store file
+
+    Returns
+    -------
+    gene_vest : np.array or None
+        array containing vest scores for gene (see vest_dict_to_array).
+        Returns None if not found.
+    """
+    return load_vest_array(gname, score_dir)
+
+
+def compute_vest_stat_batch(vest_array, ref_aa, somatic_aa, codon_pos,
+                            default_val=0.0):
+    """Compute the mean missense VEST score for a batch of permutations.
+
+    This is the vectorized counterpart of compute_vest_stat, using integer
+    coded amino acids (see utils.aa_list) and codon positions (-1 for
+    splice sites). As in compute_vest_stat, non-missense mutations are not
+    filtered out and take a score of zero.
+
+    Parameters
+    ----------
+    vest_array : np.array or None
+        dense vest scores for the gene of interest (see vest_dict_to_array)
+    ref_aa : np.array
+        N x M matrix of reference amino acids
+    somatic_aa : np.array
+        N x M matrix of somatic mutation amino acids
+    codon_pos : np.array
+        N x M matrix of codon positions in the protein sequence
+    default_val : float
+        default value to return if there are no mutations
+
+    Returns
+    -------
+    score_stat : np.array
+        mean vest score for each of the N permutations
+    """
+    codon_pos = np.asarray(codon_pos)
+    if codon_pos.ndim == 1:
+        codon_pos = codon_pos.reshape(1, -1)
+    ref_aa = np.asarray(ref_aa).reshape(codon_pos.shape)
+    somatic_aa = np.asarray(somatic_aa).reshape(codon_pos.shape)
+
+    # return default value if VEST scores or mutations are missing
+    num_perm, num_mut = codon_pos.shape
+    if vest_array is None or not num_mut:
+        return default_val * np.ones(num_perm)
+
+    # gather scores, where invalid positions or AA take a score of zero
+    num_codons, num_aa = vest_array.shape[:2]
+    is_valid = ((codon_pos >= 0) & (codon_pos < num_codons) &
+                (ref_aa < num_aa) & (somatic_aa < num_aa))
+    myscores = vest_array[np.where(is_valid, codon_pos, 0),
+                          np.where(is_valid, ref_aa, 0),
+                          np.where(is_valid, somatic_aa, 0)]
+    myscores[~is_valid] = 0
+    score_stat = myscores.mean(axis=1, dtype=np.float64)
+    return score_stat
 
 
 def compute_vest_stat(vest_dict, ref_aa, somatic_aa, codon_pos,
@@ -332,3 +710,93 @@ def compute_ng_stat(gene_graph, pos_ct, alpha=.5):
     coverage = np.count_nonzero(p)
 
     return graph_score, coverage
+
+
+def neighbor_graph_to_csr(gene_graph, alpha=.5):
+    """Converts a neighbor graph into a sparse matrix which smooths
+    mutation counts over the graph (see compute_ng_stat).
+
+    Parameters
+    ----------
+    gene_graph : dict
+        Graph of spatially near codons. keys = nodes, edges = key -> value.
+    alpha : float
+        smoothing factor
+
+    Returns
+    -------
+    graph_matrix : scipy.sparse.csr_matrix
+        codon by codon matrix, where row i contains the weight a mutation
+        at codon i gives to itself and its neighbors. Codons which are not
+        nodes in the graph have an empty row.
+    """
+    rows, cols, data = [], [], []
+    for pos in gene_graph:
+        neighbors = set(gene_graph[pos])
+        rows += [pos] * (len(neighbors) + 1)
+        cols += list(neighbors) + [pos]
+        data += [alpha] * len(neighbors) + [1-alpha]
+    num_codons = max(max(rows), max(cols)) + 1 if rows else 0
+    graph_matrix = sparse.coo_matrix((data, (rows, cols)),
+                                     shape=(num_codons, num_codons)).tocsr()
+    return graph_matrix
+
+
+def compute_ng_stat_batch(graph_matrix, codon_pos, missense_mask):
+    """Compute the clustering score on a neighbor graph for a batch of
+    permutations.
+
+    This is the batched counterpart of compute_ng_stat. Missense counts of
+    all permutations are smoothed over the graph with a single sparse
+    matrix product.
+
+    Parameters
+    ----------
+    graph_matrix : scipy.sparse.csr_matrix
+        neighbor graph smoothing matrix (see neighbor_graph_to_csr)
+    codon_pos : np.array
+        N x M matrix of codon positions
+    missense_mask : np.array
+        N x M matrix, non-zero for missense mutations
+
+    Returns
+    -------
+    graph_score : np.array
+        score measuring the clustering of missense mutations in the graph
+    coverage : np.array
+        number of nodes that received non-zero weight
+    num_mut_codons : np.array
+        number of codons with a missense mutation
+    """
+    num_perm, num_codons = len(codon_pos), graph_matrix.shape[0]
+    row_ix, col_ix = np.nonzero(missense_mask)
+    mut_pos = np.asarray(codon_pos)[row_ix, col_ix]
+
+    # make sure all mutated codons are in the graph
+    is_node = np.diff(graph_matrix.indptr) > 0
+    if np.any(mut_pos >= num_codons) or not np.all(is_node[mut_pos]):
+        raise ValueError('Codon position is not in the neighbor graph')
+
+    # count missense mutations at each codon
+    counts = sparse.coo_matrix((np.ones(len(mut_pos)), (row_ix, mut_pos)),
+                               shape=(num_perm, num_codons)).tocsr()
+    num_mut_codons = np.diff(counts.indptr)
+
+    # smooth out mutation counts
+    codon_vals = counts.dot(graph_matrix).tocsr()
+    codon_vals.eliminate_zeros()
+
+    # compute regular entropy of each row
+    vals_row_ix = np.repeat(np.arange(num_perm), np.diff(codon_vals.indptr))
+    row_sum = np.bincount(vals_row_ix, weights=codon_vals.data, minlength=num_perm)
+    p = codon_vals.data / row_sum[vals_row_ix]
+    graph_score = -np.bincount(vals_row_ix, weights=p*np.log2(p),
+                               minlength=num_perm).astype(float)
+
+    # get coverage
+    coverage = np.diff(codon_vals.indptr)
+
+    # skip if there are no missense mutations
+    graph_score[num_mut_codons == 0] = 1.0
+
+    return graph_score, coverage, num_mut_codons
@@ -11,7 +11,7 @@ class SequenceContext(object):
     def __init__(self, gene_seq, seed=None):
         self._init_context(gene_seq)
         self.seed = seed  # seed for random number generator
-        self.prng = np.random.RandomState(seed=self.seed)
+        self.prng = utils.gene_prng(self.seed, gene_seq.bed.gene_name)
 
     def _init_context(self, gene_seq):
         """Initializes attributes defining mutation contexts and their position.
@@ -150,6 +150,30 @@ class SequenceContext(object):
                 self.pos2context[i] = 'None'
             self.context2pos['None'] = range(gene_len + five_ss_len + three_ss_len)
 
+        self._init_context_buffer()
+
+    def _init_context_buffer(self):
+        """Stores the positions for every context in a single contiguous
+        integer array.
+
+        The self.context2pos values become views into the buffer, while
+        self.context_offset and self.context_len record where each
+        context's positions start and how many there are.
+        """
+        contexts = sorted(self.context2pos)
+        self.context_offset, self.context_len = {}, {}
+        offset = 0
+        for c in contexts:
+            self.context_offset[c] = offset
+            self.context_len[c] = len(self.context2pos[c])
+            offset += self.context_len[c]
+        self.pos_buffer = np.empty(offset, dtype=np.int64)
+        for c in contexts:
+            start = self.context_offset[c]
+            end = start + self.context_len[c]
+            self.pos_buffer[start:end] = self.context2pos[c]
+            self.context2pos[c] = self.pos_buffer[start:end]
+
     def is_valid_context(self, ctxt):
         """Checks if provided context is valid (previously seen).
 
@@ -184,25 +208,17 @@ class SequenceContext(object):
             num_permutations X num sized array that represents the
             randomly sampled positions for a specific context.
         """
-        # make sure provide context is valid
-        if not self.is_valid_context(context):
-            error_msg = 'Context ({0}) was never seen in sequence.'.format(context)
-            raise ValueError(error_msg)
-
-        # make sure sampling is a positive integer
-        if num < 1:
-            error_msg = ('There must be at least one sample (specified {0}) '
-                         'for a context'.format(num))
-            raise ValueError(error_msg)
-
-        # randomly select from available positions that fit the specified context
-        available_pos = self.context2pos[context]
-        random_pos = self.prng.choice(available_pos, (num_permutations, num))
+        random_pos = self.random_pos([(context, num)], num_permutations)
         return random_pos
 
     def random_pos(self, context_iterable, num_permutations):
         """Obtains random positions w/ replacement which match sequence context.
 
+        All positions are drawn at once. Each column corresponds to one
+        mutation, with its own offset and number of positions in the
+        contiguous buffer of context positions, so a single draw of
+        random integers is offset into the buffer.
+
         Parameters
         ----------
         context_iterable: iterable containing two element tuple
@@ -213,13 +229,36 @@ class SequenceContext(object):
 
         Returns
         -------
-        position_list : list
-            Contains context string and the randomly chosen positions
-            for that context.
+        random_pos : np.array
+            num_permutations X total number of mutations array of randomly
+            sampled positions. Columns follow the order of context_iterable.
         """
-        position_list = []
+        col_offset, col_len = [], []
         for contxt, n in context_iterable:
-            pos_array = self.random_context_pos(n, num_permutations, contxt)
-            position_list.append([contxt, pos_array])
-        return position_list
+            # make sure provide context is valid
+            if not self.is_valid_context(contxt):
+                error_msg = 'Context ({0}) was never seen in sequence.'.format(contxt)
+                raise ValueError(error_msg)
+
+            # make sure sampling is a positive integer
+            if n < 1:
+                error_msg = ('There must be at least one sample (specified {0}) '
+                             'for a context'.format(n))
+                raise ValueError(error_msg)
+
+            col_offset += [self.context_offset[contxt]] * n
+            col_len += [self.context_len[contxt]] * n
+        col_offset = np.array(col_offset, dtype=np.int64)
+        col_len = np.array(col_len, dtype=np.int64)
 
+        # randomly select from available positions that fit each context
+        random_pos = np.empty((num_permutations, len(col_len)), dtype=np.int64)
+        if hasattr(self.prng, 'integers'):
+            rand_ix = self.prng.integers(0, col_len, size=random_pos.shape)
+        else:
+            # legacy RandomState can not draw with a different upper
+            # bound for each column
+            rand_ix = self.prng.random_sample(random_pos.shape) * col_len
+            rand_ix = np.minimum(rand_ix.astype(np.int64), col_len - 1)
+        random_pos[:] = self.pos_buffer[col_offset + rand_ix]
+        return random_pos
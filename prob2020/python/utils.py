@@ -6,6 +6,8 @@ import csv
 from collections import OrderedDict
 from functools import wraps
 import warnings
+import hashlib
+import struct
 
 # logging import
 import logging
@@ -34,6 +36,68 @@ codon_table = {'TTT': 'F', 'TTC': 'F', 'TTA': 'L', 'TTG': 'L', 'TCT': 'S',
                'GGG': 'G', 'TAA': '*', 'TAG': '*', 'TGA': '*',
                'Splice_Site': 'Splice_Site'}
 
+# integer coding of amino acid residues used for batches of permutations.
+# The stop codon, splice sites and unknown residues (e.g. codons
+# containing an N) are given their own codes.
+aa_list = ['A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L',
+           'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y',
+           '*', 'Splice_Site', None]
+aa2int = dict((aa, i) for i, aa in enumerate(aa_list))
+aa_array = np.array(aa_list, dtype=object)  # decode integer codes
+stop_int = aa2int['*']
+splice_int = aa2int['Splice_Site']
+unknown_aa_int = aa2int[None]
+
+# integer coding of nucleotides
+nuc_list = ['A', 'C', 'G', 'T']
+nuc2int = dict((nuc, i) for i, nuc in enumerate(nuc_list))
+unknown_nuc_int = len(nuc_list)  # any other letter, e.g. N
+nuc_array = np.array(nuc_list + ['N'], dtype=object)  # decode integer codes
+nuc_ascii_table = np.empty(256, dtype=np.uint8)  # encode ascii characters
+nuc_ascii_table[:] = unknown_nuc_int
+for i, nuc in enumerate(nuc_list):
+    nuc_ascii_table[ord(nuc)] = i
+
+# integer coded codons (16*first + 4*second + third nucleotide) mapped to
+# integer coded amino acids. The extra final entry is for unknown codons.
+codon_aa_table = np.array([aa2int[codon_table[a+b+c]]
+                           for a in nuc_list
+                           for b in nuc_list
+                           for c in nuc_list] + [unknown_aa_int])
+unknown_codon_int = 64
+
+
+def _mutated_codon_aa_table():
+    """Creates a 64 x 3 x 4 table of the integer coded amino acid after
+    mutating a codon (first axis) at a position within the codon (second
+    axis) to a new nucleotide (third axis)."""
+    mut_table = np.empty((64, 3, len(nuc_list)), dtype=int)
+    for codon_ix in range(64):
+        codon = [codon_ix // 16, (codon_ix // 4) % 4, codon_ix % 4]
+        for pos_in_codon in range(3):
+            for nuc_ix in range(len(nuc_list)):
+                mut_codon = list(codon)
+                mut_codon[pos_in_codon] = nuc_ix
+                mut_codon_ix = 16*mut_codon[0] + 4*mut_codon[1] + mut_codon[2]
+                mut_table[codon_ix, pos_in_codon, nuc_ix] = codon_aa_table[mut_codon_ix]
+    return mut_table
+mutated_codon_aa_table = _mutated_codon_aa_table()
+
+# integer codes for the effect of a single substitution. The names
+# match the variant classification used by get_variant_classification,
+# where an empty string indicates an unknown effect.
+effect_list = ['Silent', 'Missense_Mutation', 'Nonsense_Mutation',
+               'Nonstop_Mutation', 'Translation_Start_Site', 'Splice_Site', '']
+effect2int = dict((e, i) for i, e in enumerate(effect_list))
+effect_array = np.array(effect_list, dtype=object)  # decode integer codes
+silent_int = effect2int['Silent']
+missense_int = effect2int['Missense_Mutation']
+nonsense_int = effect2int['Nonsense_Mutation']
+lost_stop_int = effect2int['Nonstop_Mutation']
+lost_start_int = effect2int['Translation_Start_Site']
+splice_site_int = effect2int['Splice_Site']
+unknown_effect_int = effect2int['']
+
 # global dictionary specifying base pairing
 base_pairing = {'A': 'T',
                 'T': 'A',
@@ -256,6 +320,148 @@ def read_bed(file_path, filtered_genes=[]):
     return bed_dict
 
 
+def group_genes_by_cost(bed_dict, mut_counts, num_processes,
+                        tasks_per_process=8):
+    """Groups genes into tasks of similar computational cost for
+    dynamically scheduling work across processes.
+
+    The cost of a gene is estimated as the number of mutations times the
+    CDS length. Expensive genes become their own task, while cheaper genes
+    are grouped together until the task reaches a target cost.
+
+    Parameters
+    ----------
+    bed_dict : dict
+        dictionary mapping chromosome keys to a list of BED lines
+    mut_counts : pd.Series
+        number of mutations for each gene
+    num_processes : int
+        number of processes that will work on the tasks
+    tasks_per_process : int
+        target number of tasks for each process
+
+    Returns
+    -------
+    task_list : list of lists
+        list of BED lines for each task, ordered by decreasing cost
+    """
+    bed_list = [b for chrom in bed_dict for b in bed_dict[chrom]]
+    if not bed_list:
+        return []
+
+    # estimate cost of each gene, genes without mutations still
+    # require some work
+    gene_cost = [(mut_counts.get(b.gene_name, 0) + 1) * b.cds_len
+                 for b in bed_list]
+    target_cost = float(sum(gene_cost)) / (max(num_processes, 1) * tasks_per_process)
+
+    # group genes in order of decreasing cost
+    task_list, task_cost = [], []
+    tmp_task, tmp_cost = [], 0
+    for ix in sorted(range(len(bed_list)), key=lambda i: gene_cost[i], reverse=True):
+        tmp_task.append(bed_list[ix])
+        tmp_cost += gene_cost[ix]
+        if tmp_cost >= target_cost:
+            task_list.append(tmp_task)
+            task_cost.append(tmp_cost)
+            tmp_task, tmp_cost = [], 0
+    if tmp_task:
+        task_list.append(tmp_task)
+        task_cost.append(tmp_cost)
+
+    # most expensive tasks go first
+    task_order = sorted(range(len(task_list)), key=lambda i: task_cost[i], reverse=True)
+    task_list = [task_list[i] for i in task_order]
+    return task_list
+
+
+def index_mutations_by_gene(mut_df):
+    """Sorts mutations by gene and creates an index of the rows
+    containing each gene's mutations.
+
+    The sort is stable, so the order of mutations within a gene is
+    kept. Looking up a gene with :func:`get_gene_mutations` is then a
+    simple slice, rather than a comparison against every row.
+
+    Parameters
+    ----------
+    mut_df : pd.DataFrame
+        mutations with a "Gene" column
+
+    Returns
+    -------
+    mut_df : pd.DataFrame
+        mutations sorted by gene
+    gene_index : dict
+        maps gene name to the (start, end) rows of its mutations
+    """
+    mut_df = mut_df.sort_values(by='Gene', kind='mergesort')
+    genes = mut_df['Gene'].values
+    num_mut = len(genes)
+    if num_mut:
+        boundaries = np.nonzero(genes[1:] != genes[:-1])[0] + 1
+        starts = np.concatenate([[0], boundaries])
+        ends = np.concatenate([boundaries, [num_mut]])
+        gene_index = dict((genes[s], (s, e)) for s, e in zip(starts, ends))
+    else:
+        gene_index = {}
+    return mut_df, gene_index
+
+
+def get_gene_mutations(mut_df, gene_index, gene_name):
+    """Fetches the mutations for a gene using the index from
+    :func:`index_mutations_by_gene`.
+
+    Parameters
+    ----------
+    mut_df : pd.DataFrame
+        mutations sorted by gene
+    gene_index : dict
+        maps gene name to the (start, end) rows of its mutations
+    gene_name : str
+        gene to fetch mutations for
+
+    Returns
+    -------
+    gene_mut_df : pd.DataFrame
+        mutations for the gene
+    """
+    start, end = gene_index.get(gene_name, (0, 0))
+    gene_mut_df = mut_df.iloc[start:end]
+    return gene_mut_df
+
+
+def select_gene_mutations(mut_df, bed_list, gene_index=None):
+    """Selects only the mutations found in a list of genes.
+
+    Used to send each worker process only the slice of mutations it
+    works on, rather than pickling the entire mutation data frame.
+
+    Parameters
+    ----------
+    mut_df : pd.DataFrame
+        mutations with a "Gene" column
+    bed_list : list of BedLine
+        genes to keep mutations for
+    gene_index : dict or None
+        index of gene mutations from index_mutations_by_gene. The
+        mutations are found by comparing gene names if not provided.
+
+    Returns
+    -------
+    gene_mut_df : pd.DataFrame
+        mutations for the genes in bed_list
+    """
+    gene_names = [b.gene_name for b in bed_list]
+    if gene_index is None:
+        gene_mut_df = mut_df[mut_df['Gene'].isin(gene_names)]
+    else:
+        rows = [np.arange(*gene_index[g]) for g in gene_names if g in gene_index]
+        rows = np.concatenate(rows) if rows else np.array([], dtype=int)
+        gene_mut_df = mut_df.iloc[rows]
+    return gene_mut_df
+
+
 def _fix_mutation_df(mutation_df, only_unique=False):
     """Drops invalid mutations and corrects for 1-based coordinates.
 
@@ -350,6 +556,65 @@ def _get_high_tsg_score(mutation_df, tsg_score_thresh):
     return non_tested_genes
 
 
+def encode_nucs(nucs):
+    """Integer encodes a list of nucleotides (see utils.nuc_list).
+
+    Letters other than A, C, G, T are given the code utils.unknown_nuc_int.
+    """
+    return np.array([nuc2int.get(n, unknown_nuc_int) for n in nucs], dtype=int)
+
+
+def encode_aas(aas):
+    """Integer encodes a list of amino acids (see utils.aa_list).
+
+    Values not in utils.aa_list are given the code utils.unknown_aa_int.
+    """
+    return np.array([aa2int.get(a, unknown_aa_int) for a in aas], dtype=int)
+
+
+def gene_prng(seed, gene_name):
+    """Creates a pseudo random number generator with a stream specific
+    to a gene.
+
+    The stream is derived from the user provided seed and the gene name
+    (as the spawn key of a SeedSequence), so results for a gene do not
+    depend on the order genes are processed or how they are split across
+    processes. The gene name enters as the 128 bits of its sha256 digest,
+    so that streams of different genes do not collide. Versions of numpy
+    without the Generator interface fall back to a RandomState seeded by
+    both the seed and the gene name.
+
+    Parameters
+    ----------
+    seed : int or None
+        seed for the random number generator
+    gene_name : str
+        name of the gene
+
+    Returns
+    -------
+    prng : np.random.Generator or np.random.RandomState
+        random number generator for the gene
+    """
+    gene_digest = hashlib.sha256(gene_name.encode('utf-8')).digest()
+    gene_key = struct.unpack('<4I', gene_digest[:16])
+    if hasattr(np.random, 'Generator'):
+        seed_seq = np.random.SeedSequence(seed, spawn_key=gene_key)
+        prng = np.random.Generator(np.random.PCG64(seed_seq))
+    elif seed is None:
+        prng = np.random.RandomState()
+    else:
+        prng = np.random.RandomState([seed] + list(gene_key))
+    return prng
+
+
+def json_default(obj):
+    """Converts numpy scalars to python types when writing JSON."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('{0} is not JSON serializable'.format(repr(obj)))
+
+
 def codon2aa(codon):
     """Gets corresponding AA for a codon.
 
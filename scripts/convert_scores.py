@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# fix problems with pythons terrible import system
+import sys
+import os
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '../'))
+
+import prob2020.python.scores as scores
+import argparse
+
+
+def parse_arguments():
+    info = ('Converts a directory of per gene score pickle files into a single '
+            'indexed score store, which can be used in place of the score '
+            'directory (--score-dir).')
+    parser = argparse.ArgumentParser(description=info)
+    parser.add_argument('-s', '--score-dir',
+                        type=str, required=True,
+                        help='directory containing MGA entropy and VEST pickle files')
+    parser.add_argument('-o', '--output',
+                        type=str, required=True,
+                        help='output score store file')
+    args = parser.parse_args()
+    return vars(args)
+
+
+def main(opts):
+    scores.write_score_store(opts['score_dir'], opts['output'])
+
+
+if __name__ == "__main__":
+    opts = parse_arguments()
+    main(opts)
@@ -0,0 +1,30 @@
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '..'))
+
+from prob2020.python.bed_line import BedLine
+import prob2020.python.utils as utils
+import numpy as np
+
+
+def test_query_positions():
+    # read in bed lines, including a gene with very short introns
+    bed_list = [b for b in utils.bed_generator(os.path.join(file_dir, 'data/CTNNB1.bed'))]
+    bed_list.append(BedLine('chr1\t100\t200\tFAKE\t0\t+\t100\t200\t0\t4\t10,1,5,20,\t0,11,13,20,'))
+
+    for bed in bed_list:
+        # query all positions around exons
+        coords = np.concatenate([np.arange(estart-4, estart+4) for estart, eend in bed.exons] +
+                                [np.arange(eend-4, eend+4) for estart, eend in bed.exons])
+        for strand in ['+', '-']:
+            pos = bed.query_positions(strand, [bed.chrom]*len(coords), coords)
+            for i, coord in enumerate(coords):
+                true_pos = bed.query_position(strand, bed.chrom, coord)
+                true_pos = -1 if true_pos is None else true_pos
+                assert pos[i] == true_pos, 'Position {0} mapped incorrectly'.format(coord)
+
+    # missing coordinates are not mapped
+    pos = bed_list[0].query_positions('+', ['chr3'], [np.nan])
+    assert pos[0] == -1
@@ -41,3 +41,31 @@ def test_pos_to_codon():
         results.append(codon_info)
     true_results = [('ACA', 0, 1, 'C'), ('GAT', 4, 0, 'G'), ('CCG', 5, 2, 'G')]
     assert results == true_results, 'Codon information is incorrect'
+
+
+def test_int_encoded_seq():
+    gs = GeneSequence(gene_fa, nuc_context=1)
+    gs.set_gene(bed)
+
+    # check nucleotide encoding of the coding sequence
+    cds_len = len(gs.exon_seq)
+    nucs = ''.join(utils.nuc_array[gs.nuc_array[:cds_len]])
+    assert nucs == gs.exon_seq, 'Integer encoded sequence is not correct'
+
+    # check codon information matches pos_to_codon
+    for pos in [1, 12, 17]:
+        _, codon_pos, pos_in_codon, _ = cutils.pos_to_codon(gs, pos)
+        assert gs.codon_pos_array[pos] == codon_pos
+        assert gs.pos_in_codon_array[pos] == pos_in_codon
+
+    # check reference and mutated amino acids
+    ref_aa = ''.join(utils.aa_array[gs.ref_aa_array[:cds_len:3]])
+    assert ref_aa == utils.translate_seq(gs.exon_seq), 'Reference AA are not correct'
+    mut_aa = utils.aa_array[gs.somatic_aa_array[1, utils.nuc2int['T']]]
+    assert mut_aa == 'I', 'ACA should become ATA ({0})'.format(mut_aa)
+
+    # unknown nucleotides only allow an AA if they are mutated
+    gs.add_germline_variants(['N'], [20])
+    assert utils.aa_array[gs.ref_aa_array[20]] is None
+    assert utils.aa_array[gs.somatic_aa_array[19, utils.nuc2int['A']]] is None
+    assert utils.aa_array[gs.somatic_aa_array[20, utils.nuc2int['A']]] == 'K'
@@ -8,7 +8,12 @@ sys.path.append(os.path.join(file_dir, '..'))
 import prob2020.console.randomization_test as pt
 import prob2020.python.utils as utils
 import prob2020.python.mutation_context as mc
+import prob2020.python.scores as scores
+import prob2020.python.permutation as pm
+import prob2020.python.journal as journal
+import prob2020.cython.cutils as cutils
 import numpy as np
+import json
 
 
 def test_ctnnb1_main():
@@ -70,6 +75,86 @@ def test_ctnnb1_get_aa_mut_info():
     assert aa_info['Codon Pos'][0] == 0, 'Start codon should be position 0'
 
 
+
+def test_ctnnb1_get_aa_mut_info_batch():
+    import pysam
+    from prob2020.python.gene_sequence import GeneSequence
+
+    # read fasta
+    ctnnb1_fasta = os.path.join(file_dir, 'data/CTNNB1.fa')
+    gene_fa = pysam.Fastafile(ctnnb1_fasta)
+    gs = GeneSequence(gene_fa, nuc_context=1)
+
+    # read CTNNB1 bed file
+    ctnnb1_bed = os.path.join(file_dir, 'data/CTNNB1.bed')
+    bed_list = [b for b in utils.bed_generator(ctnnb1_bed)]
+    gs.set_gene(bed_list[0])
+
+    # random positions, including splice sites
+    prng = np.random.RandomState(101)
+    seq_len = gs.bed.cds_len + len(gs.bed.pos2ss)
+    coding_pos = prng.randint(0, seq_len, size=(20, 50))
+    somatic_base = list(prng.choice(list('ACGT'), size=50))
+
+    # batch results should match mutation info for each permutation
+    batch_info = mc.get_aa_mut_info_batch(coding_pos, somatic_base, gs)
+    base_ix = utils.encode_nucs(somatic_base)
+    del_ct = cutils.calc_deleterious_info_batch(gs.effect_array, coding_pos, base_ix)
+    non_silent_ct = cutils.calc_non_silent_info_batch(gs.effect_array, coding_pos, base_ix)
+    var_class = cutils.get_variant_classification_batch(gs.effect_array, coding_pos, base_ix)
+    effect_info = pm._calc_effect_info_batch(batch_info)
+    score_dir = os.path.join(file_dir, 'data/scores')
+    vest_dict = scores.read_vest_pickle('CTNNB1', score_dir)
+    vest_stat = scores.compute_vest_stat_batch(scores.read_vest_array('CTNNB1', score_dir),
+                                               batch_info['Reference AA'],
+                                               batch_info['Somatic AA'],
+                                               batch_info['Codon Pos'])
+    for i, row in enumerate(coding_pos):
+        aa_info = mc.get_aa_mut_info(row, somatic_base, gs)
+        decoded_info = mc.decode_aa_mut_info(batch_info, i)
+        for k in ['Codon Pos', 'Reference Nuc', 'Reference AA', 'Somatic AA']:
+            assert decoded_info[k] == aa_info[k], '{0} differs for the batch version'.format(k)
+
+        # check the mutation effect table
+        aa_args = (aa_info['Reference AA'], aa_info['Somatic AA'], aa_info['Codon Pos'])
+        assert del_ct[i] == cutils.calc_deleterious_info(*aa_args)
+        assert non_silent_ct[i].tolist() == cutils.calc_non_silent_info(*aa_args)
+        assert var_class[i].tolist() == cutils.get_variant_classification(*aa_args)
+
+        # check the effect statistics
+        tmp_effect_info = cutils.calc_effect_info(aa_info['Codon Pos'],
+                                                  aa_info['Reference AA'],
+                                                  aa_info['Somatic AA'],
+                                                  is_obs=0)
+        assert abs(effect_info[0][i] - tmp_effect_info[0]) < 1e-10, 'Effect entropy differs'
+        assert effect_info[1][i] == tmp_effect_info[1], 'Recurrent count differs'
+        assert effect_info[2][i] == tmp_effect_info[2], 'Inactivating count differs'
+
+        # check the dense vest scores
+        tmp_vest = scores.compute_vest_stat(vest_dict, *aa_args)
+        assert abs(vest_stat[i] - tmp_vest) < 1e-6, 'VEST score differs'
+
+
+def test_calc_pos_info_batch():
+    # few codon positions so that recurrent positions are common
+    prng = np.random.RandomState(101)
+    codon_pos = prng.randint(0, 6, size=(30, 12))
+    missense_mask = (prng.random_sample((30, 12)) < .8).astype(np.uint8)
+    params = [{'pseudo_count': 0, 'is_obs': 0},
+              {'pseudo_count': 3, 'is_obs': 0},
+              {'pseudo_count': 0, 'is_obs': 1, 'min_frac': .2, 'min_recur': 3}]
+    for kwargs in params:
+        recur, ent, delta_ent = cutils.calc_pos_info_batch(codon_pos, missense_mask, **kwargs)
+        for i in range(len(codon_pos)):
+            # silent mutations are not missense
+            somatic_aa = ['C' if m else 'A' for m in missense_mask[i]]
+            tmp_info = cutils.calc_pos_info(codon_pos[i].tolist(),
+                                            ['A']*len(somatic_aa),
+                                            somatic_aa, **kwargs)
+            assert recur[i] == tmp_info[0], 'Recurrent counts differ'
+            assert abs(ent[i] - tmp_info[1]) < 1e-10, 'Entropy differs'
+            assert abs(delta_ent[i] - tmp_info[2]) < 1e-10, 'Delta entropy differs'
+
 def test_100genes_main():
     opts = {'input': os.path.join(file_dir, 'data/100genes.fa'),
             'bed': os.path.join(file_dir, 'data/100genes.bed'),
@@ -111,5 +196,285 @@ def test_100genes_main():
     assert num_ent_sig < 9, 'Few of the 100 test genes should not be significant ({0})'.format(num_ent_sig)
 
 
+def test_growing_batch_sizes():
+    import prob2020.python.permutation as pm
+    sizes = list(pm._growing_batch_sizes(10000, 2500, min_batch=100))
+    assert sizes == [100, 200, 400, 800, 1600, 2500, 2500, 1900]
+    assert sum(pm._growing_batch_sizes(50, 25000)) == 50
+
+
+def test_duplicate_gene_names():
+    import copy
+    import pandas as pd
+    opts = {'input': os.path.join(file_dir, 'data/100genes.fa'),
+            'context': 1,
+            'recurrent': 3,
+            'fraction': .02,
+            'use_unmapped': False,
+            'processes': 0,
+            'num_iterations': 200,
+            'stop_criteria': 100,
+            'score_dir': os.path.join(file_dir, 'data/scores'),
+            'seed': 101,
+            'kind': 'oncogene'}
+    mut_df = pd.read_csv(os.path.join(file_dir, 'data/100genes_mutations.txt'), sep='\t')
+    mut_df = mut_df.rename(columns={'Hugo_Symbol': 'Gene',
+                                    'Tumor_Sample_Barcode': 'Tumor_Sample',
+                                    'Tumor_Seq_Allele2': 'Tumor_Allele'})
+
+    # repeat the first BED line of a chromosome at its end
+    bed_dict = utils.read_bed(os.path.join(file_dir, 'data/100genes.bed'))
+    chrom = list(bed_dict)[0]
+    bed_dict[chrom].append(copy.copy(bed_dict[chrom][0]))
+    gene_order = [b.gene_name for c in bed_dict for b in bed_dict[c]]
+
+    # results should follow the BED lines, even for repeated gene names
+    for num_processes in [0, 2]:
+        opts['processes'] = num_processes
+        result = pt.multiprocess_permutation(bed_dict, mut_df, opts)
+        assert [r[0] for r in result] == gene_order
+        assert result[0] == result[len(bed_dict[chrom])-1]
+
+
+def test_resume_from_journal():
+    opts = {'input': os.path.join(file_dir, 'data/100genes.fa'),
+            'bed': os.path.join(file_dir, 'data/100genes.bed'),
+            'mutations': os.path.join(file_dir, 'data/100genes_mutations.txt'),
+            'output': os.path.join(file_dir, 'output/100genes_resume_output.txt'),
+            'context': 1,
+            'tsg_score': .1,
+            'recurrent': 3,
+            'fraction': .02,
+            'use_unmapped': False,
+            'processes': 0,
+            'num_iterations': 200,
+            'stop_criteria': 100,
+            'score_dir': os.path.join(file_dir, 'data/scores'),
+            'recurrent_pseudo_count': 0,
+            'unique': False,
+            'seed': 101,
+            'kind': 'oncogene'}
+    full_result = pt.main(opts)
+    journal_file = opts['output'] + '.journal'
+    assert not os.path.exists(journal_file), 'Journal should only be kept if requested'
+
+    # the journal should be kept if the output can not be written
+    opts.update({'journal': True, 'journal_file': journal_file,
+                 'output': os.path.join(file_dir, 'output/missing_dir/100genes_resume_output.txt')})
+    try:
+        pt.main(opts)
+        assert False, 'Writing the output should fail'
+    except (IOError, OSError):
+        pass
+    _, journal_rows = journal.read_journal(journal_file)
+    assert sorted(r[0] for r in journal_rows) == sorted(full_result['gene'])
+    os.remove(journal_file)
+    opts.update({'journal': False, 'journal_file': None, 'output': journal_file[:-len('.journal')]})
+
+    # write a journal of an interrupted run, with an incomplete last line
+    cols = ['gene', 'num recurrent', 'position entropy', 'mean vest score',
+            'entropy p-value', 'vest p-value', 'Total Mutations', 'Unmapped to Ref Tx']
+    rows = full_result[cols].head(30).values.tolist()
+    rows[0][4] = 0.123  # mark a journaled gene
+    journal.start_journal(journal_file, opts)
+    with open(journal_file, 'a') as handle:
+        for row in rows:
+            journal.write_row(handle, row)
+        handle.write('["{0}", 1, 0.'.format(full_result['gene'].iloc[30]))
+
+    # resumed run should reuse the journal and otherwise match
+    opts['resume'] = True
+    resume_result = pt.main(opts)
+    assert not os.path.exists(journal_file)
+    assert resume_result['gene'].tolist() == full_result['gene'].tolist()
+    assert resume_result['entropy p-value'].iloc[0] == 0.123
+    diff_pval = resume_result['entropy p-value'] != full_result['entropy p-value']
+    assert diff_pval.sum() == 1
+    assert (resume_result['vest p-value'] == full_result['vest p-value']).all()
+
+    # options affecting the results should match to resume
+    for k, v in [('num_iterations', 100), ('null_store', '/tmp/null_store')]:
+        journal.start_journal(journal_file, opts)
+        old_val, opts[k] = opts.get(k), v
+        try:
+            journal.start_journal(journal_file, opts, resume=True)
+            assert False, 'Resuming with different options should fail'
+        except ValueError:
+            pass
+        opts[k] = old_val
+    os.remove(journal_file)
+
+
+def test_result_cache():
+    import shutil
+    import tempfile
+    cache_dir = tempfile.mkdtemp()
+    opts = {'input': os.path.join(file_dir, 'data/CTNNB1.fa'),
+            'bed': os.path.join(file_dir, 'data/CTNNB1.bed'),
+            'mutations': os.path.join(file_dir, 'data/CTNNB1_mutations.txt'),
+            'output': '',
+            'context': 1,
+            'tsg_score': .1,
+            'recurrent': 3,
+            'fraction': .02,
+            'use_unmapped': False,
+            'processes': 0,
+            'num_iterations': 200,
+            'stop_criteria': 100,
+            'score_dir': os.path.join(file_dir, 'data/scores'),
+            'recurrent_pseudo_count': 0,
+            'unique': False,
+            'seed': 101,
+            'kind': 'oncogene',
+            'cache_dir': cache_dir}
+    try:
+        result = pt.main(opts)
+        cache_files = [os.path.join(d, f) for d, _, fs in os.walk(cache_dir) for f in fs]
+        assert len(cache_files) == len(result)
+
+        # mark a cached result, which should then be reused
+        gene = result['gene'].iloc[0]
+        for f in cache_files:
+            with open(f) as handle:
+                row = json.load(handle)
+            if row[0] == gene:
+                row[4] = 0.123
+                with open(f, 'w') as handle:
+                    json.dump(row, handle)
+        cached_result = pt.main(opts)
+        assert cached_result['entropy p-value'].iloc[0] == 0.123
+        same_cols = ['gene', 'num recurrent', 'position entropy', 'vest p-value']
+        assert (cached_result[same_cols] == result[same_cols]).all().all()
+
+        # different options should not use the cached results
+        opts['seed'] = 102
+        new_result = pt.main(opts)
+        assert new_result['entropy p-value'].iloc[0] != 0.123
+
+        # results without a seed should not be cached
+        num_cache_files = sum(len(fs) for _, _, fs in os.walk(cache_dir))
+        opts['seed'] = None
+        pt.main(opts)
+        assert sum(len(fs) for _, _, fs in os.walk(cache_dir)) == num_cache_files
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_null_store():
+    import shutil
+    import tempfile
+    import pysam
+    import pandas as pd
+    from prob2020.python.gene_sequence import GeneSequence
+    from prob2020.python.sequence_context import SequenceContext
+    from prob2020.python.null_store import NullStore
+
+    # set up CTNNB1 gene sequence
+    gene_fa = pysam.Fastafile(os.path.join(file_dir, 'data/CTNNB1.fa'))
+    gs = GeneSequence(gene_fa, nuc_context=1)
+    bed_list = [b for b in utils.bed_generator(os.path.join(file_dir, 'data/CTNNB1.bed'))]
+    gs.set_gene(bed_list[0])
+    context_cts = pd.Series([3, 2], index=['C', 'A'])
+    context_to_mut = {'A': ['G', 'T'], 'C': ['T', 'A', 'T']}
+    obs_stat = (0, 1.0, 0, 0.0)
+
+    store_dir = tempfile.mkdtemp()
+    try:
+        store = NullStore(store_dir)
+        ent_pval, vest_pval = pm.position_permutation(obs_stat, context_cts, context_to_mut,
+                                                      SequenceContext(gs, seed=101), gs,
+                                                      num_permutations=300, stop_criteria=1000,
+                                                      null_store=store)
+        store_files = [os.path.join(d, f) for d, _, fs in os.walk(store_dir) for f in fs]
+        assert len(store_files) == 1
+
+        # the same signature in a different order should reuse the stored null
+        other_order = {'A': ['T', 'G'], 'C': ['T', 'T', 'A']}
+        os.utime(store_files[0], (0, 0))
+        result = pm.position_permutation(obs_stat, context_cts.sort_index(), other_order,
+                                         SequenceContext(gs, seed=101), gs,
+                                         num_permutations=300, stop_criteria=1000,
+                                         null_store=store)
+        assert result == (ent_pval, vest_pval)
+        assert os.stat(store_files[0]).st_mtime > 0, 'Store hit should mark entry as used'
+
+        # extending a stored null gives the same result as simulating it at once
+        ext_result = pm.position_permutation(obs_stat, context_cts, context_to_mut,
+                                             SequenceContext(gs, seed=101), gs,
+                                             num_permutations=1000, stop_criteria=1000,
+                                             null_store=store)
+        new_store = NullStore(os.path.join(store_dir, 'new'))
+        new_result = pm.position_permutation(obs_stat, context_cts, context_to_mut,
+                                             SequenceContext(gs, seed=101), gs,
+                                             num_permutations=1000, stop_criteria=1000,
+                                             null_store=new_store)
+        assert ext_result == new_result
+        shutil.rmtree(os.path.join(store_dir, 'new'))
+
+        # least recently used nulls are evicted once the size cap is exceeded
+        store.max_size = os.stat(store_files[0]).st_size / (1024. * 1024)
+        del_pval = pm.deleterious_permutation(1, context_cts, context_to_mut,
+                                              SequenceContext(gs, seed=101), gs,
+                                              num_permutations=1000, stop_criteria=1000,
+                                              null_store=store)
+        new_files = [os.path.join(d, f) for d, _, fs in os.walk(store_dir) for f in fs]
+        assert len(new_files) == 1 and new_files != store_files
+        assert store.total_size == os.stat(new_files[0]).st_size
+
+        # a later run should reuse the remaining null without simulating
+        def no_simulation(*args):
+            raise AssertionError('Null distribution should be reused from the store')
+        sc = SequenceContext(gs, seed=101)
+        sc.random_pos = no_simulation
+        rerun_store = NullStore(store_dir, max_size=store.max_size)
+        assert rerun_store.total_size == store.total_size
+        rerun_pval = pm.deleterious_permutation(1, context_cts, context_to_mut, sc, gs,
+                                                num_permutations=1000, stop_criteria=1000,
+                                                null_store=rerun_store)
+        assert rerun_pval == del_pval
+    finally:
+        gene_fa.close()
+        shutil.rmtree(store_dir)
+
+
+def test_protein_permutation():
+    import pysam
+    import pandas as pd
+    from prob2020.python.gene_sequence import GeneSequence
+    from prob2020.python.sequence_context import SequenceContext
+
+    # set up CTNNB1 gene sequence
+    gene_fa = pysam.Fastafile(os.path.join(file_dir, 'data/CTNNB1.fa'))
+    gs = GeneSequence(gene_fa, nuc_context=1)
+    bed_list = [b for b in utils.bed_generator(os.path.join(file_dir, 'data/CTNNB1.bed'))]
+    gs.set_gene(bed_list[0])
+    context_cts = pd.Series([6, 4], index=['C', 'G'])
+    context_to_mut = {'C': ['T', 'T', 'T', 'T', 'A', 'A'], 'G': ['A', 'A', 'T', 'C']}
+
+    # chain graph where each codon neighbors the adjacent codons
+    num_codons = bed_list[0].cds_len // 3 + 1
+    gene_graph = dict((i, set([j for j in [i-1, i+1] if 0 <= j < num_codons]))
+                      for i in range(num_codons))
+    graph_matrix = scores.neighbor_graph_to_csr(gene_graph)
+
+    # p-values depend on the random number generator available
+    clustered_ct = {32: 3, 33: 2, 34: 1, 41: 2}
+    spread_ct = {5: 1, 100: 1, 200: 2, 300: 1, 400: 1, 500: 1, 600: 1, 700: 1}
+    expected_pvals = {'RandomState': [0.0, 0.1466275659824047],
+                      'Generator': [0.0, 0.14285714285714285]}
+    try:
+        for pos_ct, max_batch in [(clustered_ct, 25000), (spread_ct, 25000), (spread_ct, 150)]:
+            sc = SequenceContext(gs, seed=101)
+            expected = expected_pvals[type(sc.prng).__name__][pos_ct is spread_ct]
+            graph_score, _ = scores.compute_ng_stat(gene_graph, pos_ct)
+            pval, _ = pm.protein_permutation(graph_score, len(pos_ct), context_cts,
+                                             context_to_mut, sc, gs, graph_matrix,
+                                             num_permutations=1000, stop_criteria=100,
+                                             max_batch=max_batch)
+            assert abs(pval - expected) < 1e-12, 'Protein p-value changed ({0} != {1})'.format(pval, expected)
+    finally:
+        gene_fa.close()
+
+
 if __name__ == '__main__':
     test_100genes_main()
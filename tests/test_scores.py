@@ -0,0 +1,93 @@
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '..'))
+
+# useful imports
+import prob2020.python.scores as scores
+import prob2020.python.utils as utils
+import numpy as np
+
+score_dir = os.path.join(file_dir, 'data/scores')
+
+
+def test_score_store():
+    # write a small score store
+    genes = ['CTNNB1', 'A1CF', 'NOT_A_GENE']
+    store_path = os.path.join(file_dir, 'output/scores.store')
+    scores.write_score_store(score_dir, store_path, gene_names=genes)
+
+    # scores should match the pickle files
+    store = scores.ScoreStore(store_path)
+    for gene in genes:
+        mga_ent, vest_dict = scores.load_gene_scores(gene, score_dir)
+        store_mga = store.read_mga(gene)
+        if mga_ent is None:
+            assert store_mga is None, 'Missing MGA entropy scores for {0}'.format(gene)
+        else:
+            assert np.array_equal(store_mga, mga_ent), 'MGA entropy differs for {0}'.format(gene)
+        assert store.read_vest(gene) == vest_dict, 'VEST scores differ for {0}'.format(gene)
+
+    # the score store can be used in place of the score directory
+    codon_pos, ref_aa, somatic_aa = [31, 32, 40], ['D', 'S', 'T'], ['N', 'F', 'I']
+    dir_result = scores.retrieve_scores('CTNNB1', score_dir, codon_pos, ref_aa, somatic_aa)
+    store_result = scores.retrieve_scores('CTNNB1', store_path, codon_pos, ref_aa, somatic_aa)
+    assert dir_result == store_result, 'Score store results differ'
+
+
+def test_load_vest_array():
+    # dense arrays should be built once and shared
+    vest_array = scores.load_vest_array('CTNNB1', score_dir)
+    assert scores.load_vest_array('CTNNB1', score_dir) is vest_array
+    assert not vest_array.flags.writeable
+    vest_dict = scores.load_gene_scores('CTNNB1', score_dir)[1]
+    assert np.array_equal(vest_array, scores.vest_dict_to_array(vest_dict))
+    assert scores.load_vest_array('NOT_A_GENE', score_dir) is None
+
+    # least recently used arrays are dropped
+    cache_size = scores.vest_array_cache_size
+    scores.vest_array_cache_size = 2
+    try:
+        for gene in ['A1BG', 'A1CF', 'A2M']:
+            scores.load_vest_array(gene, score_dir, dtype=np.float64)
+        cached_genes = [k[1] for k in scores._vest_array_cache]
+        assert cached_genes == ['A1CF', 'A2M']
+    finally:
+        scores.vest_array_cache_size = cache_size
+
+
+def test_vest_dict_to_array():
+    vest_dict = {1: {'M': {'K': .5}}, 3: {'A': {'*': .25}},
+                 0: {'A': {'C': .75}}, -2: {'A': {'C': 1.}}}
+    vest_array = scores.vest_dict_to_array(vest_dict)
+    assert vest_array.shape[0] == 3
+    assert vest_array[0, utils.aa2int['M'], utils.aa2int['K']] == .5
+    assert vest_array[2, utils.aa2int['A'], utils.aa2int['*']] == .25
+
+    # invalid codon positions should not wrap around to the last codons
+    assert vest_array.sum() == .75
+
+
+def test_compute_ng_stat_batch():
+    # chain graph where each codon neighbors the adjacent codons
+    num_codons = 30
+    gene_graph = dict((i, set([j for j in [i-1, i+1] if 0 <= j < num_codons]))
+                      for i in range(num_codons))
+    graph_matrix = scores.neighbor_graph_to_csr(gene_graph)
+
+    prng = np.random.RandomState(101)
+    codon_pos = prng.randint(0, num_codons, size=(20, 8))
+    missense_mask = (prng.random_sample((20, 8)) < .7).astype(np.uint8)
+    missense_mask[0] = 0  # no missense mutations
+    graph_score, coverage, num_mut_codons = scores.compute_ng_stat_batch(graph_matrix,
+                                                                         codon_pos,
+                                                                         missense_mask)
+    for i in range(len(codon_pos)):
+        pos_ct = {}
+        for pos in codon_pos[i][missense_mask[i]>0]:
+            pos_ct[pos] = pos_ct.get(pos, 0) + 1
+        tmp_score, tmp_coverage = scores.compute_ng_stat(gene_graph, pos_ct)
+        assert abs(graph_score[i] - tmp_score) < 1e-10, 'Graph score differs'
+        assert coverage[i] == tmp_coverage, 'Coverage differs'
+        assert num_mut_codons[i] == len(pos_ct), 'Number of mutated codons differs'
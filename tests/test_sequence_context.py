@@ -77,6 +77,32 @@ def test_no_context_constructor():
     _check_true_context_pos(sc, true_ctxt2pos)
 
 
+def test_random_pos():
+    gs = GeneSequence(gene_fa, nuc_context=1)
+    gs.set_gene(bed)
+    sc = SequenceContext(gs, seed=101)
+    ctxt_counts = [('A', 3), ('G', 2)]
+    rand_pos = sc.random_pos(ctxt_counts, 50)
+    assert rand_pos.shape == (50, 5), 'Wrong number of random positions'
+
+    # sampled positions should respect sequence context
+    for j, letter in enumerate(['A']*3 + ['G']*2):
+        assert all(sc.pos2context[p] == letter for p in rand_pos[:, j])
+
+    # same seed should produce the same positions
+    sc2 = SequenceContext(gs, seed=101)
+    assert (sc2.random_pos(ctxt_counts, 50) == rand_pos).all(), 'Not reproducible'
+
+
+def test_gene_prng():
+    # streams depend only on the seed and gene name
+    tp53 = utils.gene_prng(101, 'TP53').standard_normal(10)
+    tp53_again = utils.gene_prng(101, 'TP53').standard_normal(10)
+    kras = utils.gene_prng(101, 'KRAS').standard_normal(10)
+    assert (tp53 == tp53_again).all(), 'Gene stream is not reproducible'
+    assert not (tp53 == kras).all(), 'Genes should have different streams'
+
+
 def _check_true_counts(seq_context, true_counts):
     for letter in true_counts:
         true_ct = true_counts[letter]
@@ -89,4 +115,4 @@ def _check_true_context_pos(seq_context, true_context_pos):
         assert_msg = 'Context positions don\'t match ({0}: {1} != {2})'.format(letter,
                                                                                true_context_pos[letter],
                                                                                seq_context.context2pos[letter])
-        assert true_context_pos[letter] == seq_context.context2pos[letter], assert_msg
+        assert list(true_context_pos[letter]) == list(seq_context.context2pos[letter]), assert_msg
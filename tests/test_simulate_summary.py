@@ -5,6 +5,15 @@ file_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(file_dir, '../'))
 
 import prob2020.console.annotate as sm
+import prob2020.console.simulate_non_silent_ratio as snsr
+import prob2020.python.mutation_context as mc
+import prob2020.python.mymath as mymath
+import prob2020.python.permutation as pm
+import prob2020.python.indel as indel
+import prob2020.python.utils as utils
+from prob2020.python.sequence_context import SequenceContext
+import pandas as pd
+import numpy as np
 
 def test_sim_summary():
     opts = {'input': os.path.join(file_dir, 'data/sim_summary.fa'),
@@ -32,5 +41,163 @@ def test_sim_summary():
     sm.main(opts)
 
 
+def test_missense_position_entropy_batch():
+    prng = np.random.RandomState(101)
+    codon_pos = prng.randint(0, 8, size=(25, 15))
+    missense_mask = (prng.random_sample((25, 15)) < .7).astype(np.uint8)
+    missense_mask[3] = 0
+    num_singles = prng.randint(0, 4, size=25)
+    fs_cts = prng.randint(0, 3, size=25)
+
+    pos_ct, offsets = mc.count_missense_positions(codon_pos, missense_mask)
+    pos_row_ix = np.repeat(np.arange(25), np.diff(offsets))
+    ent = mymath.normalized_mutation_entropy_batch(pos_ct, pos_row_ix,
+                                                   num_singles, [fs_cts])
+    for i in range(len(codon_pos)):
+        tmp_pos = codon_pos[i][missense_mask[i] > 0]
+        tmp_ct = np.bincount(tmp_pos)
+        tmp_ct = tmp_ct[tmp_ct > 0]
+        assert pos_ct[offsets[i]:offsets[i+1]].tolist() == tmp_ct.tolist()
+        tmp_ent = mymath.normalized_mutation_entropy(tmp_ct.tolist() + [1]*num_singles[i] + [fs_cts[i]])
+        assert abs(ent[i] - tmp_ent) < 1e-10, 'Normalized entropy differs'
+
+
+def test_maf_permutation_blocks():
+    import pysam
+    from prob2020.python.gene_sequence import GeneSequence
+
+    # set up CTNNB1 gene sequence
+    gene_fa = pysam.Fastafile(os.path.join(file_dir, 'data/CTNNB1.fa'))
+    gs = GeneSequence(gene_fa, nuc_context=1)
+    bed_list = [b for b in utils.bed_generator(os.path.join(file_dir, 'data/CTNNB1.bed'))]
+    gs.set_gene(bed_list[0])
+    context_cts = pd.Series([2, 3], index=['A', 'C'])
+    context_to_mut = {'A': ['G', 'T'], 'C': ['T', 'T', 'A']}
+
+    # blocks should concatenate to the same lines as a single batch
+    maf_list = pm.maf_permutation(context_cts, context_to_mut,
+                                  SequenceContext(gs, seed=101), gs, 20)
+    maf_blocks = list(pm.maf_permutation_blocks(context_cts, context_to_mut,
+                                                SequenceContext(gs, seed=101), gs, 20,
+                                                max_rows=15))
+    assert len(maf_list) == 20*5
+    assert [len(b) for b in maf_blocks] == [15]*6 + [10]
+    assert maf_list == [line for b in maf_blocks for line in b]
+
+
+def test_add_sample_counts():
+    import pysam
+    import prob2020.cython.cutils as cutils
+    from prob2020.python.gene_sequence import GeneSequence
+
+    # get CTNNB1 mutations
+    gene_fa = pysam.Fastafile(os.path.join(file_dir, 'data/CTNNB1.fa'))
+    gs = GeneSequence(gene_fa, nuc_context=1)
+    bed = [b for b in utils.bed_generator(os.path.join(file_dir, 'data/CTNNB1.bed'))][0]
+    mut_df = pd.read_csv(os.path.join(file_dir, 'data/CTNNB1_mutations.txt'), sep='\t')
+    mut_df = utils._fix_mutation_df(mut_df)
+    opts = {'use_unmapped': False, 'genome': '', 'seed': 101}
+    gene_tuple = mc.compute_mutation_context(bed, gs, mut_df, opts)
+    mutations_df = gene_tuple[2]
+    aa_info = mc.get_aa_mut_info(mutations_df['Coding Position'],
+                                 mutations_df['Tumor_Allele'].tolist(), gs)
+
+    # compare to the summary of each sample on its own
+    score_dir = os.path.join(file_dir, 'data/scores')
+    uniq_samp = pd.Index(mutations_df['Tumor_Sample'].unique())
+    samp_ix = uniq_samp.get_indexer(mutations_df['Tumor_Sample'])
+    obs_array = np.zeros((len(uniq_samp), 9))
+    snsr._add_sample_counts(obs_array, samp_ix, aa_info, 'CTNNB1', score_dir)
+    for i in range(len(uniq_samp)):
+        ixs = np.nonzero(samp_ix == i)[0]
+        tmp_result = cutils.calc_summary_info([aa_info['Reference AA'][j] for j in ixs],
+                                              [aa_info['Somatic AA'][j] for j in ixs],
+                                              [aa_info['Codon Pos'][j] for j in ixs],
+                                              'CTNNB1', score_dir)
+        expected = tmp_result[:7] + tmp_result[9:11]
+        assert np.allclose(obs_array[i], expected), 'Sample counts differ'
+
+
+def test_simulate_indel_counts():
+    bed_dict = utils.read_bed(os.path.join(file_dir, 'data/100genes.bed'), [])
+    indel_df = pd.DataFrame({'indel len': [1, 2, 3, 4, 6, 7, 9, 10]})
+    fs_cts, inframe_cts, gene_names = indel.simulate_indel_counts(indel_df, bed_dict,
+                                                                  num_permutations=2000,
+                                                                  seed=101)
+    assert fs_cts.shape == inframe_cts.shape == (2000, len(gene_names))
+    assert (fs_cts.sum(axis=1) == 5).all()
+    assert (inframe_cts.sum(axis=1) == 3).all()
+
+    # indels should be assigned proportional to gene length
+    gene_len = np.array([b.cds_len for chrom in bed_dict for b in bed_dict[chrom]])
+    gene_prob = gene_len / float(gene_len.sum())
+    fs_prob = fs_cts.sum(axis=0) / (5. * 2000)
+    assert np.abs(fs_prob - gene_prob).max() < .01
+
+    # same seed should give the same result
+    fs_cts2, inframe_cts2, _ = indel.simulate_indel_counts(indel_df, bed_dict,
+                                                           num_permutations=2000,
+                                                           seed=101)
+    assert (fs_cts == fs_cts2).all() and (inframe_cts == inframe_cts2).all()
+
+
+def test_simulate_indel_maf():
+    bed_dict = utils.read_bed(os.path.join(file_dir, 'data/100genes.bed'), [])
+    name2bed = dict((b.gene_name, b) for chrom in bed_dict for b in bed_dict[chrom])
+    indel_df = pd.DataFrame({'indel len': [1, 2, 3, 6, 10],
+                             'indel type': ['INS', 'DEL', 'DEL', 'INS', 'DEL']})
+    maf_blocks = list(indel.simulate_indel_maf(indel_df, bed_dict, num_permutations=7,
+                                               seed=101, max_rows=10))
+    assert [len(b) for b in maf_blocks] == [10, 10, 10, 5]
+
+    # same seed should give the same lines
+    maf_lines = [l for b in maf_blocks for l in b]
+    maf_lines2 = [l for b in indel.simulate_indel_maf(indel_df, bed_dict, num_permutations=7,
+                                                      seed=101)
+                  for l in b]
+    assert maf_lines == maf_lines2
+
+    # check coordinates match the position in the coding sequence
+    for line in maf_lines:
+        mybed = name2bed[line[0]]
+        pos = int(line[8][2:].split('_')[0])
+        if line[10].endswith('Ins'):
+            assert line[3] == mybed.seqpos_to_genome(pos)
+        else:
+            assert line[3] == mybed.seqpos_to_genome(pos) + 1
+            assert line[4] - line[3] + 1 == len(line[5])
+
+
+def test_annotate_observed_maf():
+    opts = {'input': os.path.join(file_dir, 'data/100genes.fa'),
+            'mutations': os.path.join(file_dir, 'data/100genes_mutations.txt'),
+            'bed': os.path.join(file_dir, 'data/100genes.bed'),
+            'processes': 0,
+            'num_iterations': 0,
+            'context': 1.5,
+            'summary': False,
+            'maf': True,
+            'unique': True,
+            'use_unmapped': False,
+            'genome': '',
+            'score_dir': None,
+            'fraction': .02,
+            'recurrent': 3,
+            'seed': 101,
+            'output': os.path.join(file_dir, 'output/100genes_observed_maf.txt')
+            }
+    sm.main(opts)
+
+    # observed missense mutations should be annotated at their original
+    # genome position
+    maf_df = pd.read_csv(opts['output'], sep='\t')
+    mut_df = pd.read_csv(opts['mutations'], sep='\t')
+    assert len(maf_df) > 0, 'No mutations were annotated'
+    is_missense = maf_df['Variant_Classification'] == 'Missense_Mutation'
+    missense_df = maf_df[is_missense]
+    assert len(missense_df) > 0
+    assert missense_df['Start_Position'].isin(mut_df['Start_Position']).all()
+
+
 if __name__ == '__main__':
     test_sim_summary()